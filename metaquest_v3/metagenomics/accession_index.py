@@ -0,0 +1,238 @@
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from .config import *
+from .utils import exclusive_build, replace_directory
+
+_build_lock = threading.Lock()
+
+
+def normalize_accession(seqid):
+    """
+    Accession of a DIAMOND/BLAST subject ID: 'ref|WP_000001.1|',
+    'gi|123|ref|WP_000001.1|' and 'sp|P0A7B8|HSLV_ECOLI' become
+    'WP_000001.1', 'WP_000001.1' and 'P0A7B8'.
+    """
+    if '|' in seqid:
+        fields = [field for field in seqid.split('|') if field]
+        if fields[0] == 'gi' and len(fields) > 3:
+            # gi|123|ref|NZ_CP000001.1|
+            return fields[3]
+        return fields[1] if len(fields) > 1 else fields[0] if fields else ''
+    return seqid
+
+
+def _read_mappings(path, chunk_rows):
+    """Yield (accessions, taxids) chunks from accession2taxid or seqid2taxid.map files"""
+    path = Path(path)
+    if path.name.endswith('accession2taxid.gz') or path.name.endswith('accession2taxid'):
+        # accession  accession.version  taxid  gi
+        options = {'header': 0, 'usecols': [1, 2]}
+    else:
+        # seqid  taxid
+        options = {'header': None, 'usecols': [0, 1]}
+    chunks = pd.read_csv(path, sep='\t', dtype=str, quoting=3, keep_default_na=False,
+                         chunksize=chunk_rows, **options)
+    for chunk in chunks:
+        accessions = chunk.iloc[:, 0].map(normalize_accession)
+        taxids = pd.to_numeric(chunk.iloc[:, 1], errors='coerce').fillna(0).astype(np.uint32)
+        yield accessions, taxids.to_numpy()
+
+
+def _merge_runs(runs, keys_out, taxids_out, block_rows):
+    """
+    K-way merge of sorted (keys, taxids) runs into the output memmaps,
+    keeping the first taxid of duplicate keys (runs are in priority order).
+    Returns the number of unique keys written.
+
+    Each step takes the next block of every run and emits everything up to
+    the smallest block end, which is final because no run holds anything
+    smaller beyond its block.
+    """
+    positions = [0] * len(runs)
+    written = 0
+    last_key = None
+    while True:
+        blocks = [(i, keys[pos:pos + block_rows]) for i, ((keys, _), pos) in enumerate(zip(runs, positions))
+                  if pos < len(keys)]
+        if not blocks:
+            break
+        cutoff = min(block[-1] for _, block in blocks)
+        merged_keys, merged_taxids = [], []
+        for i, block in blocks:
+            take = int(np.searchsorted(block, cutoff, side='right'))
+            merged_keys.append(block[:take])
+            merged_taxids.append(runs[i][1][positions[i]:positions[i] + take])
+            positions[i] += take
+        keys = np.concatenate(merged_keys)
+        taxids = np.concatenate(merged_taxids)
+        order = np.argsort(keys, kind='stable')
+        keys, taxids = keys[order], taxids[order]
+
+        first = np.r_[True, keys[1:] != keys[:-1]]
+        if last_key is not None:
+            first[0] = keys[0] != last_key
+        keys, taxids = keys[first], taxids[first]
+        keys_out[written:written + len(keys)] = keys
+        taxids_out[written:written + len(keys)] = taxids
+        written += len(keys)
+        if len(keys):
+            last_key = keys[-1]
+    return written
+
+
+def build_accession_index(sources=None, index_dir=None):
+    """
+    Build a sorted, fixed-width accession -> taxid table.
+
+    ``sources`` (default: CAT's seqid2taxid.map, then NCBI's
+    prot.accession2taxid.gz) are streamed in chunks that are sorted into
+    run files and k-way merged, so the maps never have to fit in memory.
+    When a key occurs in several sources the first source wins. Keys longer
+    than ``key_bytes`` are skipped. The result is keys.npy (S<key_bytes>)
+    and taxids.npy (uint32) in ``index_dir``.
+    """
+    sources = [Path(source) for source in (sources or [SEQID2TAXID_MAP, PROT_ACCESSION2TAXID])
+               if Path(source).exists()]
+    if not sources:
+        raise FileNotFoundError("No accession -> taxid map found")
+    index_dir = Path(index_dir or ACCESSION_INDEX_DIR)
+    key_dtype = f"S{ACCESSION_INDEX_CONFIG['key_bytes']}"
+    # Built in a private directory and swapped in whole, so readers never see a partial index
+    index_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=index_dir.parent, prefix=f".{index_dir.name}."))
+
+    try:
+        # Sorted runs of at most sort_rows entries each
+        run_files = []
+        skipped = 0
+        for source in sources:
+            print(f"Indexing accessions from {source}...")
+            for accessions, taxids in _read_mappings(source, ACCESSION_INDEX_CONFIG['sort_rows']):
+                encoded = accessions.str.encode('utf-8')
+                fits = (encoded.str.len() <= ACCESSION_INDEX_CONFIG['key_bytes']) & (taxids > 0)
+                skipped += int((~fits).sum())
+                keys = encoded[fits].to_numpy().astype(key_dtype)
+                taxids = taxids[fits.to_numpy()]
+                order = np.argsort(keys, kind='stable')
+                run = tmp_dir / f"run_{len(run_files)}"
+                np.save(f"{run}.keys.npy", keys[order])
+                np.save(f"{run}.taxids.npy", taxids[order])
+                run_files.append(run)
+
+        runs = [(np.load(f"{run}.keys.npy", mmap_mode='r'), np.load(f"{run}.taxids.npy", mmap_mode='r'))
+                for run in run_files]
+        total = sum(len(keys) for keys, _ in runs)
+        keys_out = np.lib.format.open_memmap(tmp_dir / "keys.npy", mode='w+', dtype=key_dtype, shape=(total,))
+        taxids_out = np.lib.format.open_memmap(tmp_dir / "taxids.npy", mode='w+', dtype=np.uint32, shape=(total,))
+        written = _merge_runs(runs, keys_out, taxids_out, ACCESSION_INDEX_CONFIG['merge_block_rows'])
+        keys_out.flush()
+        taxids_out.flush()
+        del keys_out, taxids_out, runs
+
+        if written < total:
+            # Duplicate keys were dropped: trim the tables to the unique ones
+            for name, dtype in (("keys.npy", key_dtype), ("taxids.npy", np.uint32)):
+                full = np.load(tmp_dir / name, mmap_mode='r')
+                trimmed = np.lib.format.open_memmap(tmp_dir / f"{name}.trim", mode='w+',
+                                                    dtype=dtype, shape=(written,))
+                trimmed[:] = full[:written]
+                trimmed.flush()
+                del full, trimmed
+                os.replace(tmp_dir / f"{name}.trim", tmp_dir / name)
+        for run in run_files:
+            os.remove(f"{run}.keys.npy")
+            os.remove(f"{run}.taxids.npy")
+        replace_directory(tmp_dir, index_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if skipped:
+        print(f"Warning: Skipped {skipped} entries without a taxid or with accessions longer "
+              f"than {ACCESSION_INDEX_CONFIG['key_bytes']} bytes")
+    print(f"✓ Accession index with {written} accessions written to {index_dir}")
+    return index_dir
+
+
+class AccessionIndex:
+    """
+    Memory-mapped accession -> taxid lookup.
+
+    ``lookup`` resolves a whole column of subject IDs with one vectorized
+    binary search over the sorted keys; only the pages it touches are read
+    from disk. Queries without a version ('WP_000001') match the first
+    versioned key ('WP_000001.1'). Unknown accessions map to taxid 0.
+    """
+
+    def __init__(self, index_dir=None):
+        index_dir = Path(index_dir or ACCESSION_INDEX_DIR)
+        self.keys = np.load(index_dir / "keys.npy", mmap_mode='r')
+        self.taxids = np.load(index_dir / "taxids.npy", mmap_mode='r')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _search(self, queries):
+        pos = np.minimum(np.searchsorted(self.keys, queries), len(self.keys) - 1)
+        return pos, self.keys[pos]
+
+    def lookup(self, seqids):
+        """Taxid (uint32) of each subject ID, 0 when not found"""
+        codes, distinct = pd.factorize(pd.Series(seqids, dtype=object).astype(str))
+        result = np.zeros(len(distinct), dtype=np.uint32)
+        if not len(distinct) or not len(self.keys):
+            return np.zeros(len(codes), dtype=np.uint32)
+
+        # Each distinct accession is searched once, in sorted order for locality
+        accessions = pd.Series(distinct).map(normalize_accession).str.encode('utf-8')
+        width = self.keys.dtype.itemsize
+        fits = (accessions.str.len() <= width).to_numpy()
+        queries, inverse = np.unique(accessions[fits].to_numpy().astype(self.keys.dtype), return_inverse=True)
+
+        pos, found = self._search(queries)
+        taxids = np.where(found == queries, self.taxids[pos], 0).astype(np.uint32)
+
+        # Unversioned queries: the first key starting with 'accession.'
+        missing = (taxids == 0) & (np.char.find(queries, b'.') < 0)
+        if missing.any():
+            prefixes = np.char.add(queries[missing], b'.')
+            short = np.char.str_len(prefixes) <= width
+            prefixes = prefixes[short].astype(self.keys.dtype)
+            pos, found = self._search(prefixes)
+            versioned = np.where(np.char.startswith(found, prefixes), self.taxids[pos], 0)
+            targets = np.flatnonzero(missing)[short]
+            taxids[targets] = versioned
+
+        result[fits] = taxids[inverse]
+        return result[codes]
+
+
+def open_accession_index(rebuild=False):
+    """
+    The accession index, built first when missing or older than its sources;
+    None when no accession -> taxid map is installed.
+    """
+    sources = [Path(source) for source in (SEQID2TAXID_MAP, PROT_ACCESSION2TAXID) if Path(source).exists()]
+    if not sources:
+        return None
+    keys_file = ACCESSION_INDEX_DIR / "keys.npy"
+
+    def stale():
+        return (not keys_file.exists()
+                or any(source.stat().st_mtime > keys_file.stat().st_mtime for source in sources))
+
+    try:
+        if rebuild or stale():
+            # The build can take hours: one stage or process builds, the others wait for it
+            with exclusive_build(ACCESSION_INDEX_DIR.parent / f".{ACCESSION_INDEX_DIR.name}.lock", _build_lock):
+                if rebuild or stale():
+                    build_accession_index(sources)
+        return AccessionIndex()
+    except Exception as e:
+        print(f"Warning: Could not open accession index: {e}")
+        return None
@@ -4,15 +4,24 @@ import pandas as pd
 from pathlib import Path
 from Bio import SeqIO
 import numpy as np
-import json
 from .config import *
-from .utils import check_dependencies, convert_fastq_to_fasta, split_interleaved
-from .taxonomic_analysis import run_kraken, run_bracken, run_fasta_blast_taxonomy, create_blast_taxonomy_summary
+from .utils import check_dependencies, convert_fastq_to_fasta
+from .taxonomic_analysis import (run_kraken, run_bracken, run_fasta_blast_taxonomy,
+                                 get_blast_backend)
 from .pathogen_analysis import *
 from .functional_analysis import *
 from .visualization import create_visualizations, create_functional_plots, create_pathogen_visualization
+from .scheduler import StageScheduler
+from .stage_cache import StageCache, MANIFEST_NAME
+from .kraken_output import summarize_kraken_output, rescore_kraken_output
+from .resources import ResourceBudget
 
-def run_analysis(input_file, file_type, output_dir):
+# Files whose fingerprint identifies the Kraken2/Bracken database
+KRAKEN_DB_FILES = [KRAKEN_DB / "hash.k2d", KRAKEN_DB / "opts.k2d", KRAKEN_DB / "taxo.k2d"]
+
+def run_analysis(input_file, file_type, output_dir, resume=False, rerun=False, screening_mode=None,
+                 resources=None, blast_backend=None, blast_db=None, interleaved=False, sampling=None,
+                 confidence_thresholds=None, diamond_batch=None, kraken_memory_mapping=False):
     """Main analysis controller"""
     try:
         output_dir = Path(output_dir)
@@ -21,157 +30,212 @@ def run_analysis(input_file, file_type, output_dir):
         print(f"Analyzing {input_file} as {file_type}")
         print(f"Output directory: {output_dir}")
         
+        resources = resources or ResourceBudget()
+        print(f"Resource budget: {resources}")
+
+        # Finished stages are reused unless --rerun; --resume only insists there is a run to continue
+        if rerun:
+            print("Rerunning every stage")
+        elif resume and not (output_dir / MANIFEST_NAME).exists():
+            print(f"Warning: No previous run in {output_dir} to resume; running every stage")
+        elif resume:
+            print("Resuming: stages with unchanged inputs will be reused")
+
         if file_type == 'fastq':
-            analyze_fastq(input_file, output_dir)
+            analyze_fastq(input_file, output_dir, reuse=not rerun, resources=resources,
+                          interleaved=interleaved, confidence_thresholds=confidence_thresholds,
+                          diamond_batch=diamond_batch, kraken_memory_mapping=kraken_memory_mapping)
         else:
-            analyze_fasta(input_file[0], output_dir)
+            analyze_fasta(input_file[0], output_dir, reuse=not rerun, screening_mode=screening_mode,
+                          resources=resources, blast_backend=blast_backend, blast_db=blast_db,
+                          sampling=sampling, diamond_batch=diamond_batch)
 
         print(f"\n🎉 Analysis complete! Open {output_dir}/analysis_dashboard.html to explore results")
     except Exception as e:
         print(f"❌ Analysis failed: {str(e)}")
         raise
 
-def analyze_fastq(reads, output_dir):
+def analyze_fastq(reads, output_dir, reuse=True, resources=None, interleaved=False,
+                  confidence_thresholds=None, diamond_batch=None, kraken_memory_mapping=False):
     """Process FASTQ files"""
     print("\n=== FASTQ Analysis Pipeline ===")
-    
-    try:
-        # Handle interleaved files
-        if len(reads) == 1 and reads[0].endswith(('.fq', '.fastq')):
-            print("Splitting interleaved FASTQ...")
-            reads = split_interleaved(reads[0], output_dir)
 
-        # Taxonomic classification
-        print("1. Running Kraken2 classification...")
-        kraken_report = run_kraken(reads, output_dir)
+    # Interleaved pairs are streamed from the one file, never split on disk
+    if interleaved:
+        print("Reading interleaved paired-end FASTQ")
 
-        print("2. Running Bracken abundance estimation...")
-        bracken_report = run_bracken(kraken_report, output_dir)
-        
-        print("3. Creating taxonomy visualizations...")
-        create_visualizations(bracken_report, output_dir)
-        
-    except Exception as e:
-        print(f"⚠️ Taxonomic analysis failed: {str(e)}")
-    
-    try:
-        # Functional annotation
-        print("4. Converting to FASTA...")
-        fasta_path = convert_fastq_to_fasta(reads if len(reads) > 1 else reads[0], output_dir)
-        
-        print("5. Running gene prediction...")
-        prokka_dir = run_prokka(fasta_path, output_dir)
-        
-        # Check if proteins were found before proceeding
-        protein_files = list(Path(prokka_dir).glob("*.faa"))
-        if not protein_files or all(os.path.getsize(pf) == 0 for pf in protein_files):
-            print("⚠️ Warning: No protein sequences found. Skipping functional annotation.")
-            return
-        
-        print("6. Running functional annotation...")
-        swissprot_results = run_swissprot_annotation(prokka_dir, output_dir)
-        
-        print("7. Creating functional plots...")
-        create_functional_plots(prokka_dir, swissprot_results, output_dir)
-        
-    except Exception as e:
-        print(f"⚠️ Functional analysis failed: {str(e)}")
+    scheduler = StageScheduler(cache=StageCache(output_dir, reuse=reuse), resources=resources,
+                               on_finish=diamond_batch and diamond_batch.stage_finished)
+
+    # Taxonomic classification
+    scheduler.add('kraken', lambda: run_kraken(reads, output_dir, interleaved=interleaved,
+                                               memory_mapping=kraken_memory_mapping),
+                  cpu_bound=True, cached=True, inputs=reads, databases=KRAKEN_DB_FILES,
+                  params={'paired': interleaved or len(reads) == 2},
+                  outputs=[output_dir / "kraken_classified.txt"])
+    scheduler.add('bracken', lambda kraken_report: run_bracken(kraken_report, output_dir),
+                  requires=['kraken'], cached=True,
+                  databases=KRAKEN_DB_FILES + [KRAKEN_DB / "database150mers.kmer_distrib"],
+                  params={'read_length': 150, 'level': 'S', 'threshold': 10})
+    scheduler.add('taxonomy_plots', lambda bracken_report: create_visualizations(bracken_report, output_dir),
+                  requires=['bracken'])
+    scheduler.add('kraken_summary',
+                  lambda kraken_report: summarize_kraken_output(output_dir / "kraken_classified.txt",
+                                                                kraken_report, output_dir),
+                  requires=['kraken'], cached=True, params=KRAKEN_OUTPUT_CONFIG,
+                  outputs=[output_dir / "kraken_taxon_counts.tsv", output_dir / "kraken_read_taxids.u32"])
+
+    # Reclassify the Kraken2 output at other --confidence values without rerunning it
+    if confidence_thresholds:
+        confidence_thresholds = sorted(set(float(threshold) for threshold in confidence_thresholds))
+        scheduler.add('confidence_sweep',
+                      lambda kraken_report: rescore_kraken_output(output_dir / "kraken_classified.txt",
+                                                                  kraken_report, output_dir,
+                                                                  confidence_thresholds),
+                      requires=['kraken'], cached=True, params={'thresholds': confidence_thresholds},
+                      outputs=[output_dir / "kraken_confidence_sweep.tsv"])
+        for i, threshold in enumerate(confidence_thresholds):
+            scheduler.add(f'bracken_confidence_{threshold}',
+                          lambda reports, i=i: run_bracken(reports[i], reports[i].parent),
+                          requires=['confidence_sweep'])
+            scheduler.add(f'taxonomy_plots_confidence_{threshold}',
+                          lambda bracken_report: create_visualizations(bracken_report, bracken_report.parent),
+                          requires=[f'bracken_confidence_{threshold}'])
 
-def analyze_fasta(fasta_path, output_dir):
+    # Functional annotation
+    scheduler.add('fasta_conversion',
+                  lambda: convert_fastq_to_fasta(reads if len(reads) > 1 else reads[0], output_dir),
+                  cached=True, inputs=reads)
+    _add_functional_stages(scheduler, output_dir, 'fasta_conversion', diamond_batch)
+
+    scheduler.run()
+
+def analyze_fasta(fasta_path, output_dir, reuse=True, screening_mode=None, resources=None,
+                  blast_backend=None, blast_db=None, sampling=None, diamond_batch=None):
     """Process FASTA files"""
+    screening_mode = screening_mode or SCREENING_CONFIG['mode']
+    sampling = sampling or BLAST_CONFIG['sampling']
+    backend = get_blast_backend(blast_backend, blast_db)
     print("\n=== FASTA Analysis Pipeline ===")
-    
-    blast_results_data = None  # Store the actual parsed data
-    
-    try:
-        # Taxonomic classification using BLAST for FASTA files
-        print("1. Running BLAST taxonomic classification...")
-        blast_results_file = run_fasta_blast_taxonomy(fasta_path, output_dir, database="nt", max_sequences=50)
-        
-        # Load the actual BLAST results data
-        if blast_results_file and Path(blast_results_file).exists():
-            try:
-                with open(blast_results_file, 'r') as f:
-                    blast_results_data = json.load(f)
-                print(f"✓ Loaded {len(blast_results_data)} BLAST results")
-            except Exception as e:
-                print(f"⚠️ Could not load BLAST results: {e}")
-        
-        print("2. Creating taxonomy visualizations...")
-        # Use the Kraken-style report created by BLAST analysis
-        kraken_style_report = output_dir / "blast_kraken_style_report.txt"
-        if kraken_style_report.exists():
-            create_visualizations(kraken_style_report, output_dir)
-        
-    except Exception as e:
-        print(f"⚠️ BLAST taxonomic analysis failed: {str(e)}")
-        print("   This may be due to network issues or API rate limits.")
-    
-    try:
-        # Pathogen screening
-        print("3. Screening for pathogens...")
-        blast_report = run_pathogen_scan(fasta_path, output_dir)
-        
-        print("4. Scanning for AMR genes...")
-        amr_results = run_antimicrobial_resistance_scan(fasta_path, output_dir)
-        
-        print("5. Scanning for virulence factors...")
-        vf_results = run_virulence_factor_scan(fasta_path, output_dir)
-        
-        # Generate reports
-        print("6. Generating reports...")
-        
-        # Only create BLAST taxonomy summary if we have the actual data
-        if blast_results_data:
-            try:
-                create_blast_taxonomy_summary(blast_results_data, output_dir)
-                print("✓ BLAST taxonomy summary created")
-            except Exception as e:
-                print(f"⚠️ Could not create BLAST taxonomy summary: {e}")
-        
-        if amr_results:
-            try:
-                generate_amr_report(amr_results, output_dir)
-                print("✓ AMR report generated")
-            except Exception as e:
-                print(f"⚠️ Could not generate AMR report: {e}")
-        
-        if vf_results:
-            try:
-                generate_vf_report(vf_results, output_dir)  
-                print("✓ Virulence factor report generated")
-            except Exception as e:
-                print(f"⚠️ Could not generate VF report: {e}")
-        
-        print("7. Creating pathogen visualization...")
-        if blast_report and Path(blast_report).exists():
-            try:
-                create_pathogen_visualization(blast_report, output_dir)
-                print("✓ Pathogen visualization created")
-            except Exception as e:
-                print(f"⚠️ Could not create pathogen visualization: {e}")
-            
-    except Exception as e:
-        print(f"⚠️ Pathogen analysis failed: {str(e)}")
-    
-    try:
-        # Functional annotation
-        print("8. Running gene prediction...")
-        prokka_dir = run_prokka(fasta_path, output_dir)
-        
-        # Check if proteins were found before proceeding
-        protein_files = list(Path(prokka_dir).glob("*.faa"))
-        if not protein_files or all(os.path.getsize(pf) == 0 for pf in protein_files):
-            print("⚠️ Warning: No protein sequences found. Skipping functional annotation.")
-            print("   This is likely because the input sequence is too short (<300 bp) for gene prediction.")
-            return
-        
-        print("9. Running functional annotation...")
-        swissprot_results = run_swissprot_annotation(prokka_dir, output_dir)
-        
-        print("10. Creating functional plots...")
+
+    scheduler = StageScheduler(cache=StageCache(output_dir, reuse=reuse), resources=resources,
+                               on_finish=diamond_batch and diamond_batch.stage_finished)
+
+    # Taxonomic classification using BLAST for FASTA files
+    scheduler.add('blast_taxonomy',
+                  lambda: run_fasta_blast_taxonomy(fasta_path, output_dir, database=blast_db,
+                                                   max_sequences=BLAST_CONFIG['max_query_sequences'],
+                                                   backend=backend.name, sampling=sampling),
+                  cpu_bound=backend.local, cached=True, inputs=[fasta_path],
+                  databases=backend.database_files(),
+                  params={'backend': backend.name, 'database': str(backend.database),
+                          'max_sequences': BLAST_CONFIG['max_query_sequences'], 'sampling': sampling,
+                          'sampling_seed': BLAST_CONFIG['sampling_seed'],
+                          'min_length': BLAST_CONFIG['min_query_length']},
+                  outputs=[output_dir / "blast_report.txt"])
+    # blast_taxonomy writes the summary and Kraken-style report the plots read
+    scheduler.add('taxonomy_plots', lambda _: _plot_blast_taxonomy(output_dir),
+                  requires=['blast_taxonomy'])
+
+    # Functional annotation
+    scheduler.add('input_fasta', lambda: fasta_path)
+    _add_functional_stages(scheduler, output_dir, 'input_fasta', diamond_batch)
+
+    if screening_mode == 'protein':
+        # blastp on Prokka-predicted proteins instead of blastx on every frame
+        for stage, source, db in (('pathogen_scan', 'pathogen', CAT_DB),
+                                  ('amr_scan', 'amr', CARD_PROTEIN_DB),
+                                  ('vf_scan', 'vf', VFDB_DB)):
+            scheduler.add(stage,
+                          lambda prokka_dir, source=source: run_protein_scan(prokka_dir, output_dir, source),
+                          requires=['prokka'], cpu_bound=True, cached=True, databases=[db],
+                          params={'program': 'blastp', 'top': SCREENING_SOURCES[source][1], 'evalue': 1e-5})
+        scheduler.add('gene_locations',
+                      lambda prokka_dir, pathogen, amr, vf: locate_gene_hits(
+                          prokka_dir, {'pathogen': pathogen, 'amr': amr, 'vf': vf}, output_dir),
+                      requires=['prokka', 'pathogen_scan', 'amr_scan', 'vf_scan'])
+    elif screening_mode == 'combined':
+        # One DIAMOND pass over a merged, source-tagged reference
+        scheduler.add('screening', lambda: run_combined_screening(fasta_path, output_dir),
+                      cpu_bound=True, cached=True, inputs=[fasta_path],
+                      databases=[CAT_FASTA_SOURCE, CARD_PROTEIN_DB, VFDB_DB],
+                      params={'max_target_seqs': SCREENING_CONFIG['max_target_seqs'], 'evalue': 1e-5})
+        scheduler.add('pathogen_scan', lambda hits: hits and hits[0], requires=['screening'])
+        scheduler.add('amr_scan', lambda hits: hits and hits[1], requires=['screening'])
+        scheduler.add('vf_scan', lambda hits: hits and hits[2], requires=['screening'])
+    else:
+        # Pathogen, AMR and virulence screening are independent DIAMOND searches
+        scheduler.add('pathogen_scan', lambda: _screen_pathogens(fasta_path, output_dir, diamond_batch),
+                      cpu_bound=True, cached=True, inputs=[fasta_path], databases=[CAT_DB],
+                      params={'top': 3, 'evalue': 1e-5})
+        scheduler.add('amr_scan', lambda: run_antimicrobial_resistance_scan(fasta_path, output_dir, diamond_batch),
+                      cpu_bound=True, cached=True, inputs=[fasta_path], databases=[CARD_PROTEIN_DB],
+                      params={'top': 5, 'evalue': 1e-5})
+        scheduler.add('vf_scan', lambda: run_virulence_factor_scan(fasta_path, output_dir, diamond_batch),
+                      cpu_bound=True, cached=True, inputs=[fasta_path], databases=[VFDB_DB],
+                      params={'top': 5, 'evalue': 1e-5})
+    scheduler.add('amr_report', lambda amr_results: _report_amr(amr_results, output_dir),
+                  requires=['amr_scan'])
+    scheduler.add('vf_report', lambda vf_results: _report_vf(vf_results, output_dir),
+                  requires=['vf_scan'])
+    scheduler.add('pathogen_taxa', lambda blast_report: annotate_pathogen_hits(blast_report, output_dir),
+                  requires=['pathogen_scan'], cached=True,
+                  databases=[SEQID2TAXID_MAP, PROT_ACCESSION2TAXID, PATHOGEN_TAXIDS, TAXDUMP_NODES])
+    scheduler.add('pathogen_plots', lambda pathogen_report: _plot_pathogens(pathogen_report, output_dir),
+                  requires=['pathogen_taxa'])
+
+    scheduler.run()
+
+def _add_functional_stages(scheduler, output_dir, fasta_stage, diamond_batch=None):
+    """Register gene prediction, SwissProt annotation and functional plots"""
+    scheduler.add('prokka', lambda fasta_path: run_prokka(fasta_path, output_dir),
+                  requires=[fasta_stage], cpu_bound=True, cached=True)
+    scheduler.add('swissprot', lambda prokka_dir: _annotate_proteins(prokka_dir, output_dir, diamond_batch),
+                  requires=['prokka'], cpu_bound=True, cached=True, databases=[SWISSPROT_DB],
+                  params={'top': 1, 'evalue': 1e-5})
+    scheduler.add('functional_plots',
+                  lambda prokka_dir, swissprot_results: _plot_functions(prokka_dir, swissprot_results, output_dir),
+                  requires=['prokka', 'swissprot'])
+
+def _screen_pathogens(fasta_path, output_dir, diamond_batch=None):
+    """Run the pathogen scan, returning None when DIAMOND did not complete"""
+    blast_report = run_pathogen_scan(fasta_path, output_dir, diamond_batch)
+    with open(blast_report, 'r') as f:
+        first_line = f.readline()
+    if first_line.startswith('#') and any(word in first_line for word in ('failed', 'timed out', 'error')):
+        return None
+    return blast_report
+
+def _plot_blast_taxonomy(output_dir):
+    # Use the Kraken-style report created by BLAST analysis
+    kraken_style_report = output_dir / "blast_kraken_style_report.txt"
+    if kraken_style_report.exists():
+        create_visualizations(kraken_style_report, output_dir)
+
+def _report_amr(amr_results, output_dir):
+    if amr_results:
+        generate_amr_report(amr_results, output_dir)
+        print("✓ AMR report generated")
+
+def _report_vf(vf_results, output_dir):
+    if vf_results:
+        generate_vf_report(vf_results, output_dir)
+        print("✓ Virulence factor report generated")
+
+def _plot_pathogens(blast_report, output_dir):
+    if blast_report and Path(blast_report).exists():
+        create_pathogen_visualization(blast_report, output_dir)
+        print("✓ Pathogen visualization created")
+
+def _annotate_proteins(prokka_dir, output_dir, diamond_batch=None):
+    # Check if proteins were found before proceeding
+    protein_files = list(Path(prokka_dir).glob("*.faa"))
+    if not protein_files or all(os.path.getsize(pf) == 0 for pf in protein_files):
+        print("⚠️ Warning: No protein sequences found. Skipping functional annotation.")
+        print("   This is likely because the input sequence is too short (<300 bp) for gene prediction.")
+        return None
+    return run_swissprot_annotation(prokka_dir, output_dir, diamond_batch)
+
+def _plot_functions(prokka_dir, swissprot_results, output_dir):
+    if swissprot_results:
         create_functional_plots(prokka_dir, swissprot_results, output_dir)
-        
-    except Exception as e:
-        print(f"⚠️ Functional analysis failed: {str(e)}")
-        print("   This may be due to short sequences or annotation issues.")
\ No newline at end of file
@@ -0,0 +1,361 @@
+import os
+import time
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .config import *
+from .analysis import run_analysis, KRAKEN_DB_FILES
+from .diamond_index import run_diamond
+from .krona import read_abundance_table
+from .resources import (ResourceBudget, Allocation, MIN_STAGE_MEMORY, current_allocation,
+                        set_current_allocation)
+from .utils import open_fastq
+
+# Scheduler stages whose DIAMOND search can be grouped -> search name passed to run_diamond
+DIAMOND_STAGES = {'swissprot': 'swissprot', 'pathogen_scan': 'pathogen', 'amr_scan': 'amr', 'vf_scan': 'vf'}
+
+# Per-sample abundance tables merged into the batch matrix, in order of preference
+ABUNDANCE_REPORTS = ["bracken_report.tsv", "kraken_report.txt", "blast_report.txt"]
+
+
+def read_sample_sheet(sheet):
+    """
+    Samples listed in a tab-separated sheet with the columns sample, type
+    (fasta/fastq), input and an optional mate: the R2 file of paired-end
+    reads, or 'interleaved'. Relative paths are taken from the sheet's
+    directory; lines starting with '#' are ignored.
+    """
+    sheet = Path(sheet)
+    table = pd.read_csv(sheet, sep='\t', dtype=str, comment='#', keep_default_na=False)
+    missing = {'sample', 'type', 'input'} - set(table.columns)
+    if missing:
+        raise ValueError(f"Sample sheet {sheet} is missing column(s): {', '.join(sorted(missing))}")
+
+    def resolve(path):
+        path = Path(path)
+        path = path if path.is_absolute() else sheet.parent / path
+        if not path.exists():
+            raise FileNotFoundError(f"Input file not found: {path}")
+        return str(path)
+
+    samples = []
+    for row in table.to_dict('records'):
+        name = row['sample'].strip()
+        file_type = row['type'].strip().lower()
+        mate = row.get('mate', '').strip()
+        if not name or '/' in name or name.startswith('.'):
+            raise ValueError(f"Invalid sample name '{name}' in {sheet}")
+        if file_type not in ('fasta', 'fastq'):
+            raise ValueError(f"Sample {name}: type must be fasta or fastq, not '{row['type']}'")
+        inputs = [resolve(row['input'].strip())]
+        if mate and mate.lower() != 'interleaved':
+            if file_type == 'fasta':
+                raise ValueError(f"Sample {name}: only FASTQ samples can have a mate file")
+            inputs.append(resolve(mate))
+        samples.append({'sample': name, 'type': file_type, 'inputs': inputs,
+                        'interleaved': mate.lower() == 'interleaved'})
+
+    names = [sample['sample'] for sample in samples]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate sample names in {sheet}: {', '.join(duplicates)}")
+    if not samples:
+        raise ValueError(f"No samples listed in {sheet}")
+    return samples
+
+
+class DiamondBatch:
+    """
+    Run identical DIAMOND searches (same program, database and options) from
+    several running samples as one search.
+
+    Each sample declares the searches it is expected to run when it joins
+    (``searches``, names from DIAMOND_STAGES). A queued search waits until
+    ``group_size`` samples have queued it, until no other running sample
+    still has it pending, or until ``max_wait`` seconds have passed. A search
+    stops being pending for a sample when the sample queues it, when its
+    stage is over without queuing it (reused from a previous run, skipped, or its
+    database is missing), or when the sample finishes. The queries are then
+    concatenated with a per-sample prefix on their IDs, searched in one run
+    that loads the database once and uses the CPU and memory granted to all
+    of the grouped stages, and the hits are split back into each sample's
+    output file. DIAMOND scores each query independently, so the hits match
+    separate runs.
+    """
+
+    def __init__(self, work_dir, group_size=None, max_wait=None):
+        self.work_dir = Path(work_dir)
+        self.group_size = group_size or BATCH_CONFIG['diamond_group_size']
+        self.max_wait = BATCH_CONFIG['diamond_group_wait'] if max_wait is None else max_wait
+        self._cond = threading.Condition()
+        self._pending = {}    # running sample -> searches it may still queue
+        self._queued = {}     # (search, program, db, options) -> jobs waiting to run
+        self._groups = 0
+
+    def join(self, sample, searches=()):
+        with self._cond:
+            self._pending[sample] = set(searches)
+
+    def leave(self, sample):
+        """Mark a sample finished; searches waiting for it can start"""
+        self.release(sample, None)
+
+    def release(self, sample, search):
+        """``search`` (None: every search) will not be queued by ``sample``"""
+        with self._cond:
+            if sample in self._pending:
+                if search is None:
+                    del self._pending[sample]
+                else:
+                    self._pending[sample].discard(search)
+            self._cond.notify_all()
+
+    def for_sample(self, sample):
+        """Handle passed to run_analysis as ``diamond_batch``"""
+        return SampleSearches(self, sample)
+
+    def search(self, sample, search, program, db, query, output, options, timeout=None):
+        key = (search, program, str(db), options)
+        job = {'query': Path(query), 'output': Path(output), 'timeout': timeout,
+               'allocation': current_allocation(), 'done': False, 'error': None}
+        deadline = time.monotonic() + self.max_wait
+
+        with self._cond:
+            self._queued.setdefault(key, []).append(job)
+            self._pending.get(sample, set()).discard(search)
+            self._cond.notify_all()
+
+        while True:
+            with self._cond:
+                while not job['done'] and not self._ready(key, job, deadline):
+                    remaining = deadline - time.monotonic()
+                    self._cond.wait(remaining if remaining > 0 else None)
+                if job['done']:
+                    break
+                group = self._queued[key][:self.group_size]
+                del self._queued[key][:len(group)]
+                self._groups += 1
+                group_id = self._groups
+            self._run_group(group_id, program, db, options, group, job['allocation'])
+
+        if job['error'] is not None:
+            raise job['error']
+        return output
+
+    def _ready(self, key, job, deadline):
+        queued = self._queued[key]
+        if job not in queued:
+            return False  # already taken into a running group
+        return (len(queued) >= self.group_size
+                or not any(key[0] in searches for searches in self._pending.values())
+                or time.monotonic() >= deadline)
+
+    def _run_group(self, group_id, program, db, options, group, own_allocation):
+        query_file = self.work_dir / f"diamond_group_{group_id}.fasta"
+        hits_file = self.work_dir / f"diamond_group_{group_id}.tsv"
+        timeouts = [job['timeout'] for job in group]
+        timeout = None if None in timeouts else max(timeouts) * len(group)
+        error = None
+        try:
+            if len(group) == 1:
+                run_diamond(program, db, group[0]['query'], group[0]['output'], options, timeout=timeout)
+            else:
+                print(f"Running one DIAMOND {program} search against {db} for {len(group)} samples")
+                self.work_dir.mkdir(parents=True, exist_ok=True)
+                _write_grouped_query(group, query_file)
+                set_current_allocation(Allocation(sum(job['allocation'].threads for job in group),
+                                                  sum(job['allocation'].memory for job in group)))
+                try:
+                    run_diamond(program, db, query_file, hits_file, options, timeout=timeout)
+                finally:
+                    set_current_allocation(own_allocation)
+                _split_grouped_hits(hits_file, group)
+        except Exception as e:
+            error = e
+        finally:
+            for path in (query_file, hits_file):
+                if path.exists():
+                    path.unlink()
+
+        with self._cond:
+            for job in group:
+                job['error'] = error
+                job['done'] = True
+            self._cond.notify_all()
+
+
+class SampleSearches:
+    """One sample's view of a DiamondBatch, as passed to run_diamond and the scheduler"""
+
+    def __init__(self, batch, sample):
+        self.batch = batch
+        self.sample = sample
+
+    def __call__(self, program, db, query, output, options, timeout=None, search=None):
+        return self.batch.search(self.sample, search, program, db, query, output, options, timeout)
+
+    def stage_finished(self, stage):
+        """StageScheduler on_finish hook: a DIAMOND stage that is over has nothing left to queue"""
+        if stage in DIAMOND_STAGES:
+            self.batch.release(self.sample, DIAMOND_STAGES[stage])
+
+
+def _write_grouped_query(group, query_file):
+    """Concatenate the group's FASTA queries, prefixing each ID with its job number"""
+    with open(query_file, 'wb') as out:
+        for i, job in enumerate(group):
+            prefix = f">{i}|".encode()
+            with open_fastq(job['query']) as f:
+                for line in f:
+                    if line.startswith(b'>'):
+                        line = prefix + line[1:]
+                    out.write(line if line.endswith(b'\n') else line + b'\n')
+
+
+def _split_grouped_hits(hits_file, group):
+    """Write each hit of a grouped search to its job's output, without the ID prefix"""
+    handles = [open(job['output'], 'wb') for job in group]
+    try:
+        with open(hits_file, 'rb') as f:
+            for line in f:
+                job, _, hit = line.partition(b'|')
+                handles[int(job)].write(hit)
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def prewarm_page_cache(paths, chunk_size=16 * 1024 ** 2):
+    """Read files once so their pages are resident in the page cache; returns the bytes read"""
+    total = 0
+    buffer = bytearray(chunk_size)
+    for path in paths:
+        if not Path(path).exists():
+            continue
+        with open(path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                total += read
+    return total
+
+
+def share_kraken_database(resources):
+    """
+    Memory-map the Kraken2 database for every sample when it fits in the
+    page cache next to the samples' own memory, reading it in once up front.
+    Returns the bytes kept resident, or 0 when each run loads its own copy.
+    """
+    size = sum(path.stat().st_size for path in KRAKEN_DB_FILES if path.exists())
+    if not size:
+        return 0
+    if size > resources.memory * BATCH_CONFIG['page_cache_fraction']:
+        print(f"Warning: Kraken2 database ({size / 1024 ** 3:.1f} GB) is too large to keep in the "
+              f"page cache; each sample will load its own copy")
+        return 0
+    start = time.time()
+    prewarm_page_cache(KRAKEN_DB_FILES)
+    print(f"✓ Kraken2 database ({size / 1024 ** 3:.1f} GB) resident in the page cache "
+          f"({time.time() - start:.1f}s); samples memory-map it")
+    return size
+
+
+def merge_abundance_tables(samples, output_dir):
+    """
+    Merge the per-sample abundance tables (Bracken, else the Kraken2 or BLAST
+    report) into samples x taxa read-count and relative-abundance matrices.
+    """
+    rows = []
+    for sample in samples:
+        sample_dir = output_dir / sample['sample']
+        report = next((sample_dir / name for name in ABUNDANCE_REPORTS if (sample_dir / name).exists()), None)
+        if report is None:
+            print(f"Warning: No abundance table for sample {sample['sample']}")
+            continue
+        try:
+            _, counts, names, _, _ = read_abundance_table(report)
+            rows.append(pd.DataFrame({'sample': sample['sample'], 'taxon': names, 'reads': counts}))
+        except Exception as e:
+            print(f"Warning: Could not read {report}: {e}")
+
+    if not rows:
+        return None
+    table = pd.concat(rows, ignore_index=True)
+    table = table[table['reads'] > 0]
+    matrix = table.pivot_table(index='sample', columns='taxon', values='reads', aggfunc='sum', fill_value=0)
+    matrix = matrix.reindex([sample['sample'] for sample in samples], fill_value=0)
+    matrix = matrix[matrix.sum().sort_values(ascending=False).index]
+
+    counts_file = output_dir / "abundance_matrix.tsv"
+    matrix.to_csv(counts_file, sep='\t')
+    totals = matrix.sum(axis=1).replace(0, 1)
+    matrix.div(totals, axis=0).to_csv(output_dir / "abundance_matrix_relative.tsv", sep='\t',
+                                       float_format='%.6g')
+    print(f"✓ Abundance matrix ({matrix.shape[0]} samples x {matrix.shape[1]} taxa) written to {counts_file}")
+    return counts_file
+
+
+def _diamond_searches(sample, options):
+    """DiamondBatch searches run_analysis may queue for ``sample``"""
+    searches = {'swissprot'}
+    screening_mode = options.get('screening_mode') or SCREENING_CONFIG['mode']
+    if sample['type'] == 'fasta' and screening_mode not in ('protein', 'combined'):
+        searches |= {'pathogen', 'amr', 'vf'}
+    return searches
+
+
+def run_batch(sheet, output_dir, workers=None, resume=False, rerun=False, resources=None, **options):
+    """
+    Analyse every sample of a sample sheet in one process.
+
+    Samples run on a pool of ``workers`` threads, each with an even share of
+    the ResourceBudget; Kraken2 memory-maps a database that is read into the
+    page cache once, and identical DIAMOND searches from concurrently running
+    samples are grouped (DiamondBatch). Each sample's results go to
+    ``output_dir/<sample>``; ``options`` are passed on to run_analysis.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    samples = read_sample_sheet(sheet)
+    resources = resources or ResourceBudget()
+    workers = workers or BATCH_CONFIG['workers'] or resources.cpus // BATCH_CONFIG['threads_per_sample']
+    workers = max(1, min(workers, len(samples)))
+    print(f"Batch of {len(samples)} samples, {workers} at a time")
+
+    resident = share_kraken_database(resources) if any(s['type'] == 'fastq' for s in samples) else 0
+    sample_cpus = max(1, resources.cpus // workers)
+    sample_memory = max(MIN_STAGE_MEMORY, (resources.memory - resident) // workers)
+    diamond = DiamondBatch(output_dir / "diamond_groups")
+
+    def analyze(sample):
+        name = sample['sample']
+        diamond.join(name, _diamond_searches(sample, options))
+        start = time.time()
+        try:
+            run_analysis(sample['inputs'], sample['type'], output_dir / name, resume=resume, rerun=rerun,
+                         resources=ResourceBudget(cpus=sample_cpus, memory=sample_memory),
+                         interleaved=sample['interleaved'], diamond_batch=diamond.for_sample(name),
+                         kraken_memory_mapping=bool(resident), **options)
+            status = 'completed'
+        except Exception as e:
+            print(f"❌ Sample {name} failed: {e}")
+            status = 'failed'
+        finally:
+            diamond.leave(name)
+        return {'sample': name, 'type': sample['type'], 'status': status,
+                'seconds': round(time.time() - start, 1)}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        summary = pd.DataFrame(list(pool.map(analyze, samples)))
+    summary.to_csv(output_dir / "batch_summary.tsv", sep='\t', index=False)
+
+    merge_abundance_tables(samples, output_dir)
+    failed = summary.loc[summary['status'] == 'failed', 'sample'].tolist()
+    if failed:
+        print(f"⚠️ {len(failed)} sample(s) failed: {', '.join(failed)}")
+    print(f"\n🎉 Batch complete! {len(samples) - len(failed)} of {len(samples)} samples analysed")
+    return summary
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from .config import *
+
+CACHE_DB_NAME = "blast_cache.sqlite"
+LEGACY_CACHE_NAME = "blast_cache.json"
+
+
+class BlastCache:
+    """
+    Indexed on-disk BLAST result cache backed by SQLite.
+
+    Entries are read and written individually, so a growing cache never has to
+    be loaded or rewritten as a whole. Entries older than ``expiry_days`` are
+    treated as missing, and ``cleanup`` drops expired entries and evicts the
+    least recently used ones until the cache fits in ``size_limit_mb``.
+    Supports the ``key in cache`` / ``cache[key]`` access used for the old
+    dict cache.
+    """
+
+    def __init__(self, cache_dir, expiry_days=None, size_limit_mb=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.expiry_seconds = (expiry_days or BLAST_CONFIG['cache_expiry_days']) * 24 * 60 * 60
+        self.size_limit = (size_limit_mb or CACHE_CONFIG['cache_size_limit_mb']) * 1024 * 1024
+        self._lock = threading.Lock()
+
+        self.db_file = self.cache_dir / CACHE_DB_NAME
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        """Return a cached entry, or default if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            if row[1] < now - self.expiry_seconds:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.conn.commit()
+                return default
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value, created=None):
+        """Insert or replace one entry"""
+        encoded = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, created or now, now, len(encoded))
+            )
+            self.conn.commit()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def cleanup(self):
+        """Drop expired entries, then evict least recently used ones down to the size limit"""
+        cutoff = time.time() - self.expiry_seconds
+        with self._lock:
+            expired = self.conn.execute("DELETE FROM entries WHERE created < ?", (cutoff,)).rowcount
+
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = 0
+            if total > self.size_limit:
+                excess = total - self.size_limit
+                freed = 0
+                victims = []
+                for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                    victims.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self.conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+                evicted = len(victims)
+
+            self.conn.commit()
+            if expired or evicted:
+                self.conn.execute("PRAGMA incremental_vacuum")
+
+        if expired or evicted:
+            print(f"✓ Cleaned BLAST cache: {expired} expired, {evicted} evicted to fit "
+                  f"{self.size_limit / (1024 * 1024):.0f} MB")
+        return expired + evicted
+
+    def import_json(self, json_file):
+        """One-time import of a legacy blast_cache.json, which is renamed afterwards"""
+        json_file = Path(json_file)
+        try:
+            with open(json_file, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not import legacy cache {json_file}: {e}")
+            return 0
+
+        imported = 0
+        for key, value in legacy.items():
+            created = value.get('timestamp') if isinstance(value, dict) else None
+            self.put(key, value, created=created)
+            imported += 1
+
+        json_file.rename(json_file.with_suffix('.json.imported'))
+        print(f"✓ Imported {imported} entries from {json_file}")
+        return imported
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def open_blast_cache(cache_dir):
+    """
+    Open the BLAST cache in cache_dir, importing a legacy JSON cache and
+    cleaning up old entries on startup as configured. Returns a plain dict
+    when caching is disabled.
+    """
+    if not CACHE_CONFIG['enable_blast_cache']:
+        return {}
+
+    cache = BlastCache(cache_dir)
+    legacy_file = Path(cache_dir) / LEGACY_CACHE_NAME
+    if legacy_file.exists():
+        cache.import_json(legacy_file)
+    if CACHE_CONFIG['cleanup_on_startup']:
+        cache.cleanup()
+    return cache
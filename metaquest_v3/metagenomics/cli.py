@@ -1,11 +1,107 @@
 import argparse
 import subprocess
+import sys
 from pathlib import Path
 from .analysis import run_analysis
+from .batch import run_batch
 from .utils import check_dependencies, check_database_status
+from .resources import ResourceBudget, set_default_budget
+from .taxonomic_analysis import BLAST_BACKENDS
+from .utils import SAMPLING_METHODS
+
+def _add_run_options(parser):
+    """Options shared by single-sample and batch runs"""
+    parser.add_argument('--threads', type=int, default=None,
+                       help="Total CPU threads to use (default: detected from affinity and cgroup limits)")
+    parser.add_argument('--memory-gb', type=float, default=None,
+                       help="Total memory to use in GB (default: detected available memory)")
+    parser.add_argument('--check-only', action='store_true', 
+                       help="Only check dependencies and databases")
+    parser.add_argument('--resume', action='store_true',
+                       help="Continue a previous run into the same output directory from the first "
+                            "stage that is missing or out of date (finished stages whose inputs, "
+                            "parameters and databases are unchanged are always reused)")
+    parser.add_argument('--rerun', action='store_true',
+                       help="Run every stage again, ignoring finished stages of a previous run")
+    parser.add_argument('--screening-mode', choices=['separate', 'combined', 'protein'], default=None,
+                       help="FASTA pathogen/AMR/virulence screening: three DIAMOND blastx runs (separate), "
+                            "one blastx pass over a merged reference (combined), or blastp on "
+                            "Prokka-predicted proteins (protein)")
+    parser.add_argument('--blast-backend', choices=BLAST_BACKENDS, default=None,
+                       help="FASTA taxonomy search: NCBI web BLAST (remote), local blastn with the "
+                            "megablast or blastn task, or DIAMOND blastx against a protein database")
+    parser.add_argument('--sampling', choices=SAMPLING_METHODS, default=None,
+                       help="How remote BLAST picks its query sequences from a large FASTA: the first N "
+                            "(head), a uniform random sample (reservoir, default) or a sample stratified "
+                            "by contig length (length)")
+    parser.add_argument('--confidence-sweep', nargs='+', type=float, metavar='T', default=None,
+                       help="FASTQ: reclassify the Kraken2 output at these --confidence values (0-1) "
+                            "and run Bracken on each; an unchanged Kraken2 run is not repeated")
+    parser.add_argument('--blast-db', default=None,
+                       help="Database for --blast-backend: an NCBI database name for remote, a "
+                            "makeblastdb prefix for megablast/blastn, or a .dmnd file for diamond")
+
+def _check_run_options(parser, args):
+    """Validate the shared options; duplicate sweep thresholds are dropped"""
+    if args.resume and args.rerun:
+        parser.error("--resume and --rerun cannot be combined")
+    if args.confidence_sweep:
+        out_of_range = [t for t in args.confidence_sweep if not 0 <= t <= 1]
+        if out_of_range:
+            parser.error(f"--confidence-sweep values must be between 0 and 1, got {out_of_range}")
+        args.confidence_sweep = sorted(set(args.confidence_sweep))
+
+def _resource_budget(args):
+    budget = ResourceBudget(
+        cpus=args.threads,
+        memory=int(args.memory_gb * 1024 ** 3) if args.memory_gb else None
+    )
+    # Tools started outside a scheduled stage stay within --threads/--memory-gb too
+    set_default_budget(budget)
+    return budget
+
+def batch_main(argv):
+    """metaquest batch: analyse every sample of a sample sheet in one process"""
+    parser = argparse.ArgumentParser(prog="metaquest batch",
+                                     description="Analyse the samples of a sample sheet, sharing databases")
+    parser.add_argument('sheet', help="Tab-separated sample sheet with the columns sample, type "
+                                      "(fasta/fastq), input and optionally mate (R2 file or 'interleaved')")
+    parser.add_argument('-o', '--output', default='results', help="Output directory, one subdirectory per sample")
+    parser.add_argument('--workers', type=int, default=None,
+                       help="Samples analysed at once (default: one per 8 CPU threads)")
+    _add_run_options(parser)
+    args = parser.parse_args(argv)
+    _check_run_options(parser, args)
+
+    try:
+        print("=== Metagenomics Analysis Pipeline: batch ===")
+        print("Checking dependencies and databases...")
+        check_dependencies()
+        check_database_status()
+
+        if args.check_only:
+            print("\n✓ All checks passed!")
+            exit(0)
+
+        run_batch(args.sheet, args.output, workers=args.workers, resume=args.resume, rerun=args.rerun,
+                  resources=_resource_budget(args), screening_mode=args.screening_mode,
+                  blast_backend=args.blast_backend, blast_db=args.blast_db, sampling=args.sampling,
+                  confidence_thresholds=args.confidence_sweep)
+        print(f"Results saved to {args.output}; merged abundances in {Path(args.output) / 'abundance_matrix.tsv'}")
+
+    except FileNotFoundError as e:
+        print(f"\n❌ File error: {e}")
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
 
 def main():
-    parser = argparse.ArgumentParser(description="Metagenomics Analysis Pipeline")
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        return batch_main(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Metagenomics Analysis Pipeline",
+                                     epilog="Several samples: metaquest batch sheet.tsv (see metaquest batch -h)")
     
     # Add the input file argument for FASTA
     parser.add_argument('input', nargs='?', help="Input FASTA file")
@@ -23,10 +119,10 @@ def main():
     fq_group.add_argument('-i','--interleaved', nargs=1, metavar=('reads.interleaved.fastq',),
                           help="Interleaved paired-end FASTQ in one file")
     parser.add_argument('-o', '--output', default='results', help="Output directory")
-    parser.add_argument('--check-only', action='store_true', 
-                       help="Only check dependencies and databases")
+    _add_run_options(parser)
     
     args = parser.parse_args()
+    _check_run_options(parser, args)
     
     try:
         print("=== Metagenomics Analysis Pipeline ===")
@@ -38,6 +134,8 @@ def main():
             print("\n✓ All checks passed!")
             exit(0)
         
+        resources = _resource_budget(args)
+        
         if args.type == 'fastq':
             # verify single or paired
             if args.reads:
@@ -45,7 +143,8 @@ def main():
                 if not Path(r1).exists(): raise FileNotFoundError(r1)
                 reads = [r1]
             elif args.interleaved:
-                # mark for de-interleaving
+                # streamed as pairs by run_kraken, never split on disk
+                if not Path(args.interleaved[0]).exists(): raise FileNotFoundError(args.interleaved[0])
                 reads = args.interleaved
             else:
                 r1 = args.reads1 and args.reads1[0]
@@ -56,14 +155,18 @@ def main():
                     if not Path(f).exists(): raise FileNotFoundError(f)
                 reads = [r1, r2]
             print(f"\nStarting FASTQ analysis of {reads}")
-            run_analysis(reads, 'fastq', args.output)
+            run_analysis(reads, 'fastq', args.output, resume=args.resume, rerun=args.rerun, resources=resources,
+                         interleaved=bool(args.interleaved), confidence_thresholds=args.confidence_sweep)
         else:  # FASTA type
             if not args.input:
                 raise ValueError("Input FASTA file is required for FASTA analysis")
             if not Path(args.input).exists():
                 raise FileNotFoundError(f"Input file not found: {args.input}")
             print(f"\nStarting FASTA analysis of {args.input}")
-            run_analysis([args.input], 'fasta', args.output)
+            run_analysis([args.input], 'fasta', args.output, resume=args.resume, rerun=args.rerun,
+                         screening_mode=args.screening_mode, resources=resources,
+                         blast_backend=args.blast_backend, blast_db=args.blast_db,
+                         sampling=args.sampling)
         
         print(f"\n🎉 Analysis complete! Results saved to {args.output}")
         
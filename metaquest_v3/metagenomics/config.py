@@ -28,10 +28,18 @@ CARD_PROTEIN_DB = DB_DIR / "pathogen_db" / "protein_fasta_protein_homolog_model.
 VFDB_DB = DB_DIR / "pathogen_db" / "VFDB_setB_pro.fas"
 VFDB_PROCESSED = DB_DIR / "pathogen_db" / "vfdb_virulence.faa"
 
+# PREBUILT DIAMOND INDEXES (built once from the FASTA sources above)
+DIAMOND_INDEX_DIR = DB_DIR / "diamond_index"
+
+# Local databases for offline FASTA taxonomy (--blast-backend)
+LOCAL_BLAST_DB = DB_DIR / "blast" / "nt"  # makeblastdb prefix
+LOCAL_DIAMOND_DB = DB_DIR / "blast" / "nr.dmnd"
+
 # TAXONOMY FILES (Multiple sources available)
 TAXDUMP_DIR = DB_DIR / "taxdump"
 TAXDUMP_CLEAN_DIR = DB_DIR / "taxdump_clean"  # Clean versions available
 TAX_DIR = DB_DIR / "tax"  # Alternative tax directory
+ACCESSION_INDEX_DIR = DB_DIR / "accession_index"  # Sorted accession -> taxid table built from the maps below
 
 # Use the cleanest available taxonomy files
 TAXDUMP_NODES = TAXDUMP_CLEAN_DIR / "nodes.dmp"
@@ -55,12 +63,34 @@ PATHOGEN_COLORS = {
 
     
 BLAST_CONFIG = {
-    'max_sequences_per_batch': 100,  # Limit to avoid API overload
+    'max_sequences_per_batch': 100,  # Sequences packed into one multi-FASTA request
+    'max_batch_bases': 100000,       # Total query length per request
+    'max_query_sequences': 1000,     # Sequences sampled from a FASTA for taxonomy
     'rate_limit_delay': 0.4,         # 400ms between requests (NCBI recommendation)
+    'max_in_flight': 4,              # Concurrent searches kept queued at NCBI
     'max_retries': 3,                # Retry failed requests
+    'retry_backoff': 5,              # Seconds before the first retry, doubled on each attempt
+    'url_base': 'https://blast.ncbi.nlm.nih.gov/Blast.cgi',  # BLAST URL API endpoint
+    'poll_interval': 60,             # Seconds between status checks of one search (NCBI: at most once a minute)
+    'max_search_wait': 3600,         # Seconds a submitted search may wait before it is resubmitted
+    'tool': 'metaquest',             # Identifies the pipeline to NCBI
+    'email': None,                   # Contact address NCBI asks heavy users to provide
     'timeout': 300,                  # 5 minute timeout per request
     'default_database': 'nt',        # Nucleotide database for FASTA
-    'cache_expiry_days': 30          # Cache results for 30 days
+    'backend': 'remote',             # 'remote' (NCBI), local 'megablast'/'blastn', or 'diamond' (blastx)
+    'local_batch_sequences': 5000,   # Sequences per local blastn/DIAMOND run
+    'cache_expiry_days': 30,         # Cache results for 30 days
+    'min_query_length': 50,          # Shorter sequences are not searched
+    'lca_top_percent': 10,           # Hits within this percent of a query's best bitscore vote in its LCA
+    'sampling': 'reservoir',         # How max_query_sequences are picked: 'head', 'reservoir' or 'length'
+    'sampling_seed': 42              # Fixed seed so reruns (and --resume) pick the same sample
+}
+
+# FASTQ streaming
+FASTQ_CONFIG = {
+    'buffer_size': 4 * 1024 * 1024,  # Read/write buffer for FASTQ and FASTA streams
+    'id_filter_mb': 256,             # Upper bound on the read ID de-duplication filter
+    'id_filter_fp_rate': 0.001       # Target share of unique reads the ID filter may rename
 }
 
 # Cache Configuration
@@ -68,4 +98,46 @@ CACHE_CONFIG = {
     'enable_blast_cache': True,
     'cache_size_limit_mb': 500,      # Maximum cache size
     'cleanup_on_startup': True       # Clean old cache entries
+}
+
+# Kraken2 per-read output (kraken_classified.txt) analysis
+KRAKEN_OUTPUT_CONFIG = {
+    'chunk_rows': 200000,            # Reads parsed at a time
+    'confidence_bins': 20            # Bins of the read confidence histogram
+}
+
+# Accession -> taxid index (accession_index.py)
+ACCESSION_INDEX_CONFIG = {
+    'key_bytes': 20,                 # Fixed key width; longer accessions are not indexed
+    'sort_rows': 20000000,           # Map entries sorted in memory per run while building
+    'merge_block_rows': 1000000      # Entries read from each run per merge step
+}
+
+# Krona charts (krona.py)
+KRONA_CONFIG = {
+    'resources': None,               # KronaTools directory or URL with Krona's JavaScript and images; None finds the installed krona package
+    'embed': True                    # Copy a local KronaTools' JavaScript and images into each chart so it opens offline
+}
+
+# AMR / virulence reports
+REPORT_CONFIG = {
+    'min_identity': 70,              # Hits below this percent identity are left out of reports
+    'max_evalue': 1e-10,             # Hits above this e-value are left out of reports
+    'chunk_rows': 500000,            # Hit table rows read at a time
+    'plot_points': 5000              # Top hits (by bitscore) drawn in per-hit scatter plots
+}
+
+# Pathogen / AMR / virulence screening
+SCREENING_CONFIG = {
+    'mode': 'separate',              # 'separate' blastx runs, one 'combined' pass, or 'protein' (blastp on Prokka ORFs)
+    'max_target_seqs': 0             # Combined-mode hit cap per query; 0 = all, so CAT hits cannot crowd out CARD/VFDB
+}
+
+# Multi-sample batch runs (metaquest batch)
+BATCH_CONFIG = {
+    'workers': None,                 # Samples analysed at once; None = one per 'threads_per_sample' CPU threads
+    'threads_per_sample': 8,         # CPU threads per sample used to size the default worker pool
+    'diamond_group_size': 8,         # Identical DIAMOND searches from this many samples run as one
+    'diamond_group_wait': 60,        # Max seconds a queued DIAMOND search waits for samples that may still join it
+    'page_cache_fraction': 0.5       # Kraken2 DB is memory-mapped when it fits in this share of the memory budget
 }
\ No newline at end of file
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from .config import *
+from .resources import stage_threads, diamond_resource_flags
+from .utils import exclusive_build
+
+_build_lock = threading.Lock()
+
+
+def source_checksum(fasta_path):
+    """SHA-256 of a source FASTA file"""
+    digest = hashlib.sha256()
+    with open(fasta_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_stamp(stamp_file):
+    if not stamp_file.exists():
+        return {}
+    try:
+        with open(stamp_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read index stamp {stamp_file}: {e}")
+        return {}
+
+
+def _write_json(path, data):
+    """Replace a JSON file atomically, through a temp file private to this writer"""
+    fd, tmp_file = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+
+
+def _stamp_matches(source_fasta, stamp):
+    """True when the source still has the size and mtime recorded in its stamp"""
+    stat = source_fasta.stat()
+    return stamp.get('size') == stat.st_size and stamp.get('mtime_ns') == stat.st_mtime_ns
+
+
+def _index_is_current(source_fasta, dmnd_file, stamp):
+    """Check a prebuilt index against its source, hashing only when the file looks changed"""
+    if not dmnd_file.exists() or not stamp:
+        return False, None
+
+    if _stamp_matches(source_fasta, stamp):
+        return True, None
+
+    checksum = source_checksum(source_fasta)
+    return checksum == stamp.get('sha256'), checksum
+
+
+def ensure_diamond_index(source_fasta, name):
+    """
+    Return the path (without .dmnd suffix) of a persistent DIAMOND index for a
+    protein FASTA, building it under DIAMOND_INDEX_DIR only when it is missing
+    or the source FASTA's checksum has changed. Builds hold an exclusive lock,
+    so concurrent callers wait for one build instead of repeating it.
+    """
+    source_fasta = Path(source_fasta)
+    if not source_fasta.exists():
+        print(f"Warning: Source FASTA not found at {source_fasta}")
+        return None
+
+    DIAMOND_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    db_prefix = DIAMOND_INDEX_DIR / name
+    dmnd_file = db_prefix.with_suffix('.dmnd')
+    stamp_file = db_prefix.with_suffix('.json')
+    if dmnd_file.exists() and _stamp_matches(source_fasta, _read_stamp(stamp_file)):
+        return db_prefix
+
+    # Concurrent scans, batch samples and other MetaQuest processes share the same index
+    with exclusive_build(DIAMOND_INDEX_DIR / f".{name}.lock", _build_lock):
+        # Another stage or process may have built it while we waited
+        current, checksum = _index_is_current(source_fasta, dmnd_file, _read_stamp(stamp_file))
+        if current:
+            # Source was touched but its content is unchanged - refresh the stamp
+            if checksum:
+                _write_stamp(stamp_file, source_fasta, checksum)
+            return db_prefix
+
+        print(f"Building DIAMOND index for {source_fasta.name} -> {dmnd_file}")
+        checksum = checksum or source_checksum(source_fasta)
+
+        # Build in a private directory so nobody ever sees a partial index
+        tmp_dir = Path(tempfile.mkdtemp(dir=DIAMOND_INDEX_DIR, prefix=f".{name}."))
+        try:
+            tmp_prefix = tmp_dir / name
+            cmd = f"diamond makedb --in {source_fasta} --db {tmp_prefix} --threads {stage_threads()}"
+            print(f"Running: {cmd}")
+            subprocess.run(cmd, shell=True, check=True)
+            os.replace(tmp_prefix.with_suffix('.dmnd'), dmnd_file)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        _write_stamp(stamp_file, source_fasta, checksum)
+        print(f"✓ DIAMOND index ready: {dmnd_file}")
+        return db_prefix
+
+
+def _write_stamp(stamp_file, source_fasta, checksum):
+    stat = source_fasta.stat()
+    stamp = {
+        'source': str(source_fasta),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': checksum
+    }
+    _write_json(stamp_file, stamp)
+
+
+def ensure_combined_screening_index(sources):
+    """
+    Build one DIAMOND index over several protein FASTA sources.
+
+    ``sources`` maps a source tag (e.g. 'pathogen', 'amr', 'vf') to its FASTA.
+    Every subject is renamed to ``<tag>|<original id>`` so hits can be split
+    back by source. The merged FASTA is only rewritten when one of the sources
+    changes; the index itself is managed by ensure_diamond_index.
+    """
+    sources = {tag: Path(path) for tag, path in sources.items() if Path(path).exists()}
+    if not sources:
+        return None
+
+    DIAMOND_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    name = "screening_" + "_".join(sorted(sources))
+    merged_fasta = DIAMOND_INDEX_DIR / f"{name}.faa"
+    sources_file = DIAMOND_INDEX_DIR / f"{name}.sources.json"
+
+    source_stamps = {}
+    for tag, path in sorted(sources.items()):
+        stat = path.stat()
+        source_stamps[tag] = {'source': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def merged_is_current():
+        return merged_fasta.exists() and _read_stamp(sources_file) == source_stamps
+
+    if not merged_is_current():
+        with exclusive_build(DIAMOND_INDEX_DIR / f".{name}.lock", _build_lock):
+            if not merged_is_current():
+                print(f"Merging screening databases ({', '.join(sorted(sources))}) -> {merged_fasta}")
+                fd, tmp_fasta = tempfile.mkstemp(dir=DIAMOND_INDEX_DIR, prefix=f".{merged_fasta.name}.",
+                                                 suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as out:
+                        for tag, path in sorted(sources.items()):
+                            with open(path, 'r') as f:
+                                for line in f:
+                                    if line.startswith('>'):
+                                        out.write(f">{tag}|{line[1:].lstrip()}")
+                                    else:
+                                        out.write(line)
+                    os.replace(tmp_fasta, merged_fasta)
+                except BaseException:
+                    os.unlink(tmp_fasta)
+                    raise
+
+                _write_json(sources_file, source_stamps)
+
+    return ensure_diamond_index(merged_fasta, name)
+
+
+def run_diamond(program, db, query, output, options, batch=None, timeout=None, search=None):
+    """
+    Run one DIAMOND search (blastx/blastp) of ``query`` against ``db``.
+
+    With ``batch`` (a batch.DiamondBatch handle), the search is queued and
+    run together with the same ``search`` (a batch.DIAMOND_STAGES name) from
+    other samples, so the database is loaded once per group; its hits still
+    end up in ``output``.
+    """
+    if batch is not None:
+        return batch(program, db, query, output, options, timeout, search)
+    cmd = f"diamond {program} -d {db} -q {query} -o {output} {options} {diamond_resource_flags()}"
+    print(f"Running: {cmd}")
+    subprocess.run(cmd, shell=True, check=True, timeout=timeout)
+    return output
@@ -0,0 +1,181 @@
+import mmap
+import os
+from pathlib import Path
+
+
+def index_path(fasta_path):
+    """Path of the .fai index next to a FASTA file"""
+    return Path(f"{fasta_path}.fai")
+
+
+def build_fasta_index(fasta_path, fai_path=None):
+    """
+    Write a samtools faidx compatible .fai index for an uncompressed FASTA.
+
+    Each line holds NAME, LENGTH, OFFSET (of the first base), LINEBASES and
+    LINEWIDTH (bases per line and bytes per line including the newline).
+    Like samtools, every line of a record except the last must have the same
+    length, otherwise the record cannot be addressed by offset.
+    """
+    fasta_path = Path(fasta_path)
+    fai_path = Path(fai_path or index_path(fasta_path))
+    entries = []
+    seen = set()
+
+    def finish(entry, line_lengths):
+        # line_lengths: (bases, bytes) for every sequence line of the record
+        name = entry[0]
+        for bases, width in line_lengths[:-1]:
+            if (bases, width) != line_lengths[0]:
+                raise ValueError(f"Different line length in sequence '{name}' of {fasta_path}")
+        if len(line_lengths) > 1 and line_lengths[-1][0] > line_lengths[0][0]:
+            raise ValueError(f"Different line length in sequence '{name}' of {fasta_path}")
+        entry[1] = sum(bases for bases, _ in line_lengths)
+        entry[3], entry[4] = line_lengths[0] if line_lengths else (0, 0)
+        entries.append(entry)
+
+    with open(fasta_path, 'rb') as f:
+        offset = 0
+        entry = None
+        line_lengths = []
+        for line in f:
+            if line.startswith(b'>'):
+                if entry:
+                    finish(entry, line_lengths)
+                name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ''
+                if name in seen:
+                    raise ValueError(f"Duplicate sequence name '{name}' in {fasta_path}")
+                seen.add(name)
+                entry = [name, 0, offset + len(line), 0, 0]
+                line_lengths = []
+            elif entry is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if bases:
+                    line_lengths.append((bases, len(line)))
+                elif line_lengths or line.strip():
+                    # A blank line inside a record breaks the fixed line layout
+                    line_lengths.append((0, len(line)))
+            offset += len(line)
+        if entry:
+            # Trailing blank lines at the end of the last record are harmless
+            while line_lengths and line_lengths[-1][0] == 0:
+                line_lengths.pop()
+            finish(entry, line_lengths)
+
+    tmp_path = fai_path.with_suffix('.fai.tmp')
+    with open(tmp_path, 'w') as out:
+        for name, length, seq_offset, line_bases, line_width in entries:
+            out.write(f"{name}\t{length}\t{seq_offset}\t{line_bases}\t{line_width}\n")
+    os.replace(tmp_path, fai_path)
+    return fai_path
+
+
+def read_fasta_index(fai_path):
+    """Load a .fai index as {name: (length, offset, line_bases, line_width)}"""
+    index = {}
+    with open(fai_path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 5:
+                index[fields[0]] = tuple(int(value) for value in fields[1:5])
+    return index
+
+
+class IndexedFasta:
+    """
+    Random access to the sequences of an uncompressed FASTA file by ID.
+
+    The file is memory-mapped and located through its .fai index, which is
+    built (or rebuilt when older than the FASTA) on first use. ``fetch``
+    returns a sequence or region as a string; ``raw`` returns a zero-copy
+    memoryview when the region lies on a single line (always the case for
+    single-line FASTA) and falls back to a copy without newlines otherwise.
+    Coordinates are 0-based and half-open, like Python slices.
+
+        with IndexedFasta("contigs.fasta") as fasta:
+            seq = fasta.fetch("contig_12", 100, 250)
+    """
+
+    def __init__(self, fasta_path, rebuild=False):
+        self.fasta_path = Path(fasta_path)
+        fai_path = index_path(self.fasta_path)
+        if rebuild or not fai_path.exists() or fai_path.stat().st_mtime < self.fasta_path.stat().st_mtime:
+            build_fasta_index(self.fasta_path, fai_path)
+        self.index = read_fasta_index(fai_path)
+
+        self._file = open(self.fasta_path, 'rb')
+        if os.path.getsize(self.fasta_path):
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+        else:
+            self._map = None
+            self._view = memoryview(b'')
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def length(self, name):
+        return self.index[name][0]
+
+    def _bounds(self, name, start, end):
+        if name not in self.index:
+            raise KeyError(f"Sequence '{name}' not found in {self.fasta_path}")
+        length = self.index[name][0]
+        start = max(0, start or 0)
+        end = length if end is None else min(end, length)
+        return start, max(start, end)
+
+    def _position(self, name, base):
+        # Byte offset of a base within the file
+        _, offset, line_bases, line_width = self.index[name]
+        if not line_bases:
+            return offset
+        line, column = divmod(base, line_bases)
+        return offset + line * line_width + column
+
+    def raw(self, name, start=0, end=None):
+        """
+        Bases start:end of a sequence as a memoryview, without copying when
+        possible. Views into the mapped file must be dropped before close().
+        """
+        start, end = self._bounds(name, start, end)
+        if start == end:
+            return memoryview(b'')
+        line_bases = self.index[name][2]
+        first = self._position(name, start)
+        if start // line_bases == (end - 1) // line_bases:
+            return self._view[first:first + end - start]
+
+        # Spans several lines: copy and drop the line breaks
+        last = self._position(name, end - 1) + 1
+        return memoryview(bytes(self._view[first:last]).replace(b'\r', b'').replace(b'\n', b''))
+
+    def fetch(self, name, start=0, end=None):
+        """Bases start:end (0-based, end exclusive) of a sequence as a string"""
+        return bytes(self.raw(name, start, end)).decode('ascii')
+
+    def fetch_region(self, region):
+        """Fetch a samtools-style region: 'name', 'name:start' or 'name:start-end' (1-based, inclusive)"""
+        if region in self.index:
+            return self.fetch(region)
+        name, _, span = region.rpartition(':')
+        start, _, end = span.replace(',', '').partition('-')
+        return self.fetch(name, int(start) - 1, int(end) if end else None)
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
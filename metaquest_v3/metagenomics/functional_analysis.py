@@ -4,16 +4,19 @@ import pandas as pd
 from pathlib import Path
 from .config import *
 from .utils import check_dependencies, parse_prokka_gff
+from .resources import stage_threads
+from .hit_tables import SWISSPROT_COLUMNS, write_hit_parquet
+from .diamond_index import run_diamond
 
 def run_prokka(fasta_path, output_dir):
     """Run Prokka for gene prediction and annotation"""
     prokka_dir = output_dir/"prokka_annotation"
-    cmd = f"prokka --outdir {prokka_dir} --prefix sample --cpus 12 --force {fasta_path}"
+    cmd = f"prokka --outdir {prokka_dir} --prefix sample --cpus {stage_threads()} --force {fasta_path}"
     print(f"Running: {cmd}")
     subprocess.run(cmd, shell=True, check=True)
     return prokka_dir
 
-def run_swissprot_annotation(prokka_dir, output_dir):
+def run_swissprot_annotation(prokka_dir, output_dir, diamond_batch=None):
     """Annotate proteins against SwissProt database"""
     swissprot_out = output_dir/"swissprot_annotation.tsv"
     protein_file = prokka_dir/"sample.faa"
@@ -22,10 +25,8 @@ def run_swissprot_annotation(prokka_dir, output_dir):
         print(f"Warning: Protein file {protein_file} not found")
         return None
     
-    cmd = f"diamond blastp -d {SWISSPROT_DB} -q {protein_file} -o {swissprot_out} " \
-          "--outfmt 6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore stitle " \
-          "--top 1 --evalue 1e-5 --threads 4"
-    
-    print(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=True)
+    run_diamond('blastp', SWISSPROT_DB, protein_file, swissprot_out,
+                "--outfmt 6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore stitle "
+                "--top 1 --evalue 1e-5", batch=diamond_batch, search='swissprot')
+    write_hit_parquet(swissprot_out, SWISSPROT_COLUMNS)
     return swissprot_out
\ No newline at end of file
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from .config import REPORT_CONFIG
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Column layouts of the DIAMOND --outfmt 6 tables written by the pipeline
+HIT_COLUMNS = ['qseqid', 'sseqid', 'pident', 'length', 'evalue', 'bitscore', 'stitle']
+SWISSPROT_COLUMNS = ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen',
+                     'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore', 'stitle']
+
+# Coordinates and counts fit int32; scores stay float64 so values written
+# to the JSON reports remain plain Python floats
+COLUMN_TYPES = {
+    'qseqid': 'string', 'sseqid': 'string', 'stitle': 'string',
+    'pident': 'float64', 'bitscore': 'float64', 'evalue': 'float64',
+    'length': 'int32', 'mismatch': 'int32', 'gapopen': 'int32',
+    'qstart': 'int32', 'qend': 'int32', 'sstart': 'int32', 'send': 'int32'
+}
+
+PARQUET_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def parquet_path(hits_file):
+    """Columnar copy of a hit table: amr_hits.txt -> amr_hits.parquet"""
+    return Path(hits_file).with_suffix('.parquet')
+
+
+def _arrow_schema(columns):
+    return pa.schema([(column, getattr(pa, COLUMN_TYPES[column])()) for column in columns])
+
+
+def _has_hits(hits_file):
+    # Empty files and '# No ... hits' placeholders carry no rows
+    with open(hits_file, 'rb') as f:
+        first = f.read(1)
+    return first not in (b'', b'#')
+
+
+def _with_column_types(df):
+    # pyarrow strings come back as object or NaN-backed str columns; match the TSV reader
+    return df.astype({column: COLUMN_TYPES[column] for column in df.columns})
+
+
+def write_hit_parquet(hits_file, columns=HIT_COLUMNS):
+    """
+    Write a typed, zstd-compressed Parquet copy of a headerless DIAMOND table.
+
+    The TSV is converted block by block, so memory stays bounded on large
+    tables. Returns the Parquet path, or None when pyarrow is not installed
+    (consumers then fall back to the TSV).
+    """
+    if pa is None:
+        return None
+
+    hits_file = Path(hits_file)
+    out_file = parquet_path(hits_file)
+    tmp_file = out_file.with_suffix('.parquet.tmp')
+    schema = _arrow_schema(columns)
+
+    try:
+        with pq.ParquetWriter(tmp_file, schema, compression='zstd') as writer:
+            if _has_hits(hits_file):
+                reader = pa_csv.open_csv(
+                    hits_file,
+                    read_options=pa_csv.ReadOptions(column_names=columns, block_size=PARQUET_BLOCK_SIZE),
+                    parse_options=pa_csv.ParseOptions(delimiter='\t', quote_char=False),
+                    convert_options=pa_csv.ConvertOptions(column_types=schema)
+                )
+                for batch in reader:
+                    writer.write_batch(batch)
+        tmp_file.replace(out_file)
+        return out_file
+    except Exception as e:
+        print(f"Warning: Could not write Parquet copy of {hits_file}: {e}")
+        if tmp_file.exists():
+            tmp_file.unlink()
+        return None
+
+
+def load_hits(hits_file, columns=HIT_COLUMNS, usecols=None):
+    """
+    Load a DIAMOND hit table, reading only ``usecols``.
+
+    Uses the Parquet copy when it is present and up to date, otherwise parses
+    the TSV with the same column types.
+    """
+    hits_file = Path(hits_file)
+    usecols = list(usecols or columns)
+    columnar = parquet_path(hits_file)
+
+    if (pa is not None and columnar.exists()
+            and columnar.stat().st_mtime >= hits_file.stat().st_mtime):
+        return _with_column_types(pd.read_parquet(columnar, columns=usecols))
+
+    if not _has_hits(hits_file):
+        return pd.DataFrame({column: pd.Series(dtype=COLUMN_TYPES[column]) for column in usecols})
+    df = pd.read_csv(hits_file, sep='\t', names=columns, header=None, usecols=usecols,
+                     dtype={column: COLUMN_TYPES[column] for column in usecols},
+                     quoting=3, float_precision='round_trip')
+    return df[usecols]
+
+
+class FilteredHits:
+    """
+    Stream a DIAMOND hit table in chunks, keeping rows with
+    pident >= min_pident and evalue <= max_evalue.
+
+    Reads the Parquet copy batch by batch when it is current, otherwise the
+    TSV with pd.read_csv(chunksize=...), so only one chunk of the raw table
+    is in memory at a time. ``rows_read`` and ``rows_kept`` count the rows
+    seen so far.
+    """
+
+    def __init__(self, hits_file, columns=HIT_COLUMNS, usecols=None, min_pident=None,
+                 max_evalue=None, chunk_rows=None):
+        self.hits_file = Path(hits_file)
+        self.columns = columns
+        self.usecols = list(usecols or columns)
+        self.min_pident = REPORT_CONFIG['min_identity'] if min_pident is None else min_pident
+        self.max_evalue = REPORT_CONFIG['max_evalue'] if max_evalue is None else max_evalue
+        self.chunk_rows = chunk_rows or REPORT_CONFIG['chunk_rows']
+        self.rows_read = 0
+        self.rows_kept = 0
+
+    def _raw_chunks(self):
+        # The filter columns are read even when the caller does not need them
+        readcols = self.usecols + [column for column in ('pident', 'evalue') if column not in self.usecols]
+        columnar = parquet_path(self.hits_file)
+        if (pa is not None and columnar.exists()
+                and columnar.stat().st_mtime >= self.hits_file.stat().st_mtime):
+            for batch in pq.ParquetFile(columnar).iter_batches(batch_size=self.chunk_rows, columns=readcols):
+                yield _with_column_types(batch.to_pandas())
+        elif _has_hits(self.hits_file):
+            yield from pd.read_csv(self.hits_file, sep='\t', names=self.columns, header=None,
+                                   usecols=readcols, dtype={column: COLUMN_TYPES[column] for column in readcols},
+                                   quoting=3, float_precision='round_trip', chunksize=self.chunk_rows)
+
+    def __iter__(self):
+        for chunk in self._raw_chunks():
+            self.rows_read += len(chunk)
+            chunk = chunk[(chunk['pident'] >= self.min_pident) & (chunk['evalue'] <= self.max_evalue)]
+            self.rows_kept += len(chunk)
+            if len(chunk):
+                yield chunk[self.usecols]
+
+
+class TopHits:
+    """Running top-N rows by a column; ties keep the earliest rows, like DataFrame.nlargest"""
+
+    def __init__(self, n, column='bitscore'):
+        self.n = n
+        self.column = column
+        self.rows = None
+
+    def update(self, chunk):
+        best = chunk.nlargest(self.n, self.column)
+        merged = best if self.rows is None else pd.concat([self.rows, best])
+        self.rows = merged.nlargest(self.n, self.column)
+
+    def result(self, n=None):
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.head(n or self.n)
+
+
+class Histogram:
+    """Fixed-bin histogram accumulated over chunks"""
+
+    def __init__(self, start, stop, bins):
+        self.edges = np.linspace(start, stop, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        self.counts += np.histogram(values, bins=self.edges)[0]
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
@@ -0,0 +1,49 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+class KeywordClassifier:
+    """
+    Assign each text to the first category whose keywords it contains.
+
+    ``categories`` maps a category name to its keywords, in priority order.
+    Each category is compiled into one alternation regex and evaluated over
+    the whole column at once; np.select then keeps the first matching
+    category per row, so the result equals looping over the categories in
+    order and stopping at the first hit. Texts are lowercased before
+    matching and keywords are used as given, so a keyword with capitals
+    never matches, exactly as with ``keyword in text.lower()``.
+    """
+
+    def __init__(self, categories, default='other'):
+        self.categories = list(categories)
+        self.default = default
+        self.patterns = [re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+                         for keywords in categories.values()]
+
+    def classify(self, texts):
+        """Return a Series with the category of each text"""
+        texts = pd.Series(texts)
+        if texts.empty:
+            return pd.Series([], index=texts.index, dtype=object)
+        lowered = texts.astype(str).str.lower()
+        conditions = [lowered.str.contains(pattern, regex=True).to_numpy(dtype=bool)
+                      for pattern in self.patterns]
+        labels = np.select(conditions, self.categories, default=self.default)
+        return pd.Series(labels, index=texts.index, dtype=object)
+
+    def group(self, df, text_column, fields):
+        """
+        Classify ``df[text_column]`` and return {category: [records]}.
+
+        ``fields`` maps output keys to DataFrame columns. Categories appear in
+        order of their first row and records keep the row order, as when the
+        dict is filled row by row.
+        """
+        if df.empty:
+            return {}
+        labels = self.classify(df[text_column])
+        records = df[list(fields.values())].rename(columns={column: key for key, column in fields.items()})
+        return {category: group.to_dict('records')
+                for category, group in records.groupby(labels, sort=False)}
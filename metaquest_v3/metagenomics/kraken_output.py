@@ -0,0 +1,399 @@
+import json
+import numpy as np
+import pandas as pd
+from collections import Counter
+from pathlib import Path
+from .config import *
+from .taxonomy import (load_taxonomy, ancestor_at_depth, lowest_common_ancestor, in_clade, group_lca,
+                       clade_counts, _parents, _depths, _group_starts)
+
+KRAKEN_OUTPUT_COLUMNS = ['status', 'read_id', 'taxid', 'length', 'kmers']
+KRAKEN_REPORT_COLUMNS = ['percentage', 'clade_reads', 'taxon_reads', 'rank', 'taxid', 'name']
+
+# Binary read -> taxid array written next to kraken_classified.txt
+READ_TAXIDS_NAME = "kraken_read_taxids.u32"
+
+
+def parse_kraken_report(report_file):
+    """
+    Load a Kraken2 report with each taxon's depth and parent taxid.
+
+    The tree is recovered from the name indentation (two spaces per level),
+    so a report is enough to place the taxa it lists in their clades.
+    """
+    rows = []
+    stack = []  # (depth, taxid) of the current lineage
+    with open(report_file, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 6:
+                continue
+            # Reports written with --report-minimizer-data carry two extra columns
+            percentage, clade_reads, taxon_reads = fields[0], fields[1], fields[2]
+            rank, taxid, raw_name = fields[-3], fields[-2], fields[-1]
+            name = raw_name.lstrip(' ')
+            depth = (len(raw_name) - len(name)) // 2
+            while stack and stack[-1][0] >= depth:
+                stack.pop()
+            parent = stack[-1][1] if stack else 0
+            stack.append((depth, int(taxid)))
+            rows.append((float(percentage), int(clade_reads), int(taxon_reads), rank.strip(),
+                         int(taxid), name, depth, parent))
+    return pd.DataFrame(rows, columns=KRAKEN_REPORT_COLUMNS + ['depth', 'parent'])
+
+
+class ReportTree:
+    """
+    Taxonomy tree of the taxa listed in a Kraken2 report, as NumPy arrays.
+
+    Nodes are numbered in report order; ``parent`` holds the parent node
+    (-1 at the root), ``depth`` the distance from the root. ``index`` maps
+    taxids to nodes vectorized, returning -1 for taxa not in the report.
+    """
+
+    def __init__(self, report):
+        report = report[report['taxid'] > 0]
+        self.taxids = report['taxid'].to_numpy(dtype=np.int64)
+        self.names = report['name'].to_numpy(dtype=object)
+        self.ranks = report['rank'].to_numpy(dtype=object)
+        self._order = np.argsort(self.taxids, kind='stable')
+        self._sorted = self.taxids[self._order]
+        self.parent = self.index(report['parent'].to_numpy(dtype=np.int64))
+        self.depth = report['depth'].to_numpy(dtype=np.int64) - (report['depth'].min() if len(report) else 0)
+
+    @classmethod
+    def from_report(cls, report_file):
+        return cls(parse_kraken_report(report_file))
+
+    def index(self, taxids):
+        """Node index of each taxid, -1 when unknown"""
+        taxids = np.asarray(taxids, dtype=np.int64)
+        if not len(self._sorted):
+            return np.full(taxids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, taxids), len(self._sorted) - 1)
+        return np.where(self._sorted[pos] == taxids, self._order[pos], -1)
+
+    @property
+    def max_depth(self):
+        return int(self.depth.max()) if len(self.depth) else 0
+
+    def name(self, node):
+        return self.names[node] if node >= 0 else ''
+
+    def rank_code(self, node):
+        return self.ranks[node] if node >= 0 else ''
+
+
+def load_kraken_tree(report_file):
+    """The NCBI taxonomy when installed, else the tree recovered from the Kraken2 report"""
+    return load_taxonomy() or ReportTree.from_report(report_file)
+
+
+def iter_kraken_output(classified_file, chunk_rows=None):
+    """
+    Stream Kraken2 per-read output as DataFrames with the call's taxid and
+    the total read length (mates summed for paired reads).
+    """
+    chunks = pd.read_csv(classified_file, sep='\t', header=None, names=KRAKEN_OUTPUT_COLUMNS,
+                         dtype=str, quoting=3, keep_default_na=False,
+                         chunksize=chunk_rows or KRAKEN_OUTPUT_CONFIG['chunk_rows'])
+    for chunk in chunks:
+        taxid = pd.to_numeric(chunk['taxid'], errors='coerce')
+        if taxid.isna().any():
+            # --use-names output: "Escherichia coli (taxid 562)"
+            extracted = chunk['taxid'].str.extract(r'taxid (\d+)\)\s*$')[0]
+            taxid = taxid.fillna(pd.to_numeric(extracted, errors='coerce'))
+        chunk['taxid'] = taxid.fillna(0).astype(np.int64)
+
+        mates = chunk['length'].str.partition('|')
+        chunk['length'] = (pd.to_numeric(mates[0], errors='coerce').fillna(0)
+                           + pd.to_numeric(mates[2], errors='coerce').fillna(0)).astype(np.int64)
+        yield chunk.reset_index(drop=True)
+
+
+def explode_kmers(chunk):
+    """
+    Split the k-mer LCA strings of a chunk into (row, taxid, count) arrays.
+
+    Ambiguous ('A') k-mers are returned separately as per-row counts since
+    Kraken2 leaves them out of the confidence denominator; the paired-end
+    '|:|' separator is dropped.
+    """
+    kmers = chunk['kmers'].str.replace('|:|', ' ', regex=False)
+    pairs_per_row = kmers.str.count(':').to_numpy()
+    rows = np.repeat(np.arange(len(chunk)), pairs_per_row)
+
+    # Parse every "taxid:count" of the chunk in one C-level pass; 'A' becomes -1
+    text = ' '.join(kmers).replace('A:', '-1:').replace(':', ' ')
+    values = np.fromstring(text, dtype=np.int64, sep=' ').reshape(-1, 2)
+    taxids, counts = values[:, 0], values[:, 1]
+
+    ambiguous = taxids < 0
+    ambiguous_counts = np.bincount(rows[ambiguous], weights=counts[ambiguous],
+                                   minlength=len(chunk)).astype(np.int64)
+    return rows[~ambiguous], taxids[~ambiguous], counts[~ambiguous], ambiguous_counts
+
+
+def read_confidence(tree, chunk):
+    """
+    Kraken2 confidence score of each read's call: the share of its
+    non-ambiguous k-mers that map inside the called taxon's clade.
+    """
+    rows, taxids, counts, _ = explode_kmers(chunk)
+    total = np.bincount(rows, weights=counts, minlength=len(chunk))
+    calls = tree.index(chunk['taxid'].to_numpy())
+    inside = in_clade(tree, tree.index(taxids), calls[rows])
+    clade = np.bincount(rows, weights=counts * inside, minlength=len(chunk))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, clade / total, 0.0)
+
+
+def classify_reads(tree, chunk, thresholds):
+    """
+    Repeat Kraken2's per-read classification at each confidence threshold.
+
+    As in Kraken2, every taxon hit by a read scores the k-mers on its
+    root-to-leaf path, the best-scoring taxon is called (the LCA of the
+    tied ones), and the call then climbs towards the root until its clade
+    holds at least ceil(threshold * k-mers) of the read's non-ambiguous
+    k-mers, or the read is left unclassified. Returns an array of node
+    indices of shape (len(thresholds), len(chunk)), -1 for unclassified.
+    K-mers mapped to taxa outside ``tree`` count towards the total only.
+    """
+    n = len(chunk)
+    calls = np.full((len(thresholds), n), -1, dtype=np.int64)
+    rows, taxids, counts, _ = explode_kmers(chunk)
+    total = np.bincount(rows, weights=counts, minlength=n)
+
+    # Hit count of each (read, taxon) pair, sorted by read then node
+    nodes = tree.index(taxids)
+    placed = nodes >= 0
+    size = len(tree.taxids)
+    keys, inverse = np.unique(rows[placed] * size + nodes[placed], return_inverse=True)
+    if not len(keys):
+        return calls
+    hits = np.bincount(inverse, weights=counts[placed]).astype(np.int64)
+    rows, nodes = keys // size, keys % size
+
+    # Root-to-leaf score: the hits on the taxon and on each of its ancestors
+    score = hits.copy()
+    ancestor = _parents(tree, nodes)
+    for _ in range(tree.max_depth):
+        present = ancestor >= 0
+        if not present.any():
+            break
+        lookup = rows * size + np.maximum(ancestor, 0)
+        pos = np.minimum(np.searchsorted(keys, lookup), len(keys) - 1)
+        score += np.where(present & (keys[pos] == lookup), hits[pos], 0)
+        ancestor = _parents(tree, ancestor)
+
+    # Highest score per read; ties resolve to the LCA of the tied taxa
+    starts = _group_starts(rows)
+    best = np.repeat(np.maximum.reduceat(score, starts), np.diff(np.r_[starts, len(rows)]))
+    tied = score == best
+    call = np.full(n, -1, dtype=np.int64)
+    called_rows, call_nodes = group_lca(tree, rows[tied], nodes[tied])
+    call[called_rows] = call_nodes
+
+    # Depth of the deepest clade around the call that holds each pair; the
+    # clade of the call's ancestor at depth d scores the hits with depth >= d
+    shared = _depths(tree, lowest_common_ancestor(tree, nodes, call[rows]))
+    order = np.lexsort((-shared, rows))
+    rows, shared, hits = rows[order], shared[order], hits[order]
+    cumulative = np.cumsum(hits)
+    starts = _group_starts(rows)
+    cumulative -= np.repeat(cumulative[starts] - hits[starts], np.diff(np.r_[starts, len(rows)]))
+
+    for i, threshold in enumerate(thresholds):
+        required = np.ceil(threshold * total)[rows]
+        reached = np.flatnonzero(cumulative >= required)
+        read_ids, first = np.unique(rows[reached], return_index=True)
+        depth = shared[reached[first]]
+        keep = depth >= 0
+        read_ids, depth = read_ids[keep], depth[keep]
+        calls[i, read_ids] = ancestor_at_depth(tree, call[read_ids], depth)
+    return calls
+
+
+def write_kraken_report(tree, node_reads, unclassified, report_file):
+    """
+    Write a Kraken2-format report from the reads assigned to each tree node.
+
+    Clade counts are summed up the tree; taxa are listed depth-first with
+    children by decreasing clade size, names indented two spaces per level.
+    """
+    node_reads = np.asarray(node_reads, dtype=np.int64)
+    clade = clade_counts(tree, node_reads)
+
+    total = int(unclassified) + int(clade[tree.parent < 0].sum())
+    present = np.flatnonzero(clade > 0)
+    children = {}
+    for node in present[np.lexsort((-clade[present], tree.parent[present]))]:
+        children.setdefault(int(tree.parent[node]), []).append(int(node))
+
+    def line(clade_reads, taxon_reads, rank, taxid, name, depth):
+        percentage = 100.0 * clade_reads / total if total else 0.0
+        return f"{percentage:6.2f}\t{clade_reads}\t{taxon_reads}\t{rank}\t{taxid}\t{'  ' * depth}{name}\n"
+
+    with open(report_file, 'w') as f:
+        if unclassified:
+            f.write(line(unclassified, unclassified, 'U', 0, 'unclassified', 0))
+        stack = list(reversed(children.get(-1, [])))
+        while stack:
+            node = stack.pop()
+            f.write(line(clade[node], node_reads[node], tree.rank_code(node),
+                         tree.taxids[node], tree.name(node), tree.depth[node]))
+            stack.extend(reversed(children.get(node, [])))
+    return report_file
+
+
+def rescore_kraken_output(classified_file, report_file, output_dir, thresholds, tree=None):
+    """
+    Reclassify the reads of kraken_classified.txt at new --confidence values.
+
+    All thresholds are evaluated in one pass over the per-read output. Each
+    one gets a confidence_<value>/ directory holding a Kraken2-format
+    kraken_report.txt (ready for Bracken) and kraken_read_taxids.u32;
+    kraken_confidence_sweep.tsv compares classified reads and taxa across
+    thresholds. Kraken2's --minimum-hit-groups filter cannot be reproduced
+    from the output and is not applied. Returns the report paths in
+    threshold order.
+    """
+    classified_file = Path(classified_file)
+    output_dir = Path(output_dir)
+    if not classified_file.exists():
+        print(f"Warning: Kraken2 output {classified_file} not found")
+        return None
+    thresholds = [float(threshold) for threshold in thresholds]
+    for threshold in thresholds:
+        if not 0 <= threshold <= 1:
+            raise ValueError(f"Confidence threshold must be between 0 and 1, got {threshold}")
+    if len(set(thresholds)) < len(thresholds):
+        raise ValueError("Confidence thresholds must be distinct")
+
+    tree = tree if tree is not None else load_kraken_tree(report_file)
+    # Full precision, so close thresholds (0.101, 0.104) get separate directories
+    sweep_dirs = [output_dir / f"confidence_{threshold}" for threshold in thresholds]
+    node_reads = np.zeros((len(thresholds), len(tree.taxids)), dtype=np.int64)
+    unclassified = np.zeros(len(thresholds), dtype=np.int64)
+    taxids_outs = []
+    for sweep_dir in sweep_dirs:
+        sweep_dir.mkdir(parents=True, exist_ok=True)
+        taxids_outs.append(open(sweep_dir / READ_TAXIDS_NAME, 'wb'))
+
+    try:
+        for chunk in iter_kraken_output(classified_file):
+            calls = classify_reads(tree, chunk, thresholds)
+            for i, out in enumerate(taxids_outs):
+                called = calls[i] >= 0
+                unclassified[i] += int((~called).sum())
+                node_reads[i] += np.bincount(calls[i][called], minlength=len(tree.taxids))
+                np.where(called, tree.taxids[np.maximum(calls[i], 0)], 0).astype('<u4').tofile(out)
+    finally:
+        for out in taxids_outs:
+            out.close()
+
+    reports = []
+    sweep = []
+    for i, (threshold, sweep_dir) in enumerate(zip(thresholds, sweep_dirs)):
+        reports.append(write_kraken_report(tree, node_reads[i], unclassified[i],
+                                           sweep_dir / "kraken_report.txt"))
+        classified_reads = int(node_reads[i].sum())
+        total = classified_reads + int(unclassified[i])
+        sweep.append({
+            'confidence': threshold,
+            'classified_reads': classified_reads,
+            'unclassified_reads': int(unclassified[i]),
+            'classified_percent': 100.0 * classified_reads / total if total else 0.0,
+            'taxa': int((node_reads[i] > 0).sum())
+        })
+        print(f"✓ Confidence {threshold}: {classified_reads}/{total} reads classified")
+
+    pd.DataFrame(sweep).to_csv(output_dir / "kraken_confidence_sweep.tsv", sep='\t', index=False,
+                               float_format='%.6g')
+    return reports
+
+
+def load_read_taxids(path):
+    """Memory-map a read -> taxid array written by summarize_kraken_output"""
+    return np.memmap(path, dtype='<u4', mode='r')
+
+
+def summarize_kraken_output(classified_file, report_file, output_dir, tree=None):
+    """
+    Aggregate kraken_classified.txt in one pass and bounded memory.
+
+    Writes kraken_output_summary.json (classified/unclassified read-length
+    histograms and the read confidence distribution), kraken_taxon_counts.tsv
+    (reads and mean confidence per taxon) and kraken_read_taxids.u32, a
+    little-endian uint32 array with the taxid of each read in file order.
+    ``tree`` defaults to the NCBI taxonomy, or the Kraken2 report's tree.
+    """
+    classified_file = Path(classified_file)
+    output_dir = Path(output_dir)
+    if not classified_file.exists():
+        print(f"Warning: Kraken2 output {classified_file} not found")
+        return None
+
+    tree = tree if tree is not None else load_kraken_tree(report_file)
+    bins = KRAKEN_OUTPUT_CONFIG['confidence_bins']
+    confidence_hist = np.zeros(bins, dtype=np.int64)
+    taxon_reads = Counter()
+    taxon_confidence = Counter()
+    lengths = {'classified': Counter(), 'unclassified': Counter()}
+    reads = 0
+
+    taxids_file = output_dir / READ_TAXIDS_NAME
+    with open(taxids_file, 'wb') as taxids_out:
+        for chunk in iter_kraken_output(classified_file):
+            reads += len(chunk)
+            chunk['taxid'].to_numpy().astype('<u4').tofile(taxids_out)
+
+            classified = chunk['status'] == 'C'
+            lengths['classified'].update(chunk.loc[classified, 'length'].value_counts().to_dict())
+            lengths['unclassified'].update(chunk.loc[~classified, 'length'].value_counts().to_dict())
+
+            called = chunk[classified].reset_index(drop=True)
+            if called.empty:
+                continue
+            confidence = read_confidence(tree, called)
+            confidence_hist += np.histogram(confidence, bins=bins, range=(0, 1))[0]
+
+            per_taxon = pd.DataFrame({'taxid': called['taxid'], 'confidence': confidence})
+            grouped = per_taxon.groupby('taxid')['confidence'].agg(['size', 'sum'])
+            taxon_reads.update(grouped['size'].to_dict())
+            taxon_confidence.update(grouped['sum'].to_dict())
+
+    nodes = tree.index(list(taxon_reads))
+    taxon_table = pd.DataFrame({
+        'taxid': list(taxon_reads),
+        'name': [tree.name(node) for node in nodes],
+        'rank': [tree.rank_code(node) for node in nodes],
+        'reads': list(taxon_reads.values()),
+        'mean_confidence': [taxon_confidence[taxid] / count for taxid, count in taxon_reads.items()]
+    }).sort_values('reads', ascending=False)
+    taxon_table.to_csv(output_dir / "kraken_taxon_counts.tsv", sep='\t', index=False, float_format='%.4f')
+
+    classified_reads = int(sum(lengths['classified'].values()))
+    edges = np.linspace(0, 1, bins + 1)
+    summary = {
+        'total_reads': reads,
+        'classified_reads': classified_reads,
+        'unclassified_reads': reads - classified_reads,
+        'taxa': len(taxon_reads),
+        'read_length_histogram': {
+            status: {str(length): int(count) for length, count in sorted(counts.items())}
+            for status, counts in lengths.items()
+        },
+        'confidence_histogram': {
+            'bin_edges': [round(edge, 4) for edge in edges],
+            'reads': confidence_hist.tolist()
+        },
+        'read_taxids': str(taxids_file)
+    }
+    summary_file = output_dir / "kraken_output_summary.json"
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"✓ Summarized {reads} Kraken2 reads ({classified_reads} classified, {len(taxon_reads)} taxa)")
+    return summary_file
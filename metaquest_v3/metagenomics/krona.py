@@ -0,0 +1,203 @@
+import os
+import re
+import sys
+import base64
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+from .config import KRONA_CONFIG
+from .taxonomy import load_taxonomy, clade_counts
+from .kraken_output import ReportTree, parse_kraken_report
+
+KRONA_PAGE = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <meta charset="utf-8"/>
+  <link rel="shortcut icon" href="{favicon}"/>
+  <script id="notfound">window.onload=function(){{document.body.innerHTML="Could not get resources from \\"{resources}\\"."}}</script>
+  {script}
+ </head>
+ <body>
+  <img id="hiddenImage" src="{hidden}" style="display:none"/>
+  <img id="loadingImage" src="{loading}" style="display:none"/>
+  <noscript>Javascript must be enabled to view this page.</noscript>
+  <div style="display:none">
+{chart}
+  </div>
+ </body>
+</html>
+"""
+
+TAXID_URL = "https://www.ncbi.nlm.nih.gov/Taxonomy/Browser/wwwtax.cgi?mode=Info&amp;id="
+
+# Used when no KronaTools is installed; charts then need internet access to open
+KRONA_WEB_RESOURCES = "https://marbl.github.io/Krona"
+KRONA_SCRIPT = Path("src") / "krona-2.0.js"
+KRONA_IMAGES = {'favicon': ('favicon.ico', 'image/x-icon'), 'hidden': ('hidden.png', 'image/png'),
+                'loading': ('loading.gif', 'image/gif')}
+
+
+def find_kronatools():
+    """Root of the installed KronaTools (holding src/krona-2.0.js and img/), or None"""
+    candidates = []
+    script = shutil.which('ktImportText')
+    if script:
+        # bioconda links bin/ktImportText to opt/krona/scripts/ImportText.pl
+        candidates.append(Path(script).resolve().parent.parent)
+    for prefix in (os.environ.get('CONDA_PREFIX'), sys.prefix):
+        if prefix:
+            candidates.append(Path(prefix) / "opt" / "krona")
+    for root in candidates:
+        if (root / KRONA_SCRIPT).is_file():
+            return root
+    return None
+
+
+def krona_page(chart):
+    """
+    The HTML page for a Krona XML chart.
+
+    Krona's JavaScript and images come from KRONA_CONFIG['resources'], or
+    the installed KronaTools when that is unset. From a local directory they
+    are embedded in the page (like ktImportText does), so the chart opens
+    offline and can be moved or shared on its own; with
+    KRONA_CONFIG['embed'] off, or a URL, the page links to them instead.
+    """
+    resources = KRONA_CONFIG['resources'] or find_kronatools()
+    if resources is None:
+        print(f"Warning: KronaTools not found; Krona charts load their JavaScript from "
+              f"{KRONA_WEB_RESOURCES} and need internet access to open. Install it with: "
+              f"conda install -c bioconda krona")
+        resources = KRONA_WEB_RESOURCES
+    resources = str(resources)
+
+    if resources.startswith(('http://', 'https://', 'file:')):
+        base = resources.rstrip('/')
+    elif not KRONA_CONFIG['embed']:
+        base = Path(resources).resolve().as_uri()
+    else:
+        root = Path(resources)
+        script = (root / KRONA_SCRIPT).read_text(encoding='utf-8')
+        images = {key: f"data:{mime};base64," + base64.b64encode((root / "img" / name).read_bytes()).decode()
+                  for key, (name, mime) in KRONA_IMAGES.items()}
+        # Nothing in the script may end the <script> element early
+        script = re.sub(r'</(script)', r'<\\/\1', script, flags=re.IGNORECASE)
+        return KRONA_PAGE.format(resources=escape(str(root)), script=f"<script>{script}</script>",
+                                 chart=chart, **images)
+
+    images = {key: f"{base}/img/{name}" for key, (name, _) in KRONA_IMAGES.items()}
+    return KRONA_PAGE.format(resources=base, script=f'<script src="{base}/{KRONA_SCRIPT.as_posix()}"></script>',
+                             chart=chart, **images)
+
+
+def read_abundance_table(report_file):
+    """
+    Load a Kraken2 report or a Bracken abundance table as
+    (taxids, own counts, names, unclassified, report tree or None).
+
+    Kraken2-format reports (including blast_kraken_style_report.txt) carry
+    their own tree in the name indentation; Bracken tables list species only
+    and need the NCBI taxonomy for their lineages.
+    """
+    with open(report_file, 'r') as f:
+        header = f.readline()
+    if 'fraction_total_reads' in header:
+        table = pd.read_csv(report_file, sep='\t')
+        return (table['taxonomy_id'].to_numpy(dtype=np.int64), table['new_est_reads'].to_numpy(dtype=np.int64),
+                table['name'].astype(str).to_numpy(), 0, None)
+
+    report = parse_kraken_report(report_file)
+    is_unclassified = report['rank'] == 'U'
+    unclassified = int(report.loc[is_unclassified, 'taxon_reads'].sum())
+    report = report[~is_unclassified]
+    # A flat report (blast_report.txt) has no hierarchy to reuse
+    tree = ReportTree(report) if report['depth'].nunique() > 1 else None
+    return (report['taxid'].to_numpy(dtype=np.int64), report['taxon_reads'].to_numpy(dtype=np.int64),
+            report['name'].to_numpy(), unclassified, tree)
+
+
+def krona_xml(tree, node_counts, dataset='sample', extra=(), unclassified=0):
+    """
+    Krona XML for per-node counts on a tree (NCBI Taxonomy or ReportTree).
+
+    Counts are summed into clade magnitudes in one vectorized pass up the
+    tree; only nodes with a non-zero clade are written, children by
+    decreasing magnitude. ``extra`` holds (name, count) pairs that could not
+    be placed in the tree; they and the unclassified count hang off the root.
+    """
+    clade = clade_counts(tree, node_counts) if tree is not None else np.zeros(0, dtype=np.int64)
+    present = np.flatnonzero(clade > 0)
+    children = {}
+    for node in present[np.lexsort((-clade[present], tree.parent[present]))] if len(present) else []:
+        children.setdefault(int(tree.parent[node]), []).append(int(node))
+    total = int(clade[tree.parent < 0].sum() if len(clade) else 0) + sum(count for _, count in extra) + unclassified
+
+    lines = [
+        '  <krona collapse="true" key="true">',
+        '   <attributes magnitude="magnitude">',
+        '    <attribute display="Total">magnitude</attribute>',
+        '    <attribute display="Rank" mono="true">rank</attribute>',
+        f'    <attribute display="Tax ID" mono="true" hrefBase="{TAXID_URL}">taxid</attribute>',
+        '   </attributes>',
+        f'   <datasets><dataset>{escape(dataset)}</dataset></datasets>',
+        f'   <node name="Root"><magnitude><val>{total}</val></magnitude>'
+    ]
+
+    def leaf(name, count, indent):
+        return f'{indent}<node name={quoteattr(str(name))}><magnitude><val>{count}</val></magnitude></node>'
+
+    # Depth-first walk; None marks the end of a node's children
+    stack = [(node, 1) for node in reversed(children.get(-1, []))]
+    while stack:
+        node, depth = stack.pop()
+        indent = '    ' + ' ' * depth
+        if node is None:
+            lines.append(f'{indent}</node>')
+            continue
+        lines.append(f'{indent}<node name={quoteattr(tree.name(node))}>'
+                     f'<magnitude><val>{clade[node]}</val></magnitude>'
+                     f'<rank><val>{escape(tree.rank_code(node))}</val></rank>'
+                     f'<taxid><val>{tree.taxids[node]}</val></taxid>')
+        stack.append((None, depth))
+        stack.extend((child, depth + 1) for child in reversed(children.get(node, [])))
+
+    for name, count in sorted(extra, key=lambda item: -item[1]):
+        lines.append(leaf(name, count, '     '))
+    if unclassified:
+        lines.append(leaf('Unclassified', unclassified, '     '))
+    lines.append('   </node>')
+    lines.append('  </krona>')
+    return '\n'.join(lines)
+
+
+def write_krona_chart(report_file, output_file, taxonomy=None, dataset=None):
+    """
+    Write an interactive Krona chart for a Kraken2 report or Bracken table.
+
+    Taxa are expanded to their full lineage through the NCBI taxonomy when
+    it is installed, otherwise through the report's own tree. The page
+    carries Krona's JavaScript (see krona_page); the plain Krona XML is
+    written next to it for ktImportXML.
+    """
+    output_file = Path(output_file)
+    taxids, counts, names, unclassified, report_tree = read_abundance_table(report_file)
+    taxonomy = taxonomy if taxonomy is not None else load_taxonomy()
+    tree = taxonomy if taxonomy is not None else report_tree
+
+    extra = []
+    node_counts = None
+    if tree is not None:
+        nodes = tree.index(taxids)
+        placed = nodes >= 0
+        node_counts = np.bincount(nodes[placed], weights=counts[placed],
+                                  minlength=len(tree.taxids)).astype(np.int64)
+        extra = [(name, int(count)) for name, count in zip(names[~placed], counts[~placed]) if count > 0]
+    else:
+        extra = [(name, int(count)) for name, count in zip(names, counts) if count > 0]
+
+    chart = krona_xml(tree, node_counts, dataset or Path(report_file).stem, extra, unclassified)
+    output_file.with_suffix('.xml').write_text(chart + '\n', encoding='utf-8')
+    output_file.write_text(krona_page(chart), encoding='utf-8')
+    return output_file
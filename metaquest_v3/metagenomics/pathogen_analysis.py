@@ -2,11 +2,50 @@ import subprocess
 import os
 import json
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from pathlib import Path
 from .config import *
-from .utils import check_dependencies
+from .utils import check_dependencies, parse_prokka_gene_coordinates
+from .diamond_index import ensure_diamond_index, ensure_combined_screening_index, run_diamond
+from .resources import diamond_resource_flags
+from .hit_tables import HIT_COLUMNS, write_hit_parquet, FilteredHits, TopHits, Histogram
+from .keyword_classifier import KeywordClassifier
+from .accession_index import open_accession_index
+from .pathogen_classifier import PathogenClassifier, UNKNOWN
+from .taxonomy import load_taxonomy
+
+# Report categories in priority order: a hit goes to the first one whose keywords its title contains
+ANTIBIOTIC_FAMILIES = {
+    'beta-lactam': ['beta-lactam', 'penicillin', 'ampicillin', 'cephalosporin'],
+    'aminoglycoside': ['aminoglycoside', 'streptomycin', 'gentamicin', 'kanamycin'],
+    'tetracycline': ['tetracycline', 'doxycycline'],
+    'quinolone': ['quinolone', 'fluoroquinolone', 'ciprofloxacin'],
+    'macrolide': ['macrolide', 'erythromycin', 'azithromycin'],
+    'chloramphenicol': ['chloramphenicol'],
+    'sulfonamide': ['sulfonamide', 'sulfamethoxazole'],
+    'trimethoprim': ['trimethoprim'],
+    'vancomycin': ['vancomycin'],
+    'lincosamide': ['lincosamide', 'clindamycin']
+}
+
+VF_KEYWORDS = {
+    'adhesion': ['adhesin', 'fimbri', 'pili', 'attach', 'binding'],
+    'toxin': ['toxin', 'hemolysin', 'cytotoxin', 'enterotoxin'],
+    'secretion_system': ['secretion', 'type III', 'type IV', 'type VI', 'T3SS', 'T4SS', 'T6SS'],
+    'immune_evasion': ['capsule', 'LPS', 'immune', 'evasion', 'resistance'],
+    'invasion': ['invasion', 'invasin', 'penetration'],
+    'motility': ['flagell', 'motility', 'chemotaxis'],
+    'regulation': ['regulator', 'sensor', 'response', 'quorum'],
+    'stress_survival': ['stress', 'survival', 'persistence', 'dormancy']
+}
+
+AMR_CLASSIFIER = KeywordClassifier(ANTIBIOTIC_FAMILIES)
+VF_CLASSIFIER = KeywordClassifier(VF_KEYWORDS)
+
+# Hit fields listed per gene in the JSON reports
+REPORT_FIELDS = {'gene': 'sseqid', 'identity': 'pident', 'evalue': 'evalue', 'description': 'stitle'}
 
 def generate_amr_report(amr_results, output_dir):
     """Generate antimicrobial resistance report from DIAMOND results"""
@@ -26,62 +65,30 @@ def generate_amr_report(amr_results, output_dir):
         return
     
     try:
-        # Read DIAMOND results
-        columns = ['qseqid', 'sseqid', 'pident', 'length', 'evalue', 'bitscore', 'stitle']
-        df = pd.read_csv(amr_results, sep='\t', names=columns, header=None)
+        # Stream high-quality hits, reading only the DIAMOND columns the report uses
+        hits = FilteredHits(amr_results, HIT_COLUMNS, usecols=['sseqid', 'pident', 'evalue', 'bitscore', 'stitle'])
+        resistance_classes = {}
+        top_hits = TopHits(10)
+        identity_hist = Histogram(hits.min_pident, 100, 20)
         
-        if df.empty:
+        for chunk in hits:
+            # Extract resistance information from titles; unknown mechanisms go to 'other'
+            for family, records in AMR_CLASSIFIER.group(chunk, 'stitle', REPORT_FIELDS).items():
+                resistance_classes.setdefault(family, []).extend(records)
+            top_hits.update(chunk)
+            identity_hist.update(chunk['pident'])
+        
+        if hits.rows_read == 0:
             print("No AMR hits found")
             return
         
-        # Filter high-quality hits
-        df_filtered = df[(df['pident'] >= 70) & (df['evalue'] <= 1e-10)]
-        
-        # Extract resistance information from titles
-        resistance_classes = {}
-        antibiotic_families = {
-            'beta-lactam': ['beta-lactam', 'penicillin', 'ampicillin', 'cephalosporin'],
-            'aminoglycoside': ['aminoglycoside', 'streptomycin', 'gentamicin', 'kanamycin'],
-            'tetracycline': ['tetracycline', 'doxycycline'],
-            'quinolone': ['quinolone', 'fluoroquinolone', 'ciprofloxacin'],
-            'macrolide': ['macrolide', 'erythromycin', 'azithromycin'],
-            'chloramphenicol': ['chloramphenicol'],
-            'sulfonamide': ['sulfonamide', 'sulfamethoxazole'],
-            'trimethoprim': ['trimethoprim'],
-            'vancomycin': ['vancomycin'],
-            'lincosamide': ['lincosamide', 'clindamycin']
-        }
-        
-        for idx, row in df_filtered.iterrows():
-            title_lower = row['stitle'].lower()
-            for family, keywords in antibiotic_families.items():
-                if any(keyword in title_lower for keyword in keywords):
-                    if family not in resistance_classes:
-                        resistance_classes[family] = []
-                    resistance_classes[family].append({
-                        'gene': row['sseqid'],
-                        'identity': row['pident'],
-                        'evalue': row['evalue'],
-                        'description': row['stitle']
-                    })
-                    break
-            else:
-                # Unknown resistance mechanism
-                if 'other' not in resistance_classes:
-                    resistance_classes['other'] = []
-                resistance_classes['other'].append({
-                    'gene': row['sseqid'],
-                    'identity': row['pident'],
-                    'evalue': row['evalue'],
-                    'description': row['stitle']
-                })
-        
         # Generate report
         amr_report = {
-            'summary': f"Detected {len(df_filtered)} high-confidence antimicrobial resistance genes",
-            'total_hits': len(df_filtered),
+            'summary': f"Detected {hits.rows_kept} high-confidence antimicrobial resistance genes",
+            'total_hits': hits.rows_kept,
             'resistance_classes': resistance_classes,
-            'top_hits': df_filtered.nlargest(10, 'bitscore')[['sseqid', 'pident', 'evalue', 'stitle']].to_dict('records')
+            'top_hits': top_hits.result()[['sseqid', 'pident', 'evalue', 'stitle']].to_dict('records')
+                        if hits.rows_kept else []
         }
         
         # Save JSON report
@@ -104,19 +111,19 @@ def generate_amr_report(amr_results, output_dir):
             fig1.update_layout(template="plotly_white")
             fig1.write_html(output_dir / "amr_classes_distribution.html")
             
-            # Identity distribution
-            fig2 = px.histogram(
-                df_filtered,
-                x='pident',
-                nbins=20,
+            # Identity distribution, binned while streaming
+            fig2 = px.bar(
+                x=identity_hist.centers,
+                y=identity_hist.counts,
                 title='AMR Gene Identity Distribution',
-                labels={'pident': 'Percentage Identity', 'count': 'Number of Genes'},
+                labels={'x': 'Percentage Identity', 'y': 'Number of Genes'},
                 color_discrete_sequence=['#FF6B6B']
             )
+            fig2.update_traces(width=identity_hist.edges[1] - identity_hist.edges[0])
             fig2.update_layout(template="plotly_white")
             fig2.write_html(output_dir / "amr_identity_distribution.html")
         
-        print(f"✓ Generated AMR report: {len(df_filtered)} resistance genes identified")
+        print(f"✓ Generated AMR report: {hits.rows_kept} resistance genes identified")
         
     except Exception as e:
         print(f"Error generating AMR report: {e}")
@@ -140,63 +147,29 @@ def generate_vf_report(vf_results, output_dir):
         return
     
     try:
-        # Read DIAMOND results
-        columns = ['qseqid', 'sseqid', 'pident', 'length', 'evalue', 'bitscore', 'stitle']
-        df = pd.read_csv(vf_results, sep='\t', names=columns, header=None)
+        # Stream high-quality hits, reading only the DIAMOND columns the report uses
+        hits = FilteredHits(vf_results, HIT_COLUMNS, usecols=['sseqid', 'pident', 'evalue', 'bitscore', 'stitle'])
+        virulence_categories = {}
+        # Best hits feed the top-10 list, the top-15 table and the scatter plot
+        top_hits = TopHits(max(REPORT_CONFIG['plot_points'], 15))
         
-        if df.empty:
+        for chunk in hits:
+            # Categorize virulence factors
+            for category, records in VF_CLASSIFIER.group(chunk, 'stitle', REPORT_FIELDS).items():
+                virulence_categories.setdefault(category, []).extend(records)
+            top_hits.update(chunk)
+        
+        if hits.rows_read == 0:
             print("No virulence factor hits found")
             return
         
-        # Filter high-quality hits
-        df_filtered = df[(df['pident'] >= 70) & (df['evalue'] <= 1e-10)]
-        
-        # Categorize virulence factors
-        virulence_categories = {}
-        vf_keywords = {
-            'adhesion': ['adhesin', 'fimbri', 'pili', 'attach', 'binding'],
-            'toxin': ['toxin', 'hemolysin', 'cytotoxin', 'enterotoxin'],
-            'secretion_system': ['secretion', 'type III', 'type IV', 'type VI', 'T3SS', 'T4SS', 'T6SS'],
-            'immune_evasion': ['capsule', 'LPS', 'immune', 'evasion', 'resistance'],
-            'invasion': ['invasion', 'invasin', 'penetration'],
-            'motility': ['flagell', 'motility', 'chemotaxis'],
-            'regulation': ['regulator', 'sensor', 'response', 'quorum'],
-            'stress_survival': ['stress', 'survival', 'persistence', 'dormancy']
-        }
-        
-        for idx, row in df_filtered.iterrows():
-            title_lower = row['stitle'].lower()
-            categorized = False
-            
-            for category, keywords in vf_keywords.items():
-                if any(keyword in title_lower for keyword in keywords):
-                    if category not in virulence_categories:
-                        virulence_categories[category] = []
-                    virulence_categories[category].append({
-                        'gene': row['sseqid'],
-                        'identity': row['pident'],
-                        'evalue': row['evalue'],
-                        'description': row['stitle']
-                    })
-                    categorized = True
-                    break
-            
-            if not categorized:
-                if 'other' not in virulence_categories:
-                    virulence_categories['other'] = []
-                virulence_categories['other'].append({
-                    'gene': row['sseqid'],
-                    'identity': row['pident'],
-                    'evalue': row['evalue'],
-                    'description': row['stitle']
-                })
-        
         # Generate report
         vf_report = {
-            'summary': f"Detected {len(df_filtered)} high-confidence virulence factors",
-            'total_hits': len(df_filtered),
+            'summary': f"Detected {hits.rows_kept} high-confidence virulence factors",
+            'total_hits': hits.rows_kept,
             'virulence_categories': virulence_categories,
-            'top_hits': df_filtered.nlargest(10, 'bitscore')[['sseqid', 'pident', 'evalue', 'stitle']].to_dict('records')
+            'top_hits': top_hits.result(10)[['sseqid', 'pident', 'evalue', 'stitle']].to_dict('records')
+                        if hits.rows_kept else []
         }
         
         # Save JSON report
@@ -217,9 +190,9 @@ def generate_vf_report(vf_results, output_dir):
             fig1.update_layout(template="plotly_white")
             fig1.write_html(output_dir / "virulence_categories_pie.html")
             
-            # Identity vs E-value scatter plot
+            # Identity vs E-value scatter plot of the best-scoring hits
             fig2 = px.scatter(
-                df_filtered,
+                top_hits.result(),
                 x='pident',
                 y='evalue',
                 size='bitscore',
@@ -232,7 +205,7 @@ def generate_vf_report(vf_results, output_dir):
             fig2.write_html(output_dir / "virulence_quality_scatter.html")
             
             # Top virulence factors table
-            top_vf = df_filtered.nlargest(15, 'bitscore')
+            top_vf = top_hits.result(15)
             fig3 = go.Figure(data=[go.Table(
                 header=dict(values=['Gene ID', 'Identity %', 'E-value', 'Description'],
                            fill_color='lightblue',
@@ -249,12 +222,12 @@ def generate_vf_report(vf_results, output_dir):
             fig3.update_layout(title="Top Virulence Factors")
             fig3.write_html(output_dir / "top_virulence_factors.html")
         
-        print(f"✓ Generated virulence factor report: {len(df_filtered)} virulence genes identified")
+        print(f"✓ Generated virulence factor report: {hits.rows_kept} virulence genes identified")
         
     except Exception as e:
         print(f"Error generating virulence factor report: {e}")
 
-def run_antimicrobial_resistance_scan(fasta_path, output_dir):
+def run_antimicrobial_resistance_scan(fasta_path, output_dir, diamond_batch=None):
     """Scan for antimicrobial resistance genes using CARD database"""
 
     if not CARD_PROTEIN_DB.exists():
@@ -263,34 +236,23 @@ def run_antimicrobial_resistance_scan(fasta_path, output_dir):
     
     amr_out = output_dir / "amr_hits.txt"
     
-    # Create temporary DIAMOND database if needed
-    temp_dmnd = output_dir / "card_temp.dmnd"
-    makedb_cmd = f"diamond makedb --in {CARD_PROTEIN_DB} --db {temp_dmnd.with_suffix('')}"
-    
     try:
-        subprocess.run(makedb_cmd, shell=True, check=True)
+        card_db = ensure_diamond_index(CARD_PROTEIN_DB, "card")
         
         # Run DIAMOND search
-        cmd = f"diamond blastx -d {temp_dmnd.with_suffix('')} -q {fasta_path} -o {amr_out} " \
-              "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle " \
-              "--top 5 --evalue 1e-5 --threads 4"
-        
-        subprocess.run(cmd, shell=True, check=True)
+        run_diamond('blastx', card_db, fasta_path, amr_out,
+                    "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle --top 5 --evalue 1e-5",
+                    batch=diamond_batch, search='amr')
+        write_hit_parquet(amr_out)
         print("✓ AMR scan completed")
         
-        # Clean up
-        for ext in ['.dmnd']:
-            temp_file = temp_dmnd.with_suffix(ext)
-            if temp_file.exists():
-                temp_file.unlink()
-        
         return amr_out
         
     except subprocess.CalledProcessError as e:
         print(f"AMR scan failed: {e}")
         return None
 
-def run_virulence_factor_scan(fasta_path, output_dir):
+def run_virulence_factor_scan(fasta_path, output_dir, diamond_batch=None):
     """Scan for virulence factors using VFDB"""
         
     if not VFDB_DB.exists():
@@ -299,30 +261,22 @@ def run_virulence_factor_scan(fasta_path, output_dir):
     
     vf_out = output_dir / "virulence_hits.txt"
     
-    # Create temporary DIAMOND database
-    temp_dmnd = output_dir / "vfdb_temp.dmnd"
-    makedb_cmd = f"diamond makedb --in {VFDB_DB} --db {temp_dmnd.with_suffix('')}"
-    
     try:
-        subprocess.run(makedb_cmd, shell=True, check=True)
+        vfdb_db = ensure_diamond_index(VFDB_DB, "vfdb")
         
-        cmd = f"diamond blastx -d {temp_dmnd.with_suffix('')} -q {fasta_path} -o {vf_out} " \
-              "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle " \
-              "--top 5 --evalue 1e-5 --threads 4"
-        
-        subprocess.run(cmd, shell=True, check=True)
+        run_diamond('blastx', vfdb_db, fasta_path, vf_out,
+                    "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle --top 5 --evalue 1e-5",
+                    batch=diamond_batch, search='vf')
+        write_hit_parquet(vf_out)
         print("✓ Virulence factor scan completed")
         
-        # Clean up
-        temp_dmnd.unlink()
-        
         return vf_out
         
     except subprocess.CalledProcessError as e:
         print(f"Virulence scan failed: {e}")
         return None
 
-def run_pathogen_scan(fasta_path, output_dir):
+def run_pathogen_scan(fasta_path, output_dir, diamond_batch=None):
     """Screen for pathogens using Diamond BLAST against pathogen database"""
     
     # Check if database exists
@@ -339,15 +293,11 @@ def run_pathogen_scan(fasta_path, output_dir):
     
     print(f"Running pathogen screening against: {CAT_DB}")
     
-    # Use simpler output format without taxonomy for now
-    cmd = f"diamond blastx -d {CAT_DB.with_suffix('')} -q {fasta_path} -o {blast_out} " \
-          "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle " \
-          "--top 3 --evalue 1e-5 --threads 4"
-    
-    print(f"Running: {cmd}")
-    
     try:
-        subprocess.run(cmd, shell=True, check=True, timeout=1800)  # 30 min timeout
+        # Use simpler output format without taxonomy for now
+        run_diamond('blastx', CAT_DB.with_suffix(''), fasta_path, blast_out,
+                    "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle --top 3 --evalue 1e-5",
+                    batch=diamond_batch, search='pathogen', timeout=1800)  # 30 min timeout
         print("✓ Pathogen screening completed")
         
         # Check if results file has content
@@ -355,6 +305,7 @@ def run_pathogen_scan(fasta_path, output_dir):
             print("No pathogen hits found")
             with open(blast_out, 'w') as f:
                 f.write("# No pathogen hits found\n")
+        write_hit_parquet(blast_out)
         
         return blast_out
         
@@ -377,4 +328,219 @@ def run_pathogen_scan(fasta_path, output_dir):
         print(f"Unexpected error in pathogen screening: {e}")
         with open(blast_out, 'w') as f:
             f.write("# Pathogen screening encountered an error\n")
-        return blast_out
\ No newline at end of file
+        return blast_out
+
+def annotate_pathogen_hits(blast_report, output_dir):
+    """
+    Write pathogen_report.tsv: the pathogen hits with a header, the
+    subject taxid (staxids) of each hit, resolved through the accession
+    index, and its Pathogenic label from the pathogen taxid list. Hits whose
+    accession is not indexed get taxid 0 and are labelled Unknown.
+    """
+    if not blast_report or not Path(blast_report).exists():
+        return None
+
+    report = output_dir / "pathogen_report.tsv"
+    index = open_accession_index()
+    if index is None:
+        print("Warning: No accession -> taxid map found; pathogen hits will have no taxids")
+    classifier = PathogenClassifier.from_file(PATHOGEN_TAXIDS, load_taxonomy())
+
+    hits = FilteredHits(blast_report, HIT_COLUMNS, min_pident=0, max_evalue=float('inf'))
+    with open(report, 'w') as f:
+        for chunk in hits:
+            taxids = index.lookup(chunk['sseqid']) if index is not None else np.zeros(len(chunk), dtype=np.uint32)
+            chunk = chunk.assign(staxids=taxids,
+                                 Pathogenic=classifier.classify(taxids) if classifier is not None else UNKNOWN)
+            chunk.to_csv(f, sep='\t', index=False, header=f.tell() == 0)
+
+    print(f"✓ Pathogen report with {hits.rows_read} hits written to {report}")
+    return report
+
+# Output file and --top setting used by each source in separate mode
+SCREENING_SOURCES = {
+    'pathogen': ("pathogen_blast_results.txt", 3),
+    'amr': ("amr_hits.txt", 5),
+    'vf': ("virulence_hits.txt", 5)
+}
+
+def run_combined_screening(fasta_path, output_dir):
+    """
+    Screen for pathogens, AMR genes and virulence factors in a single DIAMOND pass.
+
+    The query is translated and seeded once against a merged CAT + CARD + VFDB
+    reference whose subjects are tagged with their source database. Hits are
+    then split back into pathogen_blast_results.txt, amr_hits.txt and
+    virulence_hits.txt, applying each source's --top cutoff per query so the
+    outputs match the separate scans. DIAMOND reports every hit
+    (max_target_seqs 0): with a positive cap, the many CAT subjects of a
+    query could take all the slots and leave no CARD/VFDB hits to split
+    out, so a cap trades completeness for a smaller intermediate file.
+    E-values are computed against the merged database size, so they are
+    slightly more conservative.
+
+    Returns [pathogen_results, amr_results, vf_results], with None for a
+    database that is unavailable, or None if the search itself failed.
+    """
+    sources = {'pathogen': CAT_FASTA_SOURCE, 'amr': CARD_PROTEIN_DB, 'vf': VFDB_DB}
+    for tag, path in sources.items():
+        if not path.exists():
+            print(f"Warning: {tag} database not found at {path}, skipping {tag} screening")
+
+    try:
+        combined_db = ensure_combined_screening_index(sources)
+        if combined_db is None:
+            print("No screening databases found, skipping combined screening")
+            return None
+
+        combined_out = output_dir / "combined_screening_hits.txt"
+        cmd = f"diamond blastx -d {combined_db} -q {fasta_path} -o {combined_out} " \
+              "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle " \
+              f"--max-target-seqs {SCREENING_CONFIG['max_target_seqs']} --evalue 1e-5 " \
+              f"{diamond_resource_flags()}"
+
+        print(f"Running: {cmd}")
+        subprocess.run(cmd, shell=True, check=True, timeout=1800)
+        print("✓ Combined screening completed")
+
+        results = split_combined_hits(combined_out, output_dir,
+                                      [tag for tag in SCREENING_SOURCES if sources[tag].exists()])
+        combined_out.unlink()
+        return [results.get(tag) for tag in SCREENING_SOURCES]
+
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        print(f"Combined screening failed: {e}")
+        return None
+
+def split_combined_hits(combined_out, output_dir, tags):
+    """Split source-tagged DIAMOND hits into the per-database result files"""
+    outputs = {tag: output_dir / SCREENING_SOURCES[tag][0] for tag in tags}
+    handles = {tag: open(path, 'w') for tag, path in outputs.items()}
+    hit_counts = dict.fromkeys(tags, 0)
+
+    def flush(query_hits):
+        # Re-apply each source's --top cutoff relative to its own best hit
+        for tag, hits in query_hits.items():
+            best = max(bitscore for bitscore, _ in hits)
+            cutoff = best * (1 - SCREENING_SOURCES[tag][1] / 100)
+            for bitscore, line in hits:
+                if bitscore >= cutoff:
+                    handles[tag].write(line)
+                    hit_counts[tag] += 1
+
+    try:
+        # DIAMOND writes all hits of a query together, so one query is buffered at a time
+        current_query = None
+        query_hits = {}
+        with open(combined_out, 'r') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 7:
+                    continue
+                tag, _, sseqid = fields[1].partition('|')
+                if tag not in handles:
+                    continue
+                if fields[0] != current_query:
+                    flush(query_hits)
+                    current_query = fields[0]
+                    query_hits = {}
+                # Strip the source tag so outputs match the separate scans
+                fields[1] = sseqid
+                fields[6] = fields[6].partition('|')[2]
+                query_hits.setdefault(tag, []).append((float(fields[5]), '\t'.join(fields) + '\n'))
+            flush(query_hits)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    if 'pathogen' in outputs and hit_counts['pathogen'] == 0:
+        print("No pathogen hits found")
+        with open(outputs['pathogen'], 'w') as f:
+            f.write("# No pathogen hits found\n")
+
+    for tag in tags:
+        write_hit_parquet(outputs[tag])
+        print(f"  {tag}: {hit_counts[tag]} hits")
+
+    return outputs
+
+def run_protein_scan(prokka_dir, output_dir, source):
+    """
+    Screen Prokka-predicted proteins (sample.faa) with DIAMOND blastp.
+
+    ``source`` is one of SCREENING_SOURCES; the hits are written to the same
+    file and format as the blastx scan of that source, with Prokka locus tags
+    as query IDs.
+    """
+    protein_file = Path(prokka_dir) / "sample.faa"
+    if not protein_file.exists() or protein_file.stat().st_size == 0:
+        print(f"No predicted proteins in {prokka_dir}, skipping {source} screening")
+        return None
+
+    if source == 'pathogen':
+        if not CAT_DB.exists():
+            print(f"Warning: Pathogen database not found at {CAT_DB}")
+            return None
+        db = CAT_DB.with_suffix('')
+    else:
+        db = ensure_diamond_index(CARD_PROTEIN_DB, "card") if source == 'amr' else \
+             ensure_diamond_index(VFDB_DB, "vfdb")
+        if db is None:
+            return None
+
+    output_name, top = SCREENING_SOURCES[source]
+    hits_out = output_dir / output_name
+    cmd = f"diamond blastp -d {db} -q {protein_file} -o {hits_out} " \
+          "--outfmt 6 qseqid sseqid pident length evalue bitscore stitle " \
+          f"--top {top} --evalue 1e-5 {diamond_resource_flags()}"
+
+    print(f"Running: {cmd}")
+    try:
+        subprocess.run(cmd, shell=True, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Protein {source} screening failed: {e}")
+        return None
+
+    print(f"✓ Protein {source} screening completed")
+    if source == 'pathogen' and hits_out.stat().st_size == 0:
+        print("No pathogen hits found")
+        with open(hits_out, 'w') as f:
+            f.write("# No pathogen hits found\n")
+    write_hit_parquet(hits_out)
+    return hits_out
+
+def locate_gene_hits(prokka_dir, hit_files, output_dir):
+    """
+    Join protein-space hits to contig coordinates through the Prokka GFF.
+
+    ``hit_files`` maps a source tag to its DIAMOND output (or None). Writes
+    screening_gene_hits.tsv with one row per hit and its gene location.
+    """
+    gff_file = Path(prokka_dir) / "sample.gff"
+    if not gff_file.exists():
+        print(f"Warning: {gff_file} not found, cannot locate gene hits")
+        return None
+
+    coordinates = parse_prokka_gene_coordinates(gff_file)
+    located_out = output_dir / "screening_gene_hits.tsv"
+    located = 0
+
+    with open(located_out, 'w') as out:
+        out.write("source\tgene\tcontig\tstart\tend\tstrand\tsseqid\tpident\tevalue\tbitscore\tstitle\n")
+        for source, hit_file in hit_files.items():
+            if not hit_file or not Path(hit_file).exists():
+                continue
+            with open(hit_file, 'r') as f:
+                for line in f:
+                    if line.startswith('#'):
+                        continue
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 7:
+                        continue
+                    contig, start, end, strand = coordinates.get(fields[0], ('', '', '', ''))
+                    out.write(f"{source}\t{fields[0]}\t{contig}\t{start}\t{end}\t{strand}\t"
+                              f"{fields[1]}\t{fields[2]}\t{fields[4]}\t{fields[5]}\t{fields[6]}\n")
+                    located += 1
+
+    print(f"✓ Located {located} gene hits: {located_out}")
+    return located_out
@@ -0,0 +1,69 @@
+import numpy as np
+from pathlib import Path
+from .taxonomy import ABSENT
+
+PATHOGENIC = 'Pathogenic'
+NON_PATHOGENIC = 'Non-pathogenic'
+UNKNOWN = 'Unknown'
+
+
+def load_pathogen_taxids(path):
+    """Taxids listed in a pathogen list: the first field of each line, '#' comments skipped"""
+    taxids = []
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith('#') and fields[0].isdigit():
+                taxids.append(int(fields[0]))
+    return np.array(taxids, dtype=np.int64)
+
+
+class PathogenClassifier:
+    """
+    Pathogen labels for taxids from a boolean array indexed by taxid.
+
+    With a Taxonomy, the flags are pushed down the tree once at load time,
+    so a strain or subspecies under a listed species (or any taxon under a
+    listed genus) is flagged too and ``classify`` stays one array lookup.
+    Taxid 0 and taxids missing from the taxonomy are Unknown.
+    """
+
+    def __init__(self, pathogen_taxids, taxonomy=None):
+        pathogen_taxids = np.asarray(pathogen_taxids, dtype=np.int64)
+        self.taxonomy = taxonomy
+        size = max(len(taxonomy) if taxonomy is not None else 0,
+                   int(pathogen_taxids.max()) + 1 if len(pathogen_taxids) else 1)
+        self.flags = np.zeros(size, dtype=bool)
+        self.flags[pathogen_taxids[pathogen_taxids > 0]] = True
+
+        if taxonomy is not None:
+            # Merged taxids in the list count under their current taxid
+            current = taxonomy.index(pathogen_taxids)
+            self.flags[current[current >= 0]] = True
+            known = np.flatnonzero(taxonomy.rank != ABSENT)
+            for depth in range(1, taxonomy.max_depth + 1):
+                level = known[taxonomy.depth[known] == depth]
+                self.flags[level] |= self.flags[taxonomy.parent[level]]
+
+    @classmethod
+    def from_file(cls, path, taxonomy=None):
+        """Classifier for a pathogen taxid list, or None when the list is missing"""
+        if not Path(path).exists():
+            print(f"Warning: Pathogen taxid list {path} not found")
+            return None
+        return cls(load_pathogen_taxids(path), taxonomy)
+
+    def is_pathogen(self, taxids):
+        taxids = np.asarray(taxids, dtype=np.int64)
+        if self.taxonomy is not None:
+            taxids = self.taxonomy.index(taxids)
+        inside = (taxids > 0) & (taxids < len(self.flags))
+        return inside & self.flags[np.where(inside, taxids, 0)]
+
+    def classify(self, taxids):
+        """Pathogenic / Non-pathogenic / Unknown label of each taxid"""
+        taxids = np.asarray(taxids, dtype=np.int64)
+        known = taxids > 0
+        if self.taxonomy is not None:
+            known &= self.taxonomy.index(taxids) >= 0
+        return np.where(~known, UNKNOWN, np.where(self.is_pathogen(taxids), PATHOGENIC, NON_PATHOGENIC))
@@ -0,0 +1,172 @@
+import os
+import threading
+from pathlib import Path
+
+# Memory DIAMOND is never given less than, even on tiny hosts
+MIN_STAGE_MEMORY = 1024 ** 3
+
+
+def _read_text(path):
+    try:
+        return Path(path).read_text().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def detect_cpus():
+    """Usable CPU count, honouring CPU affinity and cgroup v1/v2 quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read_text("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and period:
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    else:
+        # cgroup v1
+        quota = _read_text("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_text("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+
+    return cpus
+
+
+def detect_memory():
+    """Available memory in bytes, honouring cgroup v1/v2 limits"""
+    available = None
+    meminfo = _read_text("/proc/meminfo")
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith('MemAvailable:'):
+                available = int(line.split()[1]) * 1024
+                break
+    if available is None:
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            available = 4 * 1024 ** 3
+
+    # cgroup v2 limit minus current usage
+    limit = _read_text("/sys/fs/cgroup/memory.max")
+    usage = _read_text("/sys/fs/cgroup/memory.current")
+    if limit is None:
+        # cgroup v1 reports "no limit" as a huge number, which min() ignores
+        limit = _read_text("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        usage = _read_text("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if limit and limit != 'max':
+        available = min(available, int(limit) - int(usage or 0))
+
+    return max(available, MIN_STAGE_MEMORY)
+
+
+class Allocation:
+    """CPU threads and memory granted to one running stage"""
+
+    def __init__(self, threads, memory):
+        self.threads = threads
+        self.memory = memory
+
+    def __repr__(self):
+        return f"Allocation(threads={self.threads}, memory={self.memory / 1024 ** 3:.1f} GB)"
+
+
+class ResourceBudget:
+    """
+    Host CPU and memory budget shared by concurrently running stages.
+
+    The scheduler asks for an allocation when it launches a CPU-bound stage,
+    passing the number of CPU-bound stages that may run alongside it
+    (running ones included). Each gets that fraction of the whole budget,
+    capped by what is still free, so a stage that becomes ready a moment
+    after others is not left with the scraps. Resources return to the budget
+    when each stage finishes.
+    """
+
+    def __init__(self, cpus=None, memory=None):
+        self.cpus = cpus or detect_cpus()
+        self.memory = memory or detect_memory()
+        self._used_cpus = 0
+        self._used_memory = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, sharing=1):
+        """
+        Reserve a 1/sharing share of the budget, capped by what is free.
+        Returns None when less than one core or MIN_STAGE_MEMORY is free
+        while other stages hold resources; the caller waits for a release.
+        """
+        sharing = max(sharing, 1)
+        with self._lock:
+            free_cpus = max(self.cpus - self._used_cpus, 0)
+            free_memory = max(self.memory - self._used_memory, 0)
+            busy = self._used_cpus > 0 or self._used_memory > 0
+            if busy and (free_cpus < 1 or free_memory < MIN_STAGE_MEMORY):
+                return None
+            threads = max(1, min(free_cpus, self.cpus // sharing))
+            memory = min(free_memory, max(MIN_STAGE_MEMORY, self.memory // sharing))
+            self._used_cpus += threads
+            self._used_memory += memory
+        return Allocation(threads, memory)
+
+    def release(self, allocation):
+        with self._lock:
+            self._used_cpus -= allocation.threads
+            self._used_memory -= allocation.memory
+
+    def __repr__(self):
+        return f"ResourceBudget(cpus={self.cpus}, memory={self.memory / 1024 ** 3:.1f} GB)"
+
+
+_current = threading.local()
+_default_budget = None
+
+
+def set_current_allocation(allocation, budget=None):
+    """Attach an allocation (and the budget it comes from) to the calling stage worker thread"""
+    _current.allocation = allocation
+    _current.budget = budget
+
+
+def set_default_budget(budget):
+    """Budget used by tools started outside a CPU-bound stage (the run's --threads/--memory-gb)"""
+    global _default_budget
+    _default_budget = budget
+
+
+def current_allocation():
+    """
+    Allocation of the running stage; outside a CPU-bound stage, the whole
+    budget of the current run, and only without one the whole host
+    """
+    allocation = getattr(_current, 'allocation', None)
+    if allocation is None:
+        budget = getattr(_current, 'budget', None) or _default_budget
+        if budget is not None:
+            return Allocation(budget.cpus, budget.memory)
+        allocation = Allocation(detect_cpus(), detect_memory())
+    return allocation
+
+
+def stage_threads():
+    """Thread count for an external tool started by the current stage"""
+    return current_allocation().threads
+
+
+def diamond_resource_flags():
+    """
+    DIAMOND --threads, block size (-b) and index chunk (-c) flags for the
+    current stage. DIAMOND needs roughly 6x the block size in GB with the
+    default 4 index chunks; with a single chunk it is faster but needs more
+    memory, so -c1 is only used when the stage has 16 GB or more.
+    """
+    allocation = current_allocation()
+    memory_gb = allocation.memory / 1024 ** 3
+    chunks = 1 if memory_gb >= 16 else 4
+    block_size = memory_gb / (8 if chunks == 1 else 6)
+    block_size = min(max(block_size, 0.4), 20.0)
+    return f"--threads {allocation.threads} -b {block_size:.1f} -c {chunks}"
@@ -0,0 +1,171 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .resources import ResourceBudget, current_allocation, set_current_allocation
+
+
+class Stage:
+    """A single pipeline step and the stages whose results it consumes"""
+
+    def __init__(self, name, func, requires=(), cpu_bound=False, cached=False, params=None,
+                 inputs=(), databases=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.cpu_bound = cpu_bound
+        self.cached = cached
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.databases = list(databases)
+        self.outputs = list(outputs)
+
+
+class StageScheduler:
+    """
+    Run pipeline stages as a dependency graph.
+
+    Each stage is started as soon as every stage it requires has finished and
+    receives their results as positional arguments, in the order listed in
+    ``requires``. Independent stages run at the same time on a thread pool -
+    the heavy lifting happens in external tools, so threads are sufficient.
+    A failed stage is reported and every stage downstream of it is skipped,
+    while unrelated branches keep running.
+
+    Stages added with ``cached=True`` are keyed in the optional StageCache by
+    their ``params``, ``inputs`` and ``databases`` plus everything upstream,
+    and are skipped on a rerun when nothing they depend on has changed.
+    Stages that return None are never recorded.
+
+    Stages added with ``cpu_bound=True`` are given a share of the
+    ResourceBudget when they start, sized by the number of CPU-bound stages
+    that can run alongside them, and wait when the budget is used up; tools
+    read it through resources.stage_threads() and
+    resources.diamond_resource_flags(). Other stages see the whole budget.
+
+    ``on_finish``, when given, is called with the name of every stage once it
+    is over - run, reused from the cache, failed or skipped.
+    """
+
+    def __init__(self, max_workers=None, cache=None, resources=None, on_finish=None):
+        self.stages = {}
+        self.max_workers = max_workers
+        self.cache = cache
+        self.resources = resources or ResourceBudget()
+        self.on_finish = on_finish
+        self._keys = {}
+
+    def add(self, name, func, requires=(), **options):
+        """Register a stage; its requirements must already be registered"""
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        for dep in requires:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' requires unknown stage '{dep}'")
+        self.stages[name] = Stage(name, func, requires, **options)
+        return name
+
+    def run(self):
+        """Run all stages and return a dict of stage name -> result"""
+        results = {}
+        failed = set()
+        pending = dict(self.stages)
+        waiting = []   # ready stages held back until the budget has room
+        running = {}
+        downstream = self._downstream()
+
+        # Stages mostly wait on external tools, so one worker per stage is cheap
+        workers = self.max_workers or len(self.stages)
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            while pending or waiting or running:
+                # Stages are registered after their requirements, so a single
+                # pass in insertion order propagates skips down the graph
+                ready = []
+                for name, stage in list(pending.items()):
+                    if any(dep in failed for dep in stage.requires):
+                        print(f"⚠️ Skipping {name}: an upstream stage failed")
+                        failed.add(name)
+                        del pending[name]
+                        self._finished(name)
+                    elif all(dep in results for dep in stage.requires):
+                        del pending[name]
+                        ready.append(stage)
+
+                ready, waiting = waiting + ready, []
+                for stage in ready:
+                    allocation = None
+                    if stage.cpu_bound:
+                        # A share of the budget for every CPU-bound stage that can run at
+                        # the same time: those running, and those waiting or pending that
+                        # do not have to wait for this one
+                        alongside = set(running.values()) | {s.name for s in ready} | set(pending)
+                        sharing = 1 + sum(1 for name in alongside - {stage.name} - downstream[stage.name]
+                                          if self.stages[name].cpu_bound)
+                        allocation = self.resources.allocate(sharing)
+                        if allocation is None:
+                            waiting.append(stage)
+                            continue
+                    args = [results[dep] for dep in stage.requires]
+                    upstream = [(self._keys.get(dep), results[dep]) for dep in stage.requires]
+                    future = pool.submit(self._run_stage, stage, args, upstream, allocation)
+                    running[future] = stage.name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Stage {name} failed: {str(e)}")
+                        failed.add(name)
+                    self._finished(name)
+
+        return results
+
+    def _downstream(self):
+        """Names of the stages that (transitively) require each stage"""
+        downstream = {name: set() for name in self.stages}
+        # Requirements are registered first, so a reverse pass sees every dependant before its requirements
+        for name in reversed(list(self.stages)):
+            for dep in self.stages[name].requires:
+                downstream[dep] |= {name} | downstream[name]
+        return downstream
+
+    def _finished(self, name):
+        if self.on_finish is not None:
+            self.on_finish(name)
+
+    def _run_stage(self, stage, args, upstream, allocation):
+        set_current_allocation(allocation, self.resources)
+        try:
+            return self._run_cached(stage, args, upstream)
+        finally:
+            set_current_allocation(None)
+            if allocation is not None:
+                self.resources.release(allocation)
+
+    def _run_cached(self, stage, args, upstream):
+        key = None
+        if self.cache is not None and stage.cached:
+            key = self.cache.stage_key(stage.name, stage.params, stage.inputs,
+                                       stage.databases, upstream)
+            self._keys[stage.name] = key
+            hit, result = self.cache.lookup(stage.name, key)
+            if hit:
+                print(f"↺ Reusing {stage.name} (inputs unchanged)")
+                return result
+            self.cache.invalidate(stage.name)
+
+        allocation = current_allocation() if stage.cpu_bound else None
+        print(f"▶ Starting {stage.name}" + (f" ({allocation.threads} threads)" if allocation else ""))
+        start = time.time()
+        result = stage.func(*args)
+        print(f"✓ Finished {stage.name} ({time.time() - start:.1f}s)")
+
+        # A None result means the stage was skipped or failed softly; leave it
+        # unrecorded so a resumed run tries again
+        if key is not None and result is not None:
+            self.cache.record(stage.name, key, result, stage.outputs)
+        return result
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+# Files up to this size are hashed in full; larger ones (reads, Kraken output)
+# are fingerprinted from their size plus the first and last blocks
+FULL_HASH_LIMIT = 64 * 1024 * 1024
+SAMPLE_BLOCK_SIZE = 4 * 1024 * 1024
+
+MANIFEST_NAME = "stage_manifest.json"
+
+
+def file_fingerprint(path):
+    """Content fingerprint of a file or directory (None if it does not exist)"""
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    digest = hashlib.sha256()
+    if path.is_dir():
+        for child in sorted(p for p in path.rglob("*") if p.is_file()):
+            digest.update(str(child.relative_to(path)).encode())
+            digest.update(file_fingerprint(child).encode())
+        return digest.hexdigest()
+
+    size = path.stat().st_size
+    digest.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= FULL_HASH_LIMIT:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        else:
+            digest.update(f.read(SAMPLE_BLOCK_SIZE))
+            f.seek(size - SAMPLE_BLOCK_SIZE)
+            digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def database_fingerprint(path):
+    """
+    Cheap fingerprint of a reference database from file names, sizes and
+    modification times - databases are too large to hash on every run
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    digest = hashlib.sha256()
+    for db_file in files:
+        stat = db_file.stat()
+        digest.update(f"{db_file.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def _result_paths(result):
+    """Paths referenced by a stage result"""
+    if isinstance(result, Path):
+        return [result]
+    if isinstance(result, (list, tuple)):
+        return [Path(item) for item in result if isinstance(item, (str, Path))]
+    if isinstance(result, str) and Path(result).exists():
+        return [Path(result)]
+    return []
+
+
+def _encode_result(result):
+    if isinstance(result, Path):
+        return {'__path__': str(result)}
+    if isinstance(result, (list, tuple)):
+        return [_encode_result(item) for item in result]
+    return result
+
+
+def _decode_result(value):
+    if isinstance(value, dict) and '__path__' in value:
+        return Path(value['__path__'])
+    if isinstance(value, list):
+        return [_decode_result(item) for item in value]
+    return value
+
+
+class StageCache:
+    """
+    Content-addressed record of finished pipeline stages.
+
+    A stage's key is a hash of its parameters, its input files, the
+    fingerprints of the databases it searches and the keys and outputs of the
+    stages it depends on, so any upstream change invalidates everything
+    downstream of it. Finished stages are recorded in ``stage_manifest.json``
+    in the output directory, and a stage whose key and outputs are unchanged
+    is skipped and its recorded result returned - unless ``reuse`` is off
+    (--rerun), in which case every stage runs and is recorded afresh.
+    """
+
+    def __init__(self, output_dir, reuse=True):
+        self.manifest_file = Path(output_dir) / MANIFEST_NAME
+        self.reuse = reuse
+        self._lock = threading.Lock()
+        self.manifest = self._load()
+
+    def _load(self):
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Warning: Could not load stage manifest: {e}")
+        return {}
+
+    def _save(self):
+        tmp_file = self.manifest_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        tmp_file.replace(self.manifest_file)
+
+    def stage_key(self, name, params=None, inputs=(), databases=(), upstream=()):
+        """
+        Compute the cache key of a stage.
+
+        ``upstream`` is a list of (key, result) pairs for the stages it requires.
+        """
+        spec = {
+            'stage': name,
+            'params': params or {},
+            'inputs': [file_fingerprint(p) for p in inputs],
+            'databases': [database_fingerprint(p) for p in databases],
+            'upstream': [
+                [key, [file_fingerprint(p) for p in _result_paths(result)]]
+                for key, result in upstream
+            ],
+        }
+        encoded = json.dumps(spec, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def lookup(self, name, key):
+        """Return (True, result) if the stage finished with this key and its outputs are intact"""
+        if not self.reuse:
+            return False, None
+
+        with self._lock:
+            entry = self.manifest.get(name)
+        if not entry or entry.get('key') != key:
+            return False, None
+
+        for path, fingerprint in entry.get('outputs', {}).items():
+            if file_fingerprint(path) != fingerprint:
+                return False, None
+
+        return True, _decode_result(entry.get('result'))
+
+    def invalidate(self, name):
+        """Forget a stage before it is rerun so a crash cannot leave a stale entry"""
+        with self._lock:
+            if self.manifest.pop(name, None) is not None:
+                self._save()
+
+    def record(self, name, key, result, outputs=()):
+        """Record a finished stage together with fingerprints of its outputs"""
+        paths = _result_paths(result) + [Path(p) for p in outputs]
+        entry = {
+            'key': key,
+            'result': _encode_result(result),
+            'outputs': {str(p): file_fingerprint(p) for p in paths},
+        }
+        with self._lock:
+            self.manifest[name] = entry
+            self._save()
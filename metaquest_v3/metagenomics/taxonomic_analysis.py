@@ -1,28 +1,48 @@
 import subprocess
 import os
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from collections import Counter
 import time
 import json
 import hashlib
-from Bio.Blast import NCBIWWW, NCBIXML
+import threading
+import shutil
+import tempfile
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from Bio.Blast import NCBIXML
 from Bio import SeqIO
 import requests
 from .config import *
-from .visualization import create_krona_plot
-from .utils import check_dependencies
+from .utils import check_dependencies, interleaved_pipes, iter_fasta, sample_sequences
+from .resources import stage_threads, diamond_resource_flags
+from .blast_cache import BlastCache, open_blast_cache
+from .taxonomy import load_taxonomy, group_lca
+from .kraken_output import write_kraken_report
+from .accession_index import open_accession_index
 
-def run_kraken(input_files, output_dir):
-    """Run Kraken2 classification for FASTQ files"""
+def run_kraken(input_files, output_dir, interleaved=False, memory_mapping=False):
+    """
+    Run Kraken2 classification for FASTQ files. With ``memory_mapping``,
+    Kraken2 maps the database instead of loading it (--memory-mapping), so
+    concurrent runs share one copy in the page cache.
+    """
     report = output_dir/"kraken_report.txt"
     classified = output_dir/"kraken_classified.txt"
+    if interleaved:
+        # Feed both mates to --paired through named pipes instead of split copies
+        interleaved_fastq = input_files[0] if isinstance(input_files, (list, tuple)) else input_files
+        with interleaved_pipes(interleaved_fastq) as mates:
+            return run_kraken(mates, output_dir, memory_mapping=memory_mapping)
     # input_files might be a list of one (single-end) or two paths (paired-end)
     if isinstance(input_files, (list,tuple)) and len(input_files)==2:
         reads_flags = f"--paired {input_files[0]} {input_files[1]}"
     else:
         reads_flags = input_files[0] if isinstance(input_files,(list,tuple)) else input_files
-    cmd = f"kraken2 --db {KRAKEN_DB} --threads 8 --report {report} --output {classified} {reads_flags}"
+    mapping_flag = "--memory-mapping " if memory_mapping else ""
+    cmd = f"kraken2 --db {KRAKEN_DB} {mapping_flag}--threads {stage_threads()} --report {report} --output {classified} {reads_flags}"
 
     print(f"Running: {cmd}")
     subprocess.run(cmd, shell=True, check=True)
@@ -54,99 +74,374 @@ def get_sequence_cache_key(sequence):
     """Generate cache key for sequence"""
     return hashlib.md5(sequence.encode()).hexdigest()
 
-def load_blast_cache(cache_dir):
-    """Load existing BLAST cache"""
-    cache_file = cache_dir / "blast_cache.json"
-    if cache_file.exists():
+class TokenBucket:
+    """Thread-safe token bucket that spaces out BLAST submissions"""
+    
+    def __init__(self, interval, burst=1):
+        self.interval = interval
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a submission is allowed"""
+        if self.interval <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+def _blast_api_request(params, rate_limiter, method='get'):
+    """Send one rate-limited request to the BLAST URL API and return the body"""
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    params = dict(params, tool=BLAST_CONFIG['tool'])
+    if BLAST_CONFIG['email']:
+        params['email'] = BLAST_CONFIG['email']
+    if method == 'post':
+        response = requests.post(BLAST_CONFIG['url_base'], data=params, timeout=BLAST_CONFIG['timeout'])
+    else:
+        response = requests.get(BLAST_CONFIG['url_base'], params=params, timeout=BLAST_CONFIG['timeout'])
+    response.raise_for_status()
+    return response.text
+
+def _qblast_info(text, field):
+    """Read a 'FIELD = value' entry from a BLAST URL API info block"""
+    for line in text.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep and key.strip() == field:
+            return value.strip()
+    return None
+
+def submit_blast_query(query, database="nt", rate_limiter=None):
+    """
+    Run one search through the BLAST URL API and return the parsed records.
+    
+    The job is submitted (CMD=Put) and its RID polled until READY, so many
+    jobs can wait in the remote queue at once; every request goes through the
+    shared rate limiter. Failed submissions, failed searches, searches still
+    waiting after max_search_wait seconds and network errors are retried up
+    to max_retries times with exponential backoff.
+    """
+    program = "blastn" if database == "nt" else "blastx"
+    max_retries = BLAST_CONFIG['max_retries']
+    
+    for attempt in range(max_retries + 1):
         try:
-            with open(cache_file, 'r') as f:
-                return json.load(f)
+            text = _blast_api_request({
+                'CMD': 'Put',
+                'PROGRAM': program,
+                'DATABASE': database,
+                'QUERY': query,
+                'HITLIST_SIZE': 10,  # Top 10 hits
+                'EXPECT': 1e-5,
+                'WORD_SIZE': 28 if database == "nt" else 6
+            }, rate_limiter, method='post')
+            rid = _qblast_info(text, 'RID')
+            if not rid:
+                raise RuntimeError("BLAST submission returned no RID")
+            submitted = time.monotonic()
+            
+            # Wait for the estimated run time before the first status check
+            time.sleep(min(int(_qblast_info(text, 'RTOE') or 0), BLAST_CONFIG['poll_interval']))
+            
+            while True:
+                status_text = _blast_api_request(
+                    {'CMD': 'Get', 'FORMAT_OBJECT': 'SearchInfo', 'RID': rid}, rate_limiter)
+                status = (_qblast_info(status_text, 'Status') or 'UNKNOWN').upper()
+                if status == 'READY':
+                    break
+                if status != 'WAITING':
+                    raise RuntimeError(f"BLAST search {rid} finished with status {status}")
+                if time.monotonic() - submitted > BLAST_CONFIG['max_search_wait']:
+                    raise TimeoutError(f"BLAST search {rid} still waiting after "
+                                       f"{BLAST_CONFIG['max_search_wait']}s")
+                time.sleep(BLAST_CONFIG['poll_interval'])
+            
+            xml_text = _blast_api_request({'CMD': 'Get', 'FORMAT_TYPE': 'XML', 'RID': rid}, rate_limiter)
+            return list(NCBIXML.parse(StringIO(xml_text)))
+        
         except Exception as e:
-            print(f"Warning: Could not load cache: {e}")
-    return {}
+            if attempt == max_retries:
+                raise
+            delay = BLAST_CONFIG['retry_backoff'] * 2 ** attempt
+            print(f"  BLAST request failed ({e}), retry {attempt + 1}/{max_retries} in {delay:.0f}s")
+            time.sleep(delay)
 
-def save_blast_cache(cache_dir, cache_data):
-    """Save BLAST cache to disk"""
-    cache_file = cache_dir / "blast_cache.json"
+def parse_blast_record(record, sequence_id, query_length):
+    """Convert a parsed BLAST record into the taxonomy result dict"""
+    # Extract taxonomy information
+    taxonomy_results = []
+    for alignment in record.alignments:
+        for hsp in alignment.hsps:
+            if hsp.expect <= 1e-5:  # Only significant hits
+                # Extract taxonomy info from hit description
+                hit_info = {
+                    'hit_id': alignment.hit_id,
+                    'hit_def': alignment.hit_def,
+                    'length': alignment.length,
+                    'e_value': hsp.expect,
+                    'bit_score': hsp.bits,
+                    'identity': hsp.identities / hsp.align_length * 100,
+                    'query_cover': (hsp.query_end - hsp.query_start + 1) / query_length * 100
+                }
+                
+                # Try to extract organism name from description
+                organism = extract_organism_from_description(alignment.hit_def)
+                hit_info['organism'] = organism
+                
+                taxonomy_results.append(hit_info)
+    
+    return {
+        'query_id': sequence_id,
+        'query_length': query_length,
+        'hits': taxonomy_results,
+        'timestamp': time.time()
+    }
+
+def blast_batch_online(batch, database="nt", rate_limiter=None):
+    """
+    BLAST several sequences in one multi-FASTA request.
+    
+    ``batch`` is a list of (sequence_id, sequence) pairs. Queries are renamed
+    to their position in the batch so the combined XML can be demultiplexed
+    reliably; one result dict is returned per input, in order, with an
+    'error' entry for any query the response did not cover.
+    """
+    query = ''.join(f">q{i}\n{sequence}\n" for i, (_, sequence) in enumerate(batch))
+    ids = ', '.join(sequence_id for sequence_id, _ in batch[:3]) + (', ...' if len(batch) > 3 else '')
+    
     try:
-        with open(cache_file, 'w') as f:
-            json.dump(cache_data, f, indent=2)
+        print(f"  BLASTing batch of {len(batch)} sequences ({ids}) against {database}...")
+        records = submit_blast_query(query, database=database, rate_limiter=rate_limiter)
     except Exception as e:
-        print(f"Warning: Could not save cache: {e}")
+        print(f"  BLAST failed for batch ({ids}): {e}")
+        records = []
+        error = str(e)
+    else:
+        error = "Query missing from BLAST response"
+    
+    by_index = {}
+    for record in records:
+        name = record.query.split()[0] if record.query else ''
+        if name.startswith('q') and name[1:].isdigit():
+            by_index[int(name[1:])] = record
+    
+    results = []
+    for i, (sequence_id, sequence) in enumerate(batch):
+        if i in by_index:
+            results.append(parse_blast_record(by_index[i], sequence_id, len(sequence)))
+        else:
+            results.append({
+                'query_id': sequence_id,
+                'query_length': len(sequence),
+                'hits': [],
+                'error': error,
+                'timestamp': time.time()
+            })
+    return results
+
+def make_blast_batches(queries, max_sequences, max_bases):
+    """Lazily pack queries into batches limited by sequence count and total length"""
+    current = []
+    current_bases = 0
+    for query in queries:
+        length = len(query[2])
+        if current and (len(current) >= max_sequences or current_bases + length > max_bases):
+            yield current
+            current = []
+            current_bases = 0
+        current.append(query)
+        current_bases += length
+    if current:
+        yield current
 
-def blast_sequence_online(sequence, sequence_id, database="nt", cache=None, cache_key=None):
+# Tabular fields requested from local searches; staxids is only filled in
+# when the BLAST database was built with -parse_seqids and a taxid map
+LOCAL_BLAST_FIELDS = ['qseqid', 'sseqid', 'stitle', 'slen', 'evalue', 'bitscore',
+                      'pident', 'qstart', 'qend', 'staxids']
+DIAMOND_BLAST_FIELDS = LOCAL_BLAST_FIELDS[:-1]
+
+class BlastBackend:
     """
-    BLAST a single sequence against NCBI database with caching and rate limiting
+    Search backend used by run_fasta_blast_taxonomy.
+    
+    ``search`` takes a list of (sequence_id, sequence) pairs and returns one
+    result dict per query, in order, in the format built by
+    parse_blast_record; queries that could not be searched get an 'error'
+    entry instead of hits. Queries are packed into batches of at most
+    ``max_sequences`` sequences / ``max_bases`` bases, and up to
+    ``max_in_flight`` batches are searched at once.
     """
-    # Check cache first
-    if cache and cache_key and cache_key in cache:
-        print(f"  Using cached result for {sequence_id}")
-        return cache[cache_key]
+    name = None
+    local = False
+    max_sequences = BLAST_CONFIG['max_sequences_per_batch']
+    max_bases = BLAST_CONFIG['max_batch_bases']
+    max_in_flight = 1
     
-    # Rate limiting: NCBI recommends no more than 3 requests per second
-    time.sleep(0.4)  # 400ms delay between requests
+    def __init__(self, database):
+        self.database = database
     
-    try:
-        print(f"  BLASTing {sequence_id} against {database}...")
-        
-        # Submit BLAST job
-        result_handle = NCBIWWW.qblast(
-            program="blastn" if database == "nt" else "blastx",
-            database=database,
-            sequence=sequence,
-            hitlist_size=10,  # Top 10 hits
-            expect=1e-5,
-            word_size=28 if database == "nt" else 6
-        )
-        
-        # Parse results
-        blast_records = NCBIXML.parse(result_handle)
-        record = next(blast_records)
-        
-        # Extract taxonomy information
-        taxonomy_results = []
-        for alignment in record.alignments:
-            for hsp in alignment.hsps:
-                if hsp.expect <= 1e-5:  # Only significant hits
-                    # Extract taxonomy info from hit description
-                    hit_info = {
-                        'hit_id': alignment.hit_id,
-                        'hit_def': alignment.hit_def,
-                        'length': alignment.length,
-                        'e_value': hsp.expect,
-                        'bit_score': hsp.bits,
-                        'identity': hsp.identities / hsp.align_length * 100,
-                        'query_cover': (hsp.query_end - hsp.query_start + 1) / len(sequence) * 100
-                    }
-                    
-                    # Try to extract organism name from description
-                    organism = extract_organism_from_description(alignment.hit_def)
-                    hit_info['organism'] = organism
-                    
-                    taxonomy_results.append(hit_info)
-        
-        result_data = {
-            'query_id': sequence_id,
-            'query_length': len(sequence),
-            'hits': taxonomy_results,
-            'timestamp': time.time()
-        }
-        
-        # Cache the result
-        if cache is not None and cache_key:
-            cache[cache_key] = result_data
-        
-        return result_data
-        
-    except Exception as e:
-        print(f"  BLAST failed for {sequence_id}: {e}")
-        return {
-            'query_id': sequence_id,
-            'query_length': len(sequence),
-            'hits': [],
-            'error': str(e),
-            'timestamp': time.time()
-        }
+    def check(self):
+        """Raise if the backend cannot run on this host"""
+    
+    def database_files(self):
+        """Files identifying the searched database, for stage caching"""
+        return []
+    
+    def cache_key(self, sequence):
+        return f"{self.name}:{Path(str(self.database)).name}:{get_sequence_cache_key(sequence)}"
+    
+    def search(self, batch):
+        raise NotImplementedError
+    
+    def __str__(self):
+        return f"{self.name} against {self.database}"
+
+class RemoteBlastBackend(BlastBackend):
+    """NCBI BLAST URL API, with several rate-limited searches queued at once"""
+    name = 'remote'
+    max_in_flight = BLAST_CONFIG['max_in_flight']
+    
+    def __init__(self, database="nt"):
+        super().__init__(database)
+        self.rate_limiter = TokenBucket(BLAST_CONFIG['rate_limit_delay'])
+    
+    def cache_key(self, sequence):
+        # Same keys as caches written before backends were selectable
+        return get_sequence_cache_key(sequence)
+    
+    def search(self, batch):
+        return blast_batch_online(batch, self.database, self.rate_limiter)
+
+class LocalBlastBackend(BlastBackend):
+    """blastn (or megablast) against a local nucleotide BLAST database"""
+    local = True
+    max_sequences = BLAST_CONFIG['local_batch_sequences']
+    max_bases = float('inf')
+    program = 'blastn'
+    fields = LOCAL_BLAST_FIELDS
+    
+    def __init__(self, database=None, task='megablast'):
+        super().__init__(Path(database or LOCAL_BLAST_DB))
+        self.name = task
+        self.task = task
+    
+    def check(self):
+        if not shutil.which(self.program):
+            raise FileNotFoundError(f"{self.program} not found - install it with: conda install -c bioconda blast")
+        if not self.database_files():
+            raise FileNotFoundError(f"Local BLAST database not found: {self.database}")
+    
+    def database_files(self):
+        return sorted(self.database.parent.glob(f"{self.database.name}.*"))
+    
+    def command(self, query_file, out_file):
+        return (f"blastn -task {self.task} -query {query_file} -db {self.database} "
+                f"-out {out_file} -outfmt '6 {' '.join(self.fields)}' "
+                f"-evalue 1e-5 -max_target_seqs 10 -num_threads {stage_threads()}")
+    
+    def search(self, batch):
+        ids = ', '.join(sequence_id for sequence_id, _ in batch[:3]) + (', ...' if len(batch) > 3 else '')
+        with tempfile.TemporaryDirectory(prefix="metaquest_blast_") as tmp_dir:
+            query_file = Path(tmp_dir) / "queries.fasta"
+            out_file = Path(tmp_dir) / "hits.tsv"
+            with open(query_file, 'w') as f:
+                # Queries are renamed to their position so hits map back unambiguously
+                for i, (_, sequence) in enumerate(batch):
+                    f.write(f">q{i}\n{sequence}\n")
+            
+            try:
+                print(f"  Searching {len(batch)} sequences ({ids}) with {self}...")
+                subprocess.run(self.command(query_file, out_file), shell=True, check=True)
+                return parse_tabular_hits(out_file, batch, self.fields)
+            except subprocess.CalledProcessError as e:
+                print(f"  {self.name} failed for batch ({ids}): {e}")
+                return [{
+                    'query_id': sequence_id,
+                    'query_length': len(sequence),
+                    'hits': [],
+                    'error': str(e),
+                    'timestamp': time.time()
+                } for sequence_id, sequence in batch]
+
+class DiamondBlastBackend(LocalBlastBackend):
+    """DIAMOND blastx of the nucleotide queries against a local protein database"""
+    name = 'diamond'
+    program = 'diamond'
+    fields = DIAMOND_BLAST_FIELDS
+    
+    def __init__(self, database=None):
+        BlastBackend.__init__(self, Path(database or LOCAL_DIAMOND_DB))
+    
+    def database_files(self):
+        return [self.database] if self.database.exists() else []
+    
+    def command(self, query_file, out_file):
+        return (f"diamond blastx -q {query_file} -d {self.database} -o {out_file} "
+                f"--outfmt 6 {' '.join(self.fields)} --evalue 1e-5 --max-target-seqs 10 "
+                f"{diamond_resource_flags()}")
+
+BLAST_BACKENDS = ['remote', 'megablast', 'blastn', 'diamond']
+
+def get_blast_backend(name=None, database=None):
+    """Create the FASTA taxonomy search backend (default: BLAST_CONFIG['backend'])"""
+    name = name or BLAST_CONFIG['backend']
+    if name == 'remote':
+        return RemoteBlastBackend(database or BLAST_CONFIG['default_database'])
+    if name in ('megablast', 'blastn'):
+        return LocalBlastBackend(database, task=name)
+    if name == 'diamond':
+        return DiamondBlastBackend(database)
+    raise ValueError(f"Unknown BLAST backend '{name}' (choose from {', '.join(BLAST_BACKENDS)})")
+
+def parse_tabular_hits(hits_file, batch, fields):
+    """
+    Convert tabular (-outfmt 6) hits for a batch of ``>q<index>`` queries
+    into the result dicts built by parse_blast_record, one per query.
+    """
+    results = [{
+        'query_id': sequence_id,
+        'query_length': len(sequence),
+        'hits': [],
+        'timestamp': time.time()
+    } for sequence_id, sequence in batch]
+    
+    with open(hits_file, 'r') as f:
+        for line in f:
+            row = dict(zip(fields, line.rstrip('\n').split('\t')))
+            name = row['qseqid']
+            if not (name.startswith('q') and name[1:].isdigit()):
+                continue
+            result = results[int(name[1:])]
+            
+            hit_info = {
+                'hit_id': row['sseqid'],
+                'hit_def': row['stitle'],
+                'length': int(row['slen']),
+                'e_value': float(row['evalue']),
+                'bit_score': float(row['bitscore']),
+                'identity': float(row['pident']),
+                'query_cover': (abs(int(row['qend']) - int(row['qstart'])) + 1) / result['query_length'] * 100
+            }
+            
+            # The first taxid of a merged (;-separated) entry; 0 or N/A when unknown
+            taxid = row.get('staxids', '').split(';')[0]
+            if taxid.isdigit() and int(taxid) > 0:
+                hit_info['taxid'] = int(taxid)
+            
+            hit_info['organism'] = extract_organism_from_description(row['stitle'])
+            result['hits'].append(hit_info)
+    
+    return results
 
 def extract_organism_from_description(description):
     """Extract organism name from BLAST hit description"""
@@ -171,61 +466,88 @@ def extract_organism_from_description(description):
     # Fallback: return first few words
     return ' '.join(description.split()[:3])
 
-def run_fasta_blast_taxonomy(fasta_path, output_dir, database="nt", max_sequences=100):
+def run_fasta_blast_taxonomy(fasta_path, output_dir, database=None, max_sequences=100, backend=None,
+                             sampling=None):
     """
-    Run BLAST taxonomy classification for FASTA files using NCBI API
+    Run BLAST taxonomy classification for FASTA files using the NCBI API or a
+    local backend (see get_blast_backend); ``database`` overrides the
+    backend's default database name or path. Remote searches use a
+    ``sampling`` sample (see sample_sequences) of at most max_sequences
+    sequences; local backends search every sequence.
     """
+    backend = get_blast_backend(backend, database)
+    backend.check()
     print(f"Running BLAST taxonomic classification on {fasta_path}")
-    print(f"Using database: {database}")
+    print(f"Using {backend}")
     
     # Setup cache
     cache_dir = output_dir / "blast_cache"
     cache_dir.mkdir(exist_ok=True)
-    cache = load_blast_cache(cache_dir)
-    
-    # Parse FASTA file
-    sequences = list(SeqIO.parse(fasta_path, "fasta"))
-    total_sequences = len(sequences)
-    
-    print(f"Found {total_sequences} sequences")
-    
-    # Limit sequences to avoid overwhelming the API
-    if total_sequences > max_sequences:
-        print(f"Limiting to first {max_sequences} sequences to avoid API overload")
-        sequences = sequences[:max_sequences]
-    
-    blast_results = []
-    
-    print("Starting BLAST analysis (this may take several minutes)...")
-    
-    for i, seq_record in enumerate(sequences):
-        print(f"Processing sequence {i+1}/{len(sequences)}: {seq_record.id}")
-        
-        sequence_str = str(seq_record.seq)
-        cache_key = get_sequence_cache_key(sequence_str)
-        
-        # Skip very short sequences
-        if len(sequence_str) < 50:
-            print(f"  Skipping {seq_record.id} (too short: {len(sequence_str)} bp)")
-            continue
-        
-        # BLAST the sequence
-        result = blast_sequence_online(
-            sequence_str, 
-            seq_record.id, 
-            database=database,
-            cache=cache,
-            cache_key=cache_key
-        )
-        
-        blast_results.append(result)
+    cache = open_blast_cache(cache_dir)
+    
+    # Stream the FASTA; short sequences are dropped without being kept in memory
+    min_length = BLAST_CONFIG['min_query_length']
+    records = iter_fasta(fasta_path, min_length=min_length)
+    
+    # Sample the remote queries to avoid overwhelming the API
+    if not backend.local:
+        sampling = sampling or BLAST_CONFIG['sampling']
+        records, total_sequences = sample_sequences(records, max_sequences, sampling)
+        print(f"Found {total_sequences} sequences of at least {min_length} bp")
+        if total_sequences > max_sequences:
+            print(f"Using a {sampling} sample of {max_sequences} sequences to avoid API overload")
+    
+    results_by_index = {}
+    
+    def uncached_queries():
+        for i, (sequence_id, sequence_str) in enumerate(records):
+            cache_key = backend.cache_key(sequence_str)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print(f"  Using cached result for {sequence_id}")
+                # Entries are keyed by sequence, so the cached one may be for another record
+                results_by_index[i] = dict(cached, query_id=sequence_id)
+            else:
+                yield (i, sequence_id, sequence_str, cache_key)
+    
+    def collect(future, batch):
+        for (i, _, _, cache_key), result in zip(batch, future.result()):
+            results_by_index[i] = result
+            if 'error' not in result:
+                cache[cache_key] = result
+    
+    # Pack many short queries into each request to cut round trips
+    print(f"Starting BLAST analysis ({backend.max_in_flight} searches in flight, "
+          f"this may take several minutes)...")
+    
+    # Batches are built as earlier ones finish, so only the queries in flight are held in memory;
+    # remote searches stay queued at NCBI while the token bucket spaces out submissions
+    completed = 0
+    with ThreadPoolExecutor(max_workers=backend.max_in_flight) as pool:
+        running = {}
+        for batch in make_blast_batches(uncached_queries(), backend.max_sequences, backend.max_bases):
+            future = pool.submit(backend.search,
+                                 [(sequence_id, sequence_str) for _, sequence_id, sequence_str, _ in batch])
+            running[future] = batch
+            if len(running) < backend.max_in_flight:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future, running[future])
+                completed += len(running.pop(future))
+                print(f"Completed {completed} sequences")
         
-        # Save cache periodically
-        if i % 10 == 0:
-            save_blast_cache(cache_dir, cache)
+        for future in as_completed(running):
+            collect(future, running[future])
+            completed += len(running[future])
+            print(f"Completed {completed} sequences")
+    
+    blast_results = [results_by_index[i] for i in sorted(results_by_index)]
     
-    # Final cache save
-    save_blast_cache(cache_dir, cache)
+    # Keep the cache within its size limit
+    if isinstance(cache, BlastCache):
+        cache.cleanup()
+        cache.close()
     
     # Save raw results
     results_file = output_dir / "blast_taxonomy_results.json"
@@ -241,132 +563,104 @@ def run_fasta_blast_taxonomy(fasta_path, output_dir, database="nt", max_sequence
     
     return results_file
 
-def create_blast_taxonomy_summary(blast_results, output_dir):
-    """Create summary report from BLAST taxonomy results"""
-    
-    summary_file = output_dir / "blast_taxonomy_summary.txt"
-    organism_counts = Counter()
-    total_hits = 0
-    sequences_with_hits = 0
-    
-    # Analyze results
-    for result in blast_results:
-        if 'error' in result:
-            continue
-            
-        if result['hits']:
-            sequences_with_hits += 1
-            for hit in result['hits']:
-                organism = hit.get('organism', 'Unknown')
-                organism_counts[organism] += 1
-                total_hits += 1
-    
-    # Write summary
-    with open(summary_file, 'w') as f:
-        f.write("BLAST TAXONOMIC CLASSIFICATION SUMMARY\n")
-        f.write("=" * 50 + "\n\n")
-        f.write(f"Total sequences analyzed: {len(blast_results)}\n")
-        f.write(f"Sequences with hits: {sequences_with_hits}\n")
-        f.write(f"Total BLAST hits: {total_hits}\n")
-        f.write(f"Unique organisms identified: {len(organism_counts)}\n\n")
-        
-        if organism_counts:
-            f.write("TOP ORGANISMS IDENTIFIED:\n")
-            f.write("-" * 30 + "\n")
-            
-            for organism, count in organism_counts.most_common(20):
-                f.write(f"{organism}: {count} hits\n")
-        else:
-            f.write("No significant taxonomic matches found.\n")
-    
-    # Create Kraken-style report for compatibility
-    kraken_style_report = output_dir / "blast_kraken_style_report.txt"
-    create_kraken_style_report_from_blast(blast_results, kraken_style_report)
-    
-    return summary_file
+def resolve_hit_taxids(hits, taxonomy, accession_index=None):
+    """
+    Taxid of each hit: the staxids reported by the search when present, else
+    the subject accession through the accession index, else the organism
+    name looked up in the taxonomy (full name, then genus and species).
+    0 when unresolved.
+    """
+    taxids = pd.to_numeric(hits['taxid'], errors='coerce').fillna(0).to_numpy(dtype=np.int64, copy=True)
+    missing = taxids == 0
+    if accession_index is not None and missing.any():
+        taxids[missing] = accession_index.lookup(hits.loc[missing, 'hit_id'])
+        missing = taxids == 0
+    if missing.any():
+        names = hits.loc[missing, 'organism'].fillna('').astype(str)
+        found = {}
+        for name in names.unique():
+            taxid = taxonomy.find(name)
+            if taxid < 0 and len(name.split()) > 2:
+                taxid = taxonomy.find(' '.join(name.split()[:2]))
+            found[name] = max(taxid, 0)
+        taxids[missing] = names.map(found).to_numpy(dtype=np.int64)
+    return taxids
 
+def assign_blast_lca(blast_results, taxonomy=None, accession_index=None, top_percent=None):
+    """
+    Assign each query one taxon from its hits.
 
-def create_kraken_style_report_from_blast(blast_results, output_file, organism_counts=None):
+    Hits scoring within ``top_percent`` of the query's best bitscore are
+    kept, and the query goes to the lowest common ancestor of their taxa,
+    computed for all queries at once. Queries whose hits cannot be placed
+    in the taxonomy (or every query, without one) fall back to the organism
+    of their best hit with taxid 0. Returns a DataFrame with query_id,
+    taxid, name and hits (the query's total hit count).
     """
-    Create a Kraken-style report from BLAST results using consistent organism counts
+    columns = ['query_id', 'taxid', 'name', 'hits']
+    top_percent = BLAST_CONFIG['lca_top_percent'] if top_percent is None else top_percent
+    rows = [(i, hit.get('bit_score', 0.0), hit.get('taxid', 0), hit.get('hit_id', ''),
+             hit.get('organism', 'Unknown'))
+            for i, result in enumerate(blast_results) if 'error' not in result
+            for hit in result['hits']]
+    hits = pd.DataFrame(rows, columns=['query', 'bitscore', 'taxid', 'hit_id', 'organism'])
+    if hits.empty:
+        return pd.DataFrame(columns=columns)
+
+    by_query = hits.groupby('query')['bitscore']
+    best_hits = hits.loc[by_query.idxmax()]
+    assigned = pd.DataFrame({'taxid': 0, 'name': best_hits['organism'].to_numpy()},
+                            index=best_hits['query'].to_numpy())
+    assigned['hits'] = by_query.size()
+
+    if taxonomy is not None:
+        top = hits[hits['bitscore'] >= by_query.transform('max') * (1 - top_percent / 100)]
+        nodes = taxonomy.index(resolve_hit_taxids(top, taxonomy, accession_index))
+        placed = nodes >= 0
+        queries, lca = group_lca(taxonomy, top['query'].to_numpy()[placed], nodes[placed])
+        queries, lca = queries[lca >= 0], lca[lca >= 0]
+        assigned.loc[queries, 'taxid'] = lca
+        assigned.loc[queries, 'name'] = taxonomy.names_of(lca)
+
+    assigned['query_id'] = [blast_results[i]['query_id'] for i in assigned.index]
+    return assigned[columns].reset_index(drop=True)
+
+def create_kraken_style_report_from_blast(assignments, total_sequences, output_file):
     """
+    Create a flat Kraken-style report from per-query assignments: one line
+    per assigned organism, counting sequences
+    """
+    counts = assignments.groupby(['name', 'taxid'], sort=False).size().sort_values(ascending=False, kind='stable')
+    unclassified = total_sequences - len(assignments)
     
-    # If organism_counts not provided, calculate them (for backward compatibility)
-    if organism_counts is None:
-        organism_counts = Counter()
-        organism_sequences = {}
-        
-        for result in blast_results:
-            if 'error' in result or not result['hits']:
-                continue
-                
-            for hit in result['hits']:
-                organism = hit.get('organism', 'Unknown')
-                organism_counts[organism] += 1
-                
-                if organism not in organism_sequences:
-                    organism_sequences[organism] = set()
-                organism_sequences[organism].add(result['query_id'])
-    else:
-        # Recalculate organism_sequences for consistency
-        organism_sequences = {}
-        for result in blast_results:
-            if 'error' in result or not result['hits']:
-                continue
-                
-            for hit in result['hits']:
-                organism = hit.get('organism', 'Unknown')
-                if organism not in organism_sequences:
-                    organism_sequences[organism] = set()
-                organism_sequences[organism].add(result['query_id'])
-    
-    total_sequences = len([r for r in blast_results if 'error' not in r])
-    classified_sequences = len([r for r in blast_results if 'error' not in r and r['hits']])
-    total_hits = sum(organism_counts.values())
-    
-    # Write Kraken-style report using the same organism counts as summary
     with open(output_file, 'w') as f:
-        # Header line for unclassified
-        unclassified = total_sequences - classified_sequences
         unclassified_pct = (unclassified / total_sequences) * 100 if total_sequences > 0 else 0
         f.write(f"{unclassified_pct:.2f}\t{unclassified}\t{unclassified}\tU\t0\tunclassified\n")
         
-        # Organism lines sorted by hit count (same as summary)
-        for organism, hit_count in organism_counts.most_common():
-            sequences_with_hits = len(organism_sequences.get(organism, set()))
-            
-            # Calculate percentage based on hit count relative to total hits
-            percentage = (hit_count / total_hits) * 100 if total_hits > 0 else 0
-            
-            # Use hit count as the main count
-            f.write(f"{percentage:.2f}\t{hit_count}\t{sequences_with_hits}\tS\t0\t{organism}\n")
+        for (organism, taxid), sequences in counts.items():
+            percentage = (sequences / total_sequences) * 100 if total_sequences > 0 else 0
+            f.write(f"{percentage:.2f}\t{sequences}\t{sequences}\tS\t{taxid}\t{organism}\n")
 
 def create_blast_taxonomy_summary(blast_results, output_dir):
     """Create comprehensive summary report from BLAST taxonomy results"""
     
     summary_file = output_dir / "blast_taxonomy_summary.txt"
-    organism_counts = Counter()  # This will count total hits per organism
-    organism_sequences = {}
-    total_hits = 0
-    sequences_with_hits = 0
+    valid_results = [result for result in blast_results if 'error' not in result]
+    total_hits = sum(len(result['hits']) for result in valid_results)
     
-    # Analyze results - count ALL hits to match Kraken-style report
-    for result in blast_results:
-        if 'error' in result:
-            continue
-            
-        if result['hits']:
-            sequences_with_hits += 1
-            
-            for hit in result['hits']:
-                organism = hit.get('organism', 'Unknown')
-                organism_counts[organism] += 1  # Count every hit
-                total_hits += 1
-                
-                # Track which sequences hit each organism
-                if organism not in organism_sequences:
-                    organism_sequences[organism] = set()
-                organism_sequences[organism].add(result['query_id'])
+    # One taxon per sequence, so sequences with many hits do not inflate abundances
+    taxonomy = load_taxonomy()
+    needs_index = taxonomy is not None and any('taxid' not in hit for result in valid_results
+                                               for hit in result['hits'])
+    assignments = assign_blast_lca(blast_results, taxonomy, open_accession_index() if needs_index else None)
+    sequences_with_hits = len(assignments)
+    
+    organism_counts = Counter()  # Total hits of the sequences assigned to each organism
+    organism_sequences = {}
+    for row in assignments.itertuples(index=False):
+        organism_counts[row.name] += row.hits
+        organism_sequences.setdefault(row.name, set()).add(row.query_id)
+    ranked = rank_organisms(organism_counts, organism_sequences)
     
     # Write comprehensive summary
     with open(summary_file, 'w') as f:
@@ -375,47 +669,60 @@ def create_blast_taxonomy_summary(blast_results, output_dir):
         f.write(f"Total sequences analyzed: {len(blast_results)}\n")
         f.write(f"Sequences with hits: {sequences_with_hits}\n")
         f.write(f"Total BLAST hits: {total_hits}\n")
-        f.write(f"Unique organisms identified: {len(organism_counts)}\n\n")
+        f.write(f"Unique organisms identified: {len(organism_sequences)}\n\n")
         
-        if organism_counts:
-            f.write("TOP ORGANISMS BY TOTAL HITS:\n")
+        if organism_sequences:
+            f.write("TOP ORGANISMS BY ASSIGNED SEQUENCES:\n")
             f.write("-" * 40 + "\n")
-            f.write(f"{'Organism':<30} {'Total Hits':<10} {'Sequences':<10} {'Avg Hits/Seq':<12}\n")
+            f.write(f"{'Organism':<30} {'Sequences':<10} {'Total Hits':<10} {'Avg Hits/Seq':<12}\n")
             f.write("-" * 40 + "\n")
             
-            for organism, hit_count in organism_counts.most_common(20):
-                seq_count = len(organism_sequences.get(organism, set()))
+            for organism in ranked[:20]:
+                seq_count = len(organism_sequences[organism])
+                hit_count = organism_counts[organism]
                 avg_hits = hit_count / seq_count if seq_count > 0 else 0
-                f.write(f"{organism[:29]:<30} {hit_count:<10} {seq_count:<10} {avg_hits:<12.1f}\n")
+                f.write(f"{organism[:29]:<30} {seq_count:<10} {hit_count:<10} {avg_hits:<12.1f}\n")
         else:
             f.write("No significant taxonomic matches found.\n")
         
         # Add quality metrics
         f.write(f"\nQUALITY METRICS:\n")
         f.write("-" * 20 + "\n")
-        f.write(f"Classification rate: {sequences_with_hits/len(blast_results)*100:.1f}%\n")
+        f.write(f"Classification rate: {sequences_with_hits/len(blast_results)*100:.1f}%\n" if blast_results else "")
         f.write(f"Average hits per classified sequence: {total_hits/sequences_with_hits:.1f}\n" if sequences_with_hits > 0 else "")
     
-    # Create Kraken-style report for compatibility - pass the same organism_counts
-    kraken_style_report = output_dir / "blast_report.txt"
-    create_kraken_style_report_from_blast(blast_results, kraken_style_report, organism_counts)
+    # Flat per-organism report and, with the taxonomy,
+    # a full Kraken-format tree of the LCA assignments for create_visualizations
+    create_kraken_style_report_from_blast(assignments, len(valid_results), output_dir / "blast_report.txt")
+    kraken_style_report = output_dir / "blast_kraken_style_report.txt"
+    if taxonomy is not None:
+        placed = assignments['taxid'].to_numpy(dtype=np.int64)
+        placed = placed[placed > 0]
+        write_kraken_report(taxonomy, np.bincount(placed, minlength=len(taxonomy)),
+                            len(valid_results) - len(placed), kraken_style_report)
+    else:
+        create_kraken_style_report_from_blast(assignments, len(valid_results), kraken_style_report)
     
     # Create hit comparison data for visualization - use same counts
     create_hit_comparison_data(organism_counts, organism_sequences, output_dir)
     
-    # Create Krona plot
-    create_krona_plot(output_dir)
-    
     return summary_file
 
+def rank_organisms(organism_counts, organism_sequences):
+    """Organisms by LCA-assigned sequences, then by the hits of those sequences"""
+    return sorted(organism_sequences,
+                  key=lambda organism: (len(organism_sequences[organism]), organism_counts[organism]),
+                  reverse=True)
+
 def create_hit_comparison_data(organism_counts, organism_sequences, output_dir):
     """Create data file for organism hit comparison visualization using consistent counts"""
     
     comparison_data = []
     
-    # Use the same organism_counts ranking as summary and Kraken report
-    for organism, hit_count in organism_counts.most_common(10):  # Top 10
-        seq_count = len(organism_sequences.get(organism, set()))
+    # Same ranking as the summary: one vote per assigned sequence, not per raw hit
+    for organism in rank_organisms(organism_counts, organism_sequences)[:10]:  # Top 10
+        hit_count = organism_counts[organism]
+        seq_count = len(organism_sequences[organism])
         avg_hits = hit_count / seq_count if seq_count > 0 else 0
         
         comparison_data.append({
@@ -0,0 +1,365 @@
+import json
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from .config import TAXDUMP_NODES, TAXDUMP_NAMES
+from .utils import exclusive_build, replace_directory
+
+_build_lock = threading.Lock()
+
+# Ranks with a one-letter code in Kraken2 reports; other ranks get the code of
+# the nearest ranked ancestor plus the number of levels below it (e.g. 'S1')
+KRAKEN_RANK_CODES = {
+    'superkingdom': 'D', 'domain': 'D', 'kingdom': 'K', 'phylum': 'P', 'class': 'C',
+    'order': 'O', 'family': 'F', 'genus': 'G', 'species': 'S'
+}
+
+ABSENT = 255  # rank value of taxids missing from nodes.dmp
+
+CACHE_FILES = ['parent.npy', 'rank.npy', 'depth.npy', 'name_offsets.npy', 'names.npy',
+               'name_order.npy', 'merged.npy', 'ranks.json']
+
+
+def _parents(tree, nodes):
+    # Parent of each node, keeping -1 (no node) as -1
+    return np.where(nodes >= 0, tree.parent[np.maximum(nodes, 0)], -1)
+
+
+def _depths(tree, nodes):
+    return np.where(nodes >= 0, tree.depth[np.maximum(nodes, 0)], -1)
+
+
+def ancestor_at_depth(tree, nodes, depths):
+    """Vectorized ancestor of each node at the given depth (the node itself when not deeper)"""
+    current = np.asarray(nodes, dtype=np.int64).copy()
+    for _ in range(tree.max_depth):
+        deeper = _depths(tree, current) > depths
+        if not deeper.any():
+            break
+        current = np.where(deeper, _parents(tree, current), current)
+    return current
+
+
+def lowest_common_ancestor(tree, a, b):
+    """Vectorized pairwise LCA of two node arrays; -1 when either is -1 or they share no root"""
+    a = ancestor_at_depth(tree, a, _depths(tree, np.asarray(b, dtype=np.int64)))
+    b = ancestor_at_depth(tree, b, _depths(tree, a))
+    for _ in range(tree.max_depth + 1):
+        differ = a != b
+        if not differ.any():
+            break
+        a = np.where(differ, _parents(tree, a), a)
+        b = np.where(differ, _parents(tree, b), b)
+    return np.where((a >= 0) & (a == b), a, -1)
+
+
+def _group_starts(sorted_keys):
+    # Index of the first element of each run of equal keys
+    return np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+
+def group_lca(tree, groups, nodes):
+    """
+    LCA of the nodes of each group, vectorized over all groups.
+
+    Neighbouring members of every group are merged pairwise, halving the
+    groups each round, so k members take log2(k) rounds. Returns the sorted
+    distinct groups and their LCA node (-1 when members share no root or a
+    member is -1).
+    """
+    groups = np.asarray(groups)
+    order = np.argsort(groups, kind='stable')
+    groups, nodes = groups[order], np.asarray(nodes, dtype=np.int64)[order]
+    while len(groups):
+        starts = _group_starts(groups)
+        if len(starts) == len(groups):
+            break
+        position = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+        even = np.flatnonzero(position % 2 == 0)
+        partner = np.minimum(even + 1, len(groups) - 1)
+        paired = (even + 1 < len(groups)) & (groups[partner] == groups[even])
+        merged = nodes[even]
+        merged[paired] = lowest_common_ancestor(tree, merged[paired], nodes[partner[paired]])
+        groups, nodes = groups[even], merged
+    return groups, nodes
+
+
+def clade_counts(tree, node_counts):
+    """Sum per-node counts up the tree, one vectorized pass per depth: the count of every clade"""
+    clade = np.array(node_counts, dtype=np.int64)
+    for depth in range(tree.max_depth, 0, -1):
+        level = np.flatnonzero((tree.depth == depth) & (tree.parent >= 0))
+        np.add.at(clade, tree.parent[level], clade[level])
+    return clade
+
+
+def in_clade(tree, nodes, ancestors):
+    """Vectorized test of whether each node lies in the clade rooted at the matching ancestor"""
+    nodes = np.asarray(nodes, dtype=np.int64)
+    ancestors = np.asarray(ancestors, dtype=np.int64)
+    inside = (nodes == ancestors) & (nodes >= 0)
+    current = nodes.copy()
+    for _ in range(tree.max_depth):
+        current = _parents(tree, current)
+        inside |= (current == ancestors) & (current >= 0)
+        if not (current >= 0).any():
+            break
+    return inside
+
+
+def _read_dmp(path, columns):
+    # .dmp fields are separated by "\t|\t"; splitting on tabs puts them at even positions
+    return pd.read_csv(path, sep='\t', header=None, usecols=columns, quoting=3, dtype=str,
+                       keep_default_na=False)
+
+
+def build_taxonomy_cache(nodes_file=TAXDUMP_NODES, names_file=TAXDUMP_NAMES, cache_dir=None):
+    """
+    Parse nodes.dmp and names.dmp into NumPy arrays indexed by taxid.
+
+    parent (int32, -1 at the root), rank (uint8 index into ranks.json,
+    255 for unused taxids), depth (uint8) and the scientific names as one
+    UTF-8 byte array with int64 offsets, plus taxids sorted by name for
+    lookups and merged.dmp's old -> new pairs when present. Each array is
+    saved as .npy so Taxonomy can memory-map it.
+    """
+    nodes_file = Path(nodes_file)
+    cache_dir = Path(cache_dir or nodes_file.parent / "taxonomy_cache")
+    print(f"Building taxonomy cache from {nodes_file}...")
+
+    nodes = _read_dmp(nodes_file, [0, 2, 4])
+    taxids = nodes[0].astype(np.int64).to_numpy()
+    parents = nodes[2].astype(np.int64).to_numpy()
+    size = int(taxids.max()) + 1
+
+    rank_names, rank_index = np.unique(nodes[4].to_numpy(dtype=str), return_inverse=True)
+    rank = np.full(size, ABSENT, dtype=np.uint8)
+    rank[taxids] = rank_index
+    parent = np.full(size, -1, dtype=np.int32)
+    parent[taxids] = np.where(parents == taxids, -1, parents)  # the root is its own parent
+
+    # Depth by relaxing depth[node] = depth[parent] + 1 from the root down
+    depth = np.zeros(size, dtype=np.int64)
+    has_parent = taxids[parent[taxids] >= 0]
+    for _ in range(256):
+        updated = depth[parent[has_parent]] + 1
+        if np.array_equal(updated, depth[has_parent]):
+            break
+        depth[has_parent] = updated
+    else:
+        raise ValueError(f"Taxonomy in {nodes_file} contains a cycle")
+
+    names = _read_dmp(names_file, [0, 2, 6])
+    names = names[names[6] == 'scientific name'].drop_duplicates(0)
+    name_taxids = names[0].astype(np.int64).to_numpy()
+    inside = name_taxids < size
+    name_taxids = name_taxids[inside]
+    encoded = [name.encode('utf-8') for name in names[2].to_numpy()[inside]]
+
+    # Names are concatenated in taxid order; node t spans offsets[t]:offsets[t + 1]
+    lengths = np.zeros(size, dtype=np.int64)
+    lengths[name_taxids] = [len(name) for name in encoded]
+    name_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=name_offsets[1:])
+    by_taxid = np.argsort(name_taxids)
+    name_bytes = np.frombuffer(b''.join(encoded[i] for i in by_taxid), dtype=np.uint8)
+    by_name = sorted(range(len(encoded)), key=encoded.__getitem__)
+    name_order = name_taxids[by_name].astype(np.int32)
+
+    merged = np.zeros((0, 2), dtype=np.int32)
+    merged_file = nodes_file.parent / "merged.dmp"
+    if merged_file.exists():
+        pairs = _read_dmp(merged_file, [0, 2]).astype(np.int64).to_numpy()
+        merged = pairs[np.argsort(pairs[:, 0])].astype(np.int32)
+
+    # Built in a private directory and swapped in whole, so readers never see a partial cache
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=cache_dir.parent, prefix=f".{cache_dir.name}."))
+    try:
+        np.save(tmp_dir / "parent.npy", parent)
+        np.save(tmp_dir / "rank.npy", rank)
+        np.save(tmp_dir / "depth.npy", depth.astype(np.uint8))
+        np.save(tmp_dir / "name_offsets.npy", name_offsets)
+        np.save(tmp_dir / "names.npy", name_bytes)
+        np.save(tmp_dir / "name_order.npy", name_order)
+        np.save(tmp_dir / "merged.npy", merged)
+        with open(tmp_dir / "ranks.json", 'w') as f:
+            json.dump(rank_names.tolist(), f)
+        replace_directory(tmp_dir, cache_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    print(f"✓ Taxonomy cache with {len(taxids)} taxa written to {cache_dir}")
+    return cache_dir
+
+
+class Taxonomy:
+    """
+    NCBI taxonomy as memory-mapped NumPy arrays indexed by taxid.
+
+    The arrays are built from nodes.dmp/names.dmp on first use (or when the
+    dump files are newer than the cache) and memory-mapped afterwards, so
+    loading takes milliseconds. Nodes are the taxids themselves: ``index``
+    maps merged taxids to their replacement and unknown ones to -1, and the
+    module-level ancestor, LCA and clade helpers work on it exactly as on a
+    ReportTree.
+
+        taxonomy = Taxonomy()
+        genus = taxonomy.rollup([562, 1280], 'genus')
+    """
+
+    def __init__(self, nodes_file=TAXDUMP_NODES, names_file=TAXDUMP_NAMES, cache_dir=None, rebuild=False):
+        nodes_file = Path(nodes_file)
+        names_file = Path(names_file)
+        cache_dir = Path(cache_dir or nodes_file.parent / "taxonomy_cache")
+        sources = [nodes_file, names_file, nodes_file.parent / "merged.dmp"]
+        if rebuild or self._stale(cache_dir, sources):
+            # Only one stage or process builds; the others wait and then load its cache
+            with exclusive_build(cache_dir.parent / f".{cache_dir.name}.lock", _build_lock):
+                if rebuild or self._stale(cache_dir, sources):
+                    build_taxonomy_cache(nodes_file, names_file, cache_dir)
+
+        def load(name):
+            return np.load(cache_dir / name, mmap_mode='r')
+
+        self.parent = load("parent.npy")
+        self.rank = load("rank.npy")
+        self.depth = load("depth.npy")
+        self._name_offsets = load("name_offsets.npy")
+        self._names = load("names.npy")
+        self._name_order = load("name_order.npy")
+        merged = np.load(cache_dir / "merged.npy")
+        self._merged_old, self._merged_new = merged[:, 0], merged[:, 1]
+        with open(cache_dir / "ranks.json", 'r') as f:
+            self.rank_names = json.load(f)
+        self.taxids = np.arange(len(self.parent))
+        self.max_depth = int(self.depth.max()) if len(self.depth) else 0
+        self._rank_codes = {}
+
+    @staticmethod
+    def _stale(cache_dir, sources):
+        if not all((cache_dir / name).exists() for name in CACHE_FILES):
+            return True
+        built = (cache_dir / "parent.npy").stat().st_mtime
+        return any(source.exists() and source.stat().st_mtime > built for source in sources)
+
+    @classmethod
+    def available(cls, nodes_file=TAXDUMP_NODES, names_file=TAXDUMP_NAMES):
+        return Path(nodes_file).exists() and Path(names_file).exists()
+
+    def __len__(self):
+        return len(self.parent)
+
+    def index(self, taxids):
+        """Node of each taxid (merged taxids follow merged.dmp), -1 when unknown"""
+        taxids = np.asarray(taxids, dtype=np.int64)
+        if len(self._merged_old):
+            pos = np.minimum(np.searchsorted(self._merged_old, taxids), len(self._merged_old) - 1)
+            taxids = np.where(self._merged_old[pos] == taxids, self._merged_new[pos], taxids)
+        valid = (taxids > 0) & (taxids < len(self.parent))
+        nodes = np.where(valid, taxids, 0)
+        return np.where(valid & (self.rank[nodes] != ABSENT), nodes, -1)
+
+    def name(self, node):
+        if node < 0:
+            return ''
+        return bytes(self._names[self._name_offsets[node]:self._name_offsets[node + 1]]).decode('utf-8')
+
+    def names_of(self, nodes):
+        return [self.name(int(node)) for node in np.asarray(nodes).ravel()]
+
+    def rank_of(self, node):
+        return self.rank_names[self.rank[node]] if node >= 0 and self.rank[node] != ABSENT else ''
+
+    def rank_code(self, node):
+        """Kraken2 report rank code: 'S', 'G', ... or e.g. 'G1' below a genus, 'R' for the root"""
+        node = int(node)
+        if node not in self._rank_codes:
+            if self.parent[node] < 0:
+                code = 'R'
+            else:
+                code = KRAKEN_RANK_CODES.get(self.rank_of(node))
+                if code is None:
+                    parent_code = self.rank_code(self.parent[node])
+                    base = parent_code.rstrip('0123456789')
+                    level = int(parent_code[len(base):] or 0)
+                    code = f"{base}{level + 1}"
+            self._rank_codes[node] = code
+        return self._rank_codes[node]
+
+    def find(self, name):
+        """Taxid with this exact scientific name, or -1 (binary search on the name index)"""
+        key = name.encode('utf-8')
+        low, high = 0, len(self._name_order)
+        while low < high:
+            middle = (low + high) // 2
+            taxid = int(self._name_order[middle])
+            if bytes(self._names[self._name_offsets[taxid]:self._name_offsets[taxid + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._name_order):
+            taxid = int(self._name_order[low])
+            if self.name(taxid) == name:
+                return taxid
+        return -1
+
+    def lineage(self, taxid):
+        """Taxids from the root down to ``taxid`` ([] when unknown)"""
+        node = int(self.index([taxid])[0])
+        path = []
+        while node >= 0:
+            path.append(node)
+            node = int(self.parent[node])
+        return path[::-1]
+
+    def lineages(self, taxids):
+        """
+        Ancestors of many taxids at once as an (n, max_depth + 1) array;
+        column d holds the ancestor at depth d, -1 below each taxon.
+        """
+        nodes = self.index(taxids)
+        table = np.full((len(nodes), self.max_depth + 1), -1, dtype=np.int64)
+        current = nodes.copy()
+        for _ in range(self.max_depth + 1):
+            present = current >= 0
+            if not present.any():
+                break
+            table[np.flatnonzero(present), self.depth[current[present]]] = current[present]
+            current = _parents(self, current)
+        return table
+
+    def rollup(self, taxids, rank):
+        """Ancestor of each taxid at ``rank`` (e.g. 'genus'), 0 when it has none"""
+        if rank not in self.rank_names:
+            raise ValueError(f"Unknown rank '{rank}'")
+        target = self.rank_names.index(rank)
+        current = self.index(taxids)
+        result = np.zeros(len(current), dtype=np.int64)
+        for _ in range(self.max_depth + 1):
+            present = current >= 0
+            if not present.any():
+                break
+            hit = present & (self.rank[np.maximum(current, 0)] == target)
+            result[hit] = current[hit]
+            current = np.where(hit, -1, _parents(self, current))
+        return result
+
+    def lca(self, a, b):
+        """Pairwise LCA of two taxid arrays, 0 when unknown"""
+        nodes = lowest_common_ancestor(self, self.index(a), self.index(b))
+        return np.maximum(nodes, 0)
+
+
+def load_taxonomy():
+    """The NCBI taxonomy from the configured dump, or None when it is not installed"""
+    if not Taxonomy.available():
+        return None
+    try:
+        return Taxonomy()
+    except Exception as e:
+        print(f"Warning: Could not load taxonomy from {TAXDUMP_NODES}: {e}")
+        return None
@@ -1,11 +1,27 @@
 import subprocess
 import os
+import io
+import gzip
+import math
+import random
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import islice
+try:
+    import fcntl
+except ImportError:  # Windows: threads are still serialized, other processes are not
+    fcntl = None
 from pathlib import Path
 import json
 from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+import numpy as np
 import pandas as pd
 from collections import Counter
 from .config import *
+from .blast_cache import BlastCache, CACHE_DB_NAME
 import requests
 import time
 from datetime import datetime, timedelta
@@ -50,39 +66,13 @@ def check_ncbi_api_status():
 
 def cleanup_blast_cache(cache_dir, max_age_days=30):
     """Clean up old cache entries"""
-    if not cache_dir.exists():
-        return
-    
-    cache_file = cache_dir / "blast_cache.json"
-    if not cache_file.exists():
+    if not (cache_dir / CACHE_DB_NAME).exists():
         return
     
     try:
-        with open(cache_file, 'r') as f:
-            cache = json.load(f)
-        
-        current_time = time.time()
-        cutoff_time = current_time - (max_age_days * 24 * 60 * 60)
-        
-        # Remove old entries
-        cleaned_cache = {}
-        removed_count = 0
-        
-        for key, value in cache.items():
-            if isinstance(value, dict) and 'timestamp' in value:
-                if value['timestamp'] > cutoff_time:
-                    cleaned_cache[key] = value
-                else:
-                    removed_count += 1
-            else:
-                # Keep entries without timestamp (backwards compatibility)
-                cleaned_cache[key] = value
-        
-        if removed_count > 0:
-            with open(cache_file, 'w') as f:
-                json.dump(cleaned_cache, f, indent=2)
-            print(f"✓ Cleaned {removed_count} old cache entries")
-        
+        cache = BlastCache(cache_dir, expiry_days=max_age_days)
+        cache.cleanup()
+        cache.close()
     except Exception as e:
         print(f"Warning: Could not clean cache: {e}")
 
@@ -99,25 +89,109 @@ def estimate_blast_time(num_sequences, avg_length=1000):
     else:
         return f"~{total_seconds/3600:.1f} hours"
 
+def iter_fasta(fasta_path, min_length=0):
+    """Stream (id, sequence) pairs from a FASTA file, skipping sequences shorter than min_length"""
+    with open(fasta_path, 'r') as f:
+        for title, sequence in SimpleFastaParser(f):
+            if len(sequence) >= min_length:
+                yield (title.split(None, 1)[0] if title else ''), sequence
+
+def _length_stratum(length):
+    # Power-of-two length classes: 64-127 bp, 128-255 bp, ...
+    return length.bit_length()
+
+def _reservoir_add(reservoir, seen, item, size, rng):
+    """Algorithm R step: keep ``item`` (the seen-th so far) with probability size/seen"""
+    if len(reservoir) < size:
+        reservoir.append(item)
+    else:
+        slot = rng.randrange(seen)
+        if slot < size:
+            reservoir[slot] = item
+
+def _proportional_quotas(counts, total):
+    """Split ``total`` picks across strata in proportion to their counts (largest remainder)"""
+    size = sum(counts.values())
+    exact = {key: total * count / size for key, count in counts.items()}
+    quotas = {key: int(value) for key, value in exact.items()}
+    leftover = total - sum(quotas.values())
+    for key in sorted(exact, key=lambda k: exact[k] - quotas[k], reverse=True)[:leftover]:
+        quotas[key] += 1
+    return quotas
+
+SAMPLING_METHODS = ['head', 'reservoir', 'length']
+
+def sample_sequences(records, max_sequences, method=None, seed=None):
+    """
+    Pick at most max_sequences records from a stream in a single pass.
+    
+    ``method`` is 'head' (first N, the old behaviour), 'reservoir' (uniform
+    random sample) or 'length' (reservoirs per power-of-two length class,
+    combined in proportion to each class's share of the input so short and
+    long contigs are both represented). Memory is bounded by the sample size
+    (per length class for 'length'), not the input size. Returns (sample in input order, number of records seen).
+    """
+    method = method or BLAST_CONFIG['sampling']
+    rng = random.Random(BLAST_CONFIG['sampling_seed'] if seed is None else seed)
+    
+    if method == 'head':
+        sample = []
+        seen = 0
+        for record in records:
+            if seen < max_sequences:
+                sample.append((seen, record))
+            seen += 1
+    elif method == 'reservoir':
+        sample = []
+        seen = 0
+        for record in records:
+            seen += 1
+            _reservoir_add(sample, seen, (seen, record), max_sequences, rng)
+    elif method == 'length':
+        reservoirs = {}
+        counts = Counter()
+        seen = 0
+        for record in records:
+            seen += 1
+            stratum = _length_stratum(len(record[1]))
+            counts[stratum] += 1
+            _reservoir_add(reservoirs.setdefault(stratum, []), counts[stratum], (seen, record),
+                           max_sequences, rng)
+        
+        sample = []
+        if seen:
+            for stratum, quota in _proportional_quotas(counts, min(max_sequences, seen)).items():
+                sample.extend(rng.sample(reservoirs[stratum], quota))
+    else:
+        raise ValueError(f"Unknown sampling method '{method}' (choose from head, reservoir, length)")
+    
+    sample.sort(key=lambda item: item[0])
+    return [record for _, record in sample], seen
+
 def validate_fasta_for_blast(fasta_path, min_length=50, max_sequences=1000):
     """Validate FASTA file for BLAST analysis"""
     if not fasta_path.exists():
         return False, "FASTA file does not exist"
     
-    sequences = list(SeqIO.parse(fasta_path, "fasta"))
+    total = 0
+    valid = 0
+    with open(fasta_path, 'r') as f:
+        for _, sequence in SimpleFastaParser(f):
+            total += 1
+            if len(sequence) >= min_length:
+                valid += 1
     
-    if not sequences:
+    if not total:
         return False, "No sequences found in FASTA file"
     
-    valid_sequences = [seq for seq in sequences if len(seq.seq) >= min_length]
-    
-    if not valid_sequences:
+    if not valid:
         return False, f"No sequences longer than {min_length} bp found"
     
-    if len(sequences) > max_sequences:
-        return True, f"Warning: {len(sequences)} sequences found, will process first {max_sequences}"
+    if valid > max_sequences:
+        return True, (f"Warning: {valid} sequences found, will process a {BLAST_CONFIG['sampling']} "
+                      f"sample of {max_sequences}")
     
-    return True, f"Ready to process {len(valid_sequences)} sequences"
+    return True, f"Ready to process {valid} sequences"
 
 def check_dependencies():
     """Verify required tools are installed"""
@@ -126,20 +200,14 @@ def check_dependencies():
         'bracken': 'bracken --version', 
         'diamond': 'diamond version',
         'prokka': 'prokka --version',
-        'taxonkit': 'taxonkit version',
-        'ktImportText': 'ktImportText --version',
-        'seqtk': 'seqtk'
+        'taxonkit': 'taxonkit version'
     }
     
     missing = []
     for cmd, ver_cmd in required.items():
         try:
-            if cmd == 'seqtk':
-                result = subprocess.run([cmd], capture_output=True, text=True)
-                # seqtk returns error code when run without args, but that's expected
-            else:
-                subprocess.run(ver_cmd.split(), check=True, 
-                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            subprocess.run(ver_cmd.split(), check=True, 
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             print(f"✓ {cmd} found")
         except (subprocess.CalledProcessError, FileNotFoundError):
             missing.append(cmd)
@@ -217,65 +285,287 @@ def check_database_status():
     
     return len(missing_required) == 0
 
+class ReadIdFilter:
+    """
+    Bounded-memory set of read IDs used to de-duplicate FASTA headers.
+    
+    A Bloom filter in a fixed numpy bit array: memory does not grow with the
+    number of reads. A false positive only renames a read that was in fact
+    unique, which is harmless; a true duplicate is always caught.
+    
+    The filter is sized for ``expected_items`` IDs at ``fp_rate``, but never
+    larger than ``max_bytes``; ``fp_rate`` then holds the rate the capped
+    filter can actually reach. IDs are hashed once with Python's own bytes
+    hash, so a filter is only meaningful within one process.
+    """
+    
+    def __init__(self, expected_items, max_bytes, fp_rate=0.001):
+        expected_items = max(expected_items, 1)
+        # -log2(p) hashes, and enough bits for n IDs to stay at p with that many
+        hashes = max(1, round(-math.log2(fp_rate)))
+        wanted_bits = math.ceil(-hashes * expected_items / math.log(1 - fp_rate ** (1 / hashes)))
+        size = max(min(max(wanted_bits // 8 + 1, 64 * 1024), max_bytes), 1)
+        self.bits = np.zeros(size, dtype=np.uint8)
+        self.nbits = size * 8
+        # A capped filter needs fewer hashes, or it fills up even faster
+        self.hashes = max(1, min(hashes, round(self.nbits / expected_items * math.log(2))))
+        self.fp_rate = (1 - math.exp(-self.hashes * expected_items / self.nbits)) ** self.hashes
+    
+    def _positions(self, items):
+        h1 = np.fromiter((hash(item) for item in items), dtype=np.int64, count=len(items)).view(np.uint64)
+        # Second hash for double hashing: a splitmix64 finalizer of the first
+        h2 = h1 ^ (h1 >> np.uint64(30))
+        h2 *= np.uint64(0xbf58476d1ce4e5b9)
+        h2 ^= h2 >> np.uint64(27)
+        h2 *= np.uint64(0x94d049bb133111eb)
+        h2 ^= h2 >> np.uint64(31)
+        h2 |= np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return h1, (h1[:, None] + steps * h2[:, None]) % np.uint64(self.nbits)
+    
+    def add_many(self, items):
+        """
+        Add IDs in order, returning a bool array that is True where an ID was
+        (probably) already present, in the filter or earlier in ``items``.
+        """
+        if not len(items):
+            return np.zeros(0, dtype=bool)
+        h1, positions = self._positions(items)
+        byte, mask = positions >> np.uint64(3), np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)
+        present = (self.bits[byte] & mask).all(axis=1)
+        _, first = np.unique(h1, return_index=True)
+        repeated = np.ones(len(items), dtype=bool)
+        repeated[first] = False
+        np.bitwise_or.at(self.bits, byte.ravel(), mask.ravel())
+        return present | repeated
+    
+    def add(self, item):
+        """Add an ID, returning True if it was (probably) already present"""
+        return bool(self.add_many([item])[0])
+
+def open_fastq(fastq_path):
+    """Open a plain or gzip-compressed FASTQ for buffered binary reading"""
+    buffer_size = FASTQ_CONFIG['buffer_size']
+    with open(fastq_path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    if compressed:
+        return io.BufferedReader(gzip.open(fastq_path, 'rb'), buffer_size)
+    return open(fastq_path, 'rb', buffering=buffer_size)
+
+def iter_fastq(fastq_path):
+    """
+    Yield (header, sequence) byte strings from a plain or gzipped FASTQ.
+    
+    The file is read in FASTQ_CONFIG['buffer_size'] blocks and split into
+    lines a block at a time. Records may wrap their sequence and quality over
+    several lines: the quality ends once it is as long as the sequence, so a
+    quality line starting with '@' or '+' is not mistaken for a header.
+    """
+    buffer_size = FASTQ_CONFIG['buffer_size']
+    with open_fastq(fastq_path) as f:
+        lines = []
+        tail = b''
+        while True:
+            block = f.read(buffer_size)
+            data = tail + block
+            if b'\r' in data:
+                data = data.replace(b'\r\n', b'\n')
+            new_lines = data.split(b'\n')
+            # The last piece is an unfinished line unless the file has ended
+            tail = new_lines.pop() if block else b''
+            lines += new_lines
+            
+            i, n = 0, len(lines)
+            while i < n:
+                header = lines[i]
+                if not header:
+                    i += 1
+                    continue
+                if not header.startswith(b'@'):
+                    raise ValueError(f"Malformed FASTQ record in {fastq_path}: {header[:50]!r}")
+                j = i + 1
+                while j < n and not lines[j].startswith(b'+'):
+                    j += 1
+                sequence = b''.join(lines[i + 1:j])
+                k, quality_length = j + 1, 0
+                while k < n and quality_length < len(sequence):
+                    quality_length += len(lines[k])
+                    k += 1
+                if j >= n or quality_length < len(sequence):
+                    break  # record continues in the next block
+                if quality_length != len(sequence):
+                    raise ValueError(f"FASTQ quality and sequence lengths differ in {fastq_path}: "
+                                     f"{header[:50]!r}")
+                yield header[1:], sequence
+                i = k
+            lines = lines[i:]
+            
+            if not block:
+                if any(lines):
+                    raise ValueError(f"Truncated FASTQ record at the end of {fastq_path}: {lines[0][:50]!r}")
+                return
+
+def estimate_read_count(fastq_paths):
+    """Rough read count from file sizes, used to size the ID filter"""
+    total = 0
+    for path in fastq_paths:
+        size = os.path.getsize(path)
+        # ~300 bytes per short-read record, ~4x compression for gzip
+        total += size * (4 if str(path).endswith('.gz') else 1) // 300
+    return total
+
 def convert_fastq_to_fasta(fastq_path, output_dir):
-    """Convert FASTQ to FASTA for downstream analysis, handling duplicate IDs"""
+    """
+    Convert FASTQ to FASTA for downstream analysis, handling duplicate IDs.
+    
+    Streams plain or gzipped FASTQ (including multi-line records) straight to
+    FASTA in one pass; IDs are cut at the first whitespace and repeated IDs
+    get a counter suffix.
+    """
     fasta_path = output_dir/"converted.fasta"
     
-    # Method 1: Use seqtk with deduplication by adding sequence counter
-    temp_fasta = output_dir/"temp_converted.fasta"
     # fastq_path may be str or list of two strings
     if isinstance(fastq_path, (list,tuple)):
         # merge both reads
-        fastq_str = " ".join(fastq_path)
+        fastq_paths = list(fastq_path)
     else:
-        fastq_str = fastq_path
-    cmd = f"seqtk seq -a {fastq_str} > {temp_fasta}"
-    print(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=True)
+        fastq_paths = [fastq_path]
     
-    # Remove duplicates and add unique identifiers
-    seen_ids = set()
-    counter = 0
+    print(f"Converting {', '.join(str(p) for p in fastq_paths)} to FASTA")
     
-    with open(temp_fasta, 'r') as infile, open(fasta_path, 'w') as outfile:
-        for line in infile:
-            if line.startswith('>'):
-                original_id = line.strip()[1:]  # Remove '>'
-                base_id = original_id.split()[0]  # Take first part before any spaces
+    expected_reads = estimate_read_count(fastq_paths)
+    seen_ids = ReadIdFilter(expected_reads, FASTQ_CONFIG['id_filter_mb'] * 1024 * 1024,
+                            FASTQ_CONFIG['id_filter_fp_rate'])
+    if seen_ids.fp_rate > FASTQ_CONFIG['id_filter_fp_rate']:
+        print(f"Warning: ~{expected_reads:,} reads exceed the {FASTQ_CONFIG['id_filter_mb']} MB read ID filter; "
+              f"about {seen_ids.fp_rate:.2%} of unique reads may get a counter suffix. "
+              f"Raise FASTQ_CONFIG['id_filter_mb'] to avoid this.")
+    counter = 0
+    reads = 0
+    
+    with open(fasta_path, 'wb', buffering=FASTQ_CONFIG['buffer_size']) as outfile:
+        for path in fastq_paths:
+            records = iter_fastq(path)
+            # IDs go through the filter a batch at a time
+            while True:
+                batch = list(islice(records, 65536))
+                if not batch:
+                    break
+                ids = [(header.split(None, 1) or [b''])[0] for header, _ in batch]
+                repeated = seen_ids.add_many(ids).tolist()
                 
-                # Create unique ID
-                if base_id in seen_ids:
-                    unique_id = f"{base_id}_{counter}"
-                    counter += 1
-                else:
-                    unique_id = base_id
-                    seen_ids.add(base_id)
+                # Create unique IDs
+                renamed = []
+                lines = []
+                for (_, sequence), base_id, duplicate in zip(batch, ids, repeated):
+                    if duplicate:
+                        base_id += f"_{counter}".encode()
+                        renamed.append(base_id)
+                        counter += 1
+                    lines.append(b'>' + base_id + b'\n' + sequence + b'\n')
+                seen_ids.add_many(renamed)
                 
-                outfile.write(f">{unique_id}\n")
-            else:
-                outfile.write(line)
+                outfile.write(b''.join(lines))
+                reads += len(batch)
     
-    # Clean up temp file
-    temp_fasta.unlink()
-    
-    print(f"✓ Converted FASTQ to FASTA with unique IDs: {fasta_path}")
+    print(f"✓ Converted {reads} reads from FASTQ to FASTA with unique IDs ({counter} renamed): {fasta_path}")
     return fasta_path
 
 
-def split_interleaved(interleaved_fastq: str, output_dir: Path) -> list:
+def _write_mate(interleaved_fastq, fifo, mate, errors):
+    """
+    Copy every other record (mate 0 = R1, 1 = R2) of an interleaved FASTQ into
+    a pipe. Records must be 4 lines; anything else is rejected rather than
+    pairing the wrong lines.
+    """
+    try:
+        with open_fastq(interleaved_fastq) as f, open(fifo, 'wb', buffering=FASTQ_CONFIG['buffer_size']) as out:
+            index = 0
+            while True:
+                header = f.readline()
+                if not header:
+                    break
+                sequence, separator, quality = f.readline(), f.readline(), f.readline()
+                if not header.startswith(b'@') or not separator.startswith(b'+') or not quality:
+                    raise ValueError(f"Malformed or multi-line FASTQ record in {interleaved_fastq}: "
+                                     f"{header[:50]!r}")
+                if index % 2 == mate:
+                    out.write(header + sequence + separator + quality)
+                index += 1
+    except BrokenPipeError:
+        # The reader exited early; its own exit status reports the failure
+        pass
+    except Exception as e:
+        errors.append(e)
+
+@contextmanager
+def interleaved_pipes(interleaved_fastq: str):
+    """
+    Expose an interleaved (plain or gzipped) FASTQ as two named pipes carrying
+    the R1 and R2 reads, without writing split copies to disk.
+    
+    Each pipe has its own writer thread that reads the interleaved file
+    independently and keeps every other record, so a consumer may read the
+    two pipes in any order without deadlocking. Yields [R1 pipe, R2 pipe].
+    """
+    with tempfile.TemporaryDirectory(prefix="metaquest_pairs_") as tmp_dir:
+        fifos = [os.path.join(tmp_dir, "R1.fastq"), os.path.join(tmp_dir, "R2.fastq")]
+        errors = []
+        writers = []
+        for mate, fifo in enumerate(fifos):
+            os.mkfifo(fifo)
+            writer = threading.Thread(target=_write_mate, args=(interleaved_fastq, fifo, mate, errors),
+                                      daemon=True)
+            writer.start()
+            writers.append(writer)
+        
+        try:
+            yield fifos
+        finally:
+            for fifo, writer in zip(fifos, writers):
+                # Unblock a writer whose pipe was never (fully) read: holding the read end
+                # lets its open() return, closing it fails its writes. A writer still
+                # opening the FASTQ opens the pipe later, so repeat until it has exited.
+                while writer.is_alive():
+                    fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                    try:
+                        writer.join(0.1)
+                    finally:
+                        os.close(fd)
+        
+        if errors:
+            raise errors[0]
+
+@contextmanager
+def exclusive_build(lock_file, thread_lock):
     """
-    Split a single interleaved FASTQ into two files (R1, R2) using seqkit.
-    Requires seqkit in your PATH.
+    Hold ``thread_lock`` and an exclusive lock on ``lock_file`` while a shared
+    cache under databases/ is (re)built, so concurrent stages, batch samples
+    and other MetaQuest processes build it once instead of racing each other.
+    Callers check again whether the cache is stale once they hold the lock.
     """
-    r1 = output_dir / "split_R1.fastq"
-    r2 = output_dir / "split_R2.fastq"
-    cmd = (
-        f"seqkit split2 -1 {r1} -2 {r2} "
-        f"--by-pair {interleaved_fastq}"
-    )
-    print(f"Running: {cmd}")
-    subprocess.run(cmd, shell=True, check=True)
-    return [str(r1), str(r2)]
+    lock_file = Path(lock_file)
+    with thread_lock:
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_file, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def replace_directory(new_dir, target):
+    """Swap a freshly built directory in for ``target``, removing the old copy afterwards"""
+    new_dir, target = Path(new_dir), Path(target)
+    old_dir = None
+    if target.exists():
+        old_dir = Path(tempfile.mkdtemp(dir=target.parent, prefix=f".{target.name}.old."))
+        os.replace(target, old_dir)
+    os.replace(new_dir, target)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
 
 def parse_prokka_gff(gff_file):
     """Parse Prokka GFF file to count features"""
@@ -292,6 +582,27 @@ def parse_prokka_gff(gff_file):
     
     return feature_counts
 
+def parse_prokka_gene_coordinates(gff_file):
+    """Map Prokka locus tags to their (contig, start, end, strand) from the GFF"""
+    coordinates = {}
+    
+    with open(gff_file, 'r') as f:
+        for line in f:
+            # Prokka appends the contig sequences after a ##FASTA directive
+            if line.startswith('##FASTA'):
+                break
+            if line.startswith('#'):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 9 or parts[2] != 'CDS':
+                continue
+            attributes = dict(field.split('=', 1) for field in parts[8].split(';') if '=' in field)
+            locus_tag = attributes.get('locus_tag') or attributes.get('ID')
+            if locus_tag:
+                coordinates[locus_tag] = (parts[0], int(parts[3]), int(parts[4]), parts[6])
+    
+    return coordinates
+
 def has_taxonomy_info(pathogen_db_path):
     """Check if Diamond database has taxonomy information"""
     if pathogen_db_path is None:
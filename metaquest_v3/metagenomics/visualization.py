@@ -5,6 +5,8 @@ import plotly.graph_objects as go
 import numpy as np
 from pathlib import Path
 from .config import *
+from .hit_tables import SWISSPROT_COLUMNS, load_hits
+from .krona import write_krona_chart
 
 def create_visualizations(bracken_report, output_dir):
     """Create essential taxonomy visualizations - focusing on actionable insights"""
@@ -55,39 +57,21 @@ def create_visualizations(bracken_report, output_dir):
             fig.write_html(output_dir/"taxonomy_overview.html")
         
         # Keep Krona plot as it's uniquely informative for hierarchical data
-        create_krona_plot(df, abundance_col, name_col, output_dir)
+        create_krona_plot(bracken_report, output_dir)
         
     except Exception as e:
         print(f"Visualization error: {e}")
 
-def create_krona_plot(output_dir):
-    """Create Krona hierarchical plot directly from blast_report.txt to ensure consistency"""
+def create_krona_plot(report_file, output_dir):
+    """Create Krona hierarchical plot from a Bracken table or Kraken-format report, with full lineages"""
     try:
-        blast_report_file = output_dir / "blast_report.txt"
-        
-        if not blast_report_file.exists():
-            print("Warning: blast_report.txt not found, cannot create Krona plot")
+        if not Path(report_file).exists():
+            print(f"Warning: {report_file} not found, cannot create Krona plot")
             return
         
-        krona_input = output_dir / "krona_input.txt"
-        
-        with open(blast_report_file, 'r') as infile, open(krona_input, 'w') as outfile:
-            for line in infile:
-                parts = line.strip().split('\t')
-                if len(parts) >= 6:
-                    percentage = float(parts[0])
-                    hit_count = int(parts[1])
-                    organism = parts[5]
-                    
-                    # Skip unclassified and very low abundance
-                    if organism != "unclassified" and percentage > 0.1:
-                        outfile.write(f"{hit_count}\t{organism}\n")
-        
-        krona_output = output_dir / "taxonomy_krona.html"
-        cmd = f"ktImportText {krona_input} -o {krona_output}"
-        subprocess.run(cmd, shell=True, check=True)
+        krona_output = write_krona_chart(report_file, Path(output_dir) / "taxonomy_krona.html")
         print(f"✓ Krona plot created: {krona_output}")
-        print(f"  Krona input file: {krona_input}")
+        print(f"  Krona XML: {krona_output.with_suffix('.xml')}")
         
     except Exception as e:
         print(f"Krona plot error: {e}")
@@ -134,10 +118,8 @@ def create_functional_plots(prokka_dir, swissprot_results, output_dir):
     try:
         # SwissProt annotation results
         if swissprot_results and Path(swissprot_results).exists():
-            df = pd.read_csv(swissprot_results, sep='\t', header=None,
-                            names=['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 
-                                  'gapopen', 'qstart', 'qend', 'sstart', 'send', 
-                                  'evalue', 'bitscore', 'stitle'])
+            # Only identities are plotted
+            df = load_hits(swissprot_results, SWISSPROT_COLUMNS, usecols=['pident'])
             
             if len(df) == 0:
                 return
@@ -196,7 +178,7 @@ def generate_analysis_summary(output_dir):
         
         # Check what files were generated
         viz_files = ['taxonomy_overview.html', 'pathogen_summary.html', 
-                    'annotation_quality.html', 'krona.html']
+                    'annotation_quality.html', 'taxonomy_krona.html']
         
         for file in viz_files:
             if (output_dir / file).exists():
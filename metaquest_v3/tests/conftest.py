@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the package the way the metaquest wrapper runs it: as `metagenomics`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
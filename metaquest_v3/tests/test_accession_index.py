@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from metagenomics import accession_index
+from metagenomics.accession_index import AccessionIndex, build_accession_index, normalize_accession
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    # Tiny runs and merge blocks so the build goes through the external sort and k-way merge
+    monkeypatch.setitem(accession_index.ACCESSION_INDEX_CONFIG, 'sort_rows', 3)
+    monkeypatch.setitem(accession_index.ACCESSION_INDEX_CONFIG, 'merge_block_rows', 2)
+    seqid_map = tmp_path / "seqid2taxid.map"
+    seqid_map.write_text("WP_000003.1\t562\n"
+                         "ref|WP_000001.1|\t562\n"
+                         "NZ_CP000001.1\t28901\n"
+                         "WP_000002.1\t1280\n")
+    accession2taxid = tmp_path / "prot.accession2taxid"
+    accession2taxid.write_text("accession\taccession.version\ttaxid\tgi\n"
+                               "WP_000002\tWP_000002.1\t9999\t2\n"   # also in the first source
+                               "P0A7B8\tP0A7B8.1\t83333\t3\n"
+                               "WP_000009\tWP_000009.2\t590\t4\n"
+                               "XP_123\tXP_123.1\t0\t5\n"            # no taxid: skipped
+                               "A\t" + "A" * 30 + "\t1\t6\n")       # longer than key_bytes: skipped
+    return build_accession_index([seqid_map, accession2taxid], tmp_path / "accession_index")
+
+
+def test_subject_ids_are_reduced_to_their_accession():
+    assert normalize_accession('ref|WP_000001.1|') == 'WP_000001.1'
+    assert normalize_accession('gi|123|ref|NZ_CP000001.1|') == 'NZ_CP000001.1'
+    assert normalize_accession('sp|P0A7B8|HSLV_ECOLI') == 'P0A7B8'
+    assert normalize_accession('WP_000001.1') == 'WP_000001.1'
+
+
+def test_build_writes_sorted_unique_keys_with_the_first_source_winning(index_dir):
+    index = AccessionIndex(index_dir)
+    keys = list(index.keys)
+    assert keys == sorted(keys) and len(keys) == len(set(keys)) == 6
+    assert index.taxids[keys.index(b'WP_000002.1')] == 1280
+
+
+def test_lookup_resolves_every_id_format(index_dir):
+    index = AccessionIndex(index_dir)
+    taxids = index.lookup(['WP_000001.1', 'gi|7|ref|NZ_CP000001.1|', 'sp|P0A7B8.1|HSLV_ECOLI',
+                           'WP_000009',      # unversioned: first versioned key
+                           'WP_000001.1',    # repeated IDs are looked up once
+                           'WP_404.1', 'XP_123.1', ''])
+    assert taxids.dtype == np.uint32
+    assert taxids.tolist() == [562, 28901, 83333, 590, 562, 0, 0, 0]
+
+
+def test_lookup_on_empty_input(index_dir):
+    assert AccessionIndex(index_dir).lookup([]).tolist() == []
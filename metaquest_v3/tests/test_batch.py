@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import pytest
+from metagenomics.batch import DiamondBatch, read_sample_sheet
+
+# Stands in for `diamond PROGRAM -d DB -q QUERY -o OUTPUT ...`: logs the query and hits every query once
+FAKE_DIAMOND = """#!/bin/sh
+echo "$5" >> "$DIAMOND_LOG"
+grep '^>' "$5" | sed 's/^>//; s/ .*//' | awk '{print $1"\\tsubject_"NR"\\t99.0"}' > "$7"
+"""
+
+
+@pytest.fixture
+def diamond_queries(tmp_path, monkeypatch):
+    """Fake diamond on PATH; returns a function listing the query files of each run so far"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "diamond").write_text(FAKE_DIAMOND)
+    (bin_dir / "diamond").chmod(0o755)
+    log = tmp_path / "diamond.log"
+    log.touch()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('DIAMOND_LOG', str(log))
+    return lambda: log.read_text().splitlines()
+
+
+def queries(tmp_path, sample, count):
+    path = tmp_path / f"{sample}_proteins.faa"
+    path.write_text(''.join(f">{sample}_gene{i} hypothetical protein\nMKLV\n" for i in range(count)))
+    return path
+
+
+def run_searches(batch, tmp_path, samples):
+    """Queue an AMR search for each sample from its own thread; returns the exceptions raised"""
+    errors = []
+
+    def search(sample, count):
+        try:
+            batch.for_sample(sample)('blastx', 'card', queries(tmp_path, sample, count),
+                                     tmp_path / f"{sample}_amr.tsv", '--evalue 1e-5', search='amr')
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=search, args=item) for item in samples]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return errors
+
+
+def test_identical_searches_from_two_samples_run_once_and_split_back(tmp_path, diamond_queries):
+    batch = DiamondBatch(tmp_path / "groups", group_size=2, max_wait=30)
+    for sample in ('s1', 's2'):
+        batch.join(sample, {'amr'})
+
+    assert run_searches(batch, tmp_path, [('s1', 2), ('s2', 3)]) == []
+
+    runs = diamond_queries()
+    assert len(runs) == 1 and 'diamond_group_' in runs[0]
+    assert (tmp_path / "s1_amr.tsv").read_text().splitlines() == [
+        "s1_gene0\tsubject_1\t99.0", "s1_gene1\tsubject_2\t99.0"]
+    assert [line.split('\t')[0] for line in (tmp_path / "s2_amr.tsv").read_text().splitlines()] == [
+        "s2_gene0", "s2_gene1", "s2_gene2"]
+    # The grouped query and hits are removed
+    assert list((tmp_path / "groups").iterdir()) == []
+
+
+@pytest.mark.parametrize("give_up", ['leave', 'stage_finished'])
+def test_sample_that_will_not_queue_the_search_releases_the_waiters(tmp_path, diamond_queries, give_up):
+    batch = DiamondBatch(tmp_path / "groups", group_size=2, max_wait=30)
+    batch.join('s1', {'amr'})
+    batch.join('s2', {'amr', 'vf'})
+
+    def s2_gives_up():
+        time.sleep(0.2)
+        if give_up == 'leave':
+            batch.leave('s2')
+        else:
+            # e.g. its AMR scan was reused from a previous run
+            batch.for_sample('s2').stage_finished('amr_scan')
+    threading.Thread(target=s2_gives_up).start()
+
+    start = time.monotonic()
+    assert run_searches(batch, tmp_path, [('s1', 2)]) == []
+    assert time.monotonic() - start < 5
+    assert diamond_queries() == [str(tmp_path / "s1_proteins.faa")]
+
+
+def test_search_without_other_pending_samples_runs_at_once(tmp_path, diamond_queries):
+    batch = DiamondBatch(tmp_path / "groups", group_size=4, max_wait=30)
+    batch.join('s1', {'amr'})
+    batch.join('s2', {'vf'})
+    start = time.monotonic()
+    assert run_searches(batch, tmp_path, [('s1', 1)]) == []
+    assert time.monotonic() - start < 5 and len(diamond_queries()) == 1
+
+
+def write_sheet(tmp_path, rows):
+    (tmp_path / "reads.fastq").write_text("@r1\nACGT\n+\nIIII\n")
+    (tmp_path / "reads_R2.fastq").write_text("@r1\nACGT\n+\nIIII\n")
+    sheet = tmp_path / "samples.tsv"
+    sheet.write_text("sample\ttype\tinput\tmate\n# comment\n" + ''.join('\t'.join(row) + '\n' for row in rows))
+    return sheet
+
+
+def test_sample_sheet_resolves_paths_relative_to_the_sheet(tmp_path):
+    sheet = write_sheet(tmp_path, [('paired', 'FASTQ', 'reads.fastq', 'reads_R2.fastq'),
+                                   ('mixed', 'fastq', 'reads.fastq', 'interleaved'),
+                                   ('single', 'fastq', str(tmp_path / 'reads.fastq'), '')])
+    samples = read_sample_sheet(sheet)
+
+    assert [s['sample'] for s in samples] == ['paired', 'mixed', 'single']
+    assert samples[0]['inputs'] == [str(tmp_path / 'reads.fastq'), str(tmp_path / 'reads_R2.fastq')]
+    assert [s['type'] for s in samples] == ['fastq'] * 3
+    assert [s['interleaved'] for s in samples] == [False, True, False]
+
+
+@pytest.mark.parametrize("rows, message", [
+    ([('s1', 'fastq', 'reads.fastq', ''), ('s1', 'fastq', 'reads.fastq', '')], "Duplicate sample names"),
+    ([('../s1', 'fastq', 'reads.fastq', '')], "Invalid sample name"),
+    ([('.hidden', 'fastq', 'reads.fastq', '')], "Invalid sample name"),
+    ([(' ', 'fastq', 'reads.fastq', '')], "Invalid sample name"),
+    ([('s1', 'bam', 'reads.fastq', '')], "type must be fasta or fastq"),
+    ([('s1', 'fasta', 'reads.fastq', 'reads_R2.fastq')], "only FASTQ samples can have a mate"),
+    ([], "No samples"),
+])
+def test_invalid_sample_sheets_are_rejected(tmp_path, rows, message):
+    with pytest.raises(ValueError, match=message):
+        read_sample_sheet(write_sheet(tmp_path, rows))
+
+
+def test_missing_inputs_and_columns_are_reported(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        read_sample_sheet(write_sheet(tmp_path, [('s1', 'fastq', 'absent.fastq', '')]))
+    sheet = tmp_path / "no_type.tsv"
+    sheet.write_text("sample\tinput\ns1\treads.fastq\n")
+    with pytest.raises(ValueError, match="missing column"):
+        read_sample_sheet(sheet)
@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import pytest
+from metagenomics import taxonomic_analysis
+from metagenomics.taxonomic_analysis import (RemoteBlastBackend, TokenBucket, blast_batch_online,
+                                             make_blast_batches, run_fasta_blast_taxonomy, submit_blast_query)
+
+HIT = """<Hit>
+  <Hit_num>1</Hit_num>
+  <Hit_id>gi|1|ref|{accession}|</Hit_id>
+  <Hit_def>{organism} chromosome, complete genome</Hit_def>
+  <Hit_accession>{accession}</Hit_accession>
+  <Hit_len>5000</Hit_len>
+  <Hit_hsps><Hsp>
+    <Hsp_num>1</Hsp_num><Hsp_bit-score>180.5</Hsp_bit-score><Hsp_score>200</Hsp_score>
+    <Hsp_evalue>1e-50</Hsp_evalue><Hsp_query-from>1</Hsp_query-from><Hsp_query-to>100</Hsp_query-to>
+    <Hsp_hit-from>1</Hsp_hit-from><Hsp_hit-to>100</Hsp_hit-to><Hsp_query-frame>1</Hsp_query-frame>
+    <Hsp_hit-frame>1</Hsp_hit-frame><Hsp_identity>98</Hsp_identity><Hsp_positive>98</Hsp_positive>
+    <Hsp_gaps>0</Hsp_gaps><Hsp_align-len>100</Hsp_align-len>
+    <Hsp_qseq>A</Hsp_qseq><Hsp_hseq>A</Hsp_hseq><Hsp_midline>|</Hsp_midline>
+  </Hsp></Hit_hsps>
+</Hit>"""
+
+ITERATION = """<Iteration>
+  <Iteration_iter-num>{num}</Iteration_iter-num>
+  <Iteration_query-ID>Query_{num}</Iteration_query-ID>
+  <Iteration_query-def>{query}</Iteration_query-def>
+  <Iteration_query-len>100</Iteration_query-len>
+  <Iteration_hits>{hit}</Iteration_hits>
+  <Iteration_stat><Statistics>
+    <Statistics_db-num>1</Statistics_db-num><Statistics_db-len>1</Statistics_db-len>
+    <Statistics_hsp-len>0</Statistics_hsp-len><Statistics_eff-space>0</Statistics_eff-space>
+    <Statistics_kappa>0.41</Statistics_kappa><Statistics_lambda>0.625</Statistics_lambda>
+    <Statistics_entropy>0.78</Statistics_entropy>
+  </Statistics></Iteration_stat>
+</Iteration>"""
+
+BLAST_XML = """<?xml version="1.0"?>
+<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">
+<BlastOutput>
+  <BlastOutput_program>blastn</BlastOutput_program>
+  <BlastOutput_version>BLASTN 2.15.0+</BlastOutput_version>
+  <BlastOutput_reference>ref</BlastOutput_reference>
+  <BlastOutput_db>nt</BlastOutput_db>
+  <BlastOutput_query-ID>Query_1</BlastOutput_query-ID>
+  <BlastOutput_query-def>q0</BlastOutput_query-def>
+  <BlastOutput_query-len>100</BlastOutput_query-len>
+  <BlastOutput_param><Parameters>
+    <Parameters_expect>1e-05</Parameters_expect><Parameters_sc-match>1</Parameters_sc-match>
+    <Parameters_sc-mismatch>-2</Parameters_sc-mismatch><Parameters_gap-open>0</Parameters_gap-open>
+    <Parameters_gap-extend>0</Parameters_gap-extend><Parameters_filter>L;m;</Parameters_filter>
+  </Parameters></BlastOutput_param>
+  <BlastOutput_iterations>{iterations}</BlastOutput_iterations>
+</BlastOutput>"""
+
+
+def blast_xml(queries):
+    """BLAST XML with one iteration per (query name, organism or None) pair"""
+    iterations = [
+        ITERATION.format(num=num, query=query,
+                         hit=HIT.format(accession=f"NZ_{num}.1", organism=organism) if organism else '')
+        for num, (query, organism) in enumerate(queries, 1)
+    ]
+    return BLAST_XML.format(iterations=''.join(iterations))
+
+
+QUERY = ">q0\n" + "ACGT" * 25
+
+
+def query_names(query):
+    return [line[1:].split()[0] for line in query.splitlines() if line.startswith('>')]
+
+
+class BlastHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.respond(*self.server.handle(dict(parse_qsl(body))))
+
+    def do_GET(self):
+        self.respond(*self.server.handle(dict(parse_qsl(urlsplit(self.path).query))))
+
+    def respond(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BlastServer(ThreadingHTTPServer):
+    """
+    The BLAST URL API on localhost. Each Put gets its own RID, which is READY
+    after ``waiting`` status checks and once ``hold_until_puts`` searches have
+    been submitted; ``failures`` Puts are answered with a 503 first.
+    """
+    daemon_threads = True
+
+    def __init__(self, xml=None, waiting=0, failures=0, hold_until_puts=0):
+        super().__init__(('127.0.0.1', 0), BlastHandler)
+        # Default: every query hits E. coli
+        self.xml = xml or (lambda names: blast_xml([(name, 'Escherichia coli') for name in names]))
+        self.waiting = waiting
+        self.failures = failures
+        self.hold_until_puts = hold_until_puts
+        self.requests = []
+        self.searches = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/Blast.cgi"
+
+    def commands(self):
+        return [(params['CMD'], params.get('FORMAT_OBJECT') or params.get('FORMAT_TYPE'))
+                for _, params in self.requests]
+
+    def times(self, command):
+        return [at for at, params in self.requests if params['CMD'] == command]
+
+    def handle(self, params):
+        with self.lock:
+            self.requests.append((time.monotonic(), params))
+            if params['CMD'] == 'Put':
+                if self.failures:
+                    self.failures -= 1
+                    return 503, "Service Unavailable"
+                rid = f"R{len(self.searches) + 1}"
+                self.searches[rid] = {'names': query_names(params['QUERY']), 'waiting': self.waiting}
+                return 200, f"<!--QBlastInfoBegin\n    RID = {rid}\n    RTOE = 20\nQBlastInfoEnd-->"
+            search = self.searches[params['RID']]
+            if params.get('FORMAT_OBJECT') == 'SearchInfo':
+                ready = not search['waiting'] and len(self.searches) >= self.hold_until_puts
+                search['waiting'] = max(0, search['waiting'] - 1)
+                return 200, f"QBlastInfoBegin\n    Status={'READY' if ready else 'WAITING'}\nQBlastInfoEnd"
+            return 200, self.xml(search['names'])
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Start a BlastServer and point BLAST_CONFIG['url_base'] at it, with short waits"""
+    servers = []
+    config = taxonomic_analysis.BLAST_CONFIG
+    monkeypatch.setitem(config, 'poll_interval', 0.01)
+    monkeypatch.setitem(config, 'retry_backoff', 0.05)
+    monkeypatch.setitem(config, 'timeout', 5)
+
+    def start(**options):
+        blast = BlastServer(**options)
+        threading.Thread(target=blast.serve_forever, args=(0.01,), daemon=True).start()
+        servers.append(blast)
+        monkeypatch.setitem(config, 'url_base', blast.url)
+        return blast
+    yield start
+    for blast in servers:
+        blast.shutdown()
+        blast.server_close()
+
+
+def test_submission_polls_the_rid_until_ready(server):
+    blast = server(waiting=2)
+    records = submit_blast_query(QUERY)
+
+    assert blast.commands() == [('Put', None)] + [('Get', 'SearchInfo')] * 3 + [('Get', 'XML')]
+    assert all(params['RID'] == 'R1' and params['tool'] == 'metaquest' for _, params in blast.requests[1:])
+    assert records[0].alignments[0].hit_def.startswith('Escherichia coli')
+
+
+def test_failed_submission_is_retried_with_backoff(server):
+    blast = server(failures=2)
+    records = submit_blast_query(QUERY)
+
+    puts = blast.times('Put')
+    assert len(puts) == 3
+    backoff = taxonomic_analysis.BLAST_CONFIG['retry_backoff']
+    assert puts[1] - puts[0] >= backoff and puts[2] - puts[1] >= backoff * 2
+    assert len(records) == 1
+
+
+def test_search_waiting_past_the_limit_is_resubmitted_then_fails(server, monkeypatch):
+    monkeypatch.setitem(taxonomic_analysis.BLAST_CONFIG, 'max_search_wait', 0.05)
+    monkeypatch.setitem(taxonomic_analysis.BLAST_CONFIG, 'max_retries', 1)
+    blast = server(waiting=10 ** 6)
+    with pytest.raises(TimeoutError):
+        submit_blast_query(QUERY)
+
+    assert len(blast.times('Put')) == 2
+    assert blast.commands().count(('Get', 'XML')) == 0
+
+
+def test_batch_is_one_request_demultiplexed_by_query_position(server):
+    # The response covers q0 and q2 but not q1
+    blast = server(xml=lambda names: blast_xml([('q0', 'Escherichia coli'), ('q2', 'Salmonella enterica')]))
+    batch = [('contig_a', 'A' * 100), ('contig_b', 'C' * 100), ('contig_c', 'G' * 100)]
+    results = blast_batch_online(batch)
+
+    puts = [params for _, params in blast.requests if params['CMD'] == 'Put']
+    assert len(puts) == 1
+    assert puts[0]['QUERY'] == f">q0\n{'A' * 100}\n>q1\n{'C' * 100}\n>q2\n{'G' * 100}\n"
+    assert [r['query_id'] for r in results] == ['contig_a', 'contig_b', 'contig_c']
+    assert results[0]['hits'][0]['organism'] == 'Escherichia coli'
+    assert results[1]['hits'] == [] and 'missing' in results[1]['error']
+    assert results[2]['hits'][0]['organism'] == 'Salmonella enterica'
+
+
+def test_searches_are_in_flight_together_while_requests_are_spaced_out(server, monkeypatch, tmp_path):
+    monkeypatch.setitem(taxonomic_analysis.BLAST_CONFIG, 'rate_limit_delay', 0.05)
+    monkeypatch.setattr(RemoteBlastBackend, 'max_sequences', 1)
+    monkeypatch.setattr(RemoteBlastBackend, 'max_in_flight', 4)
+    # No search is READY until all four are submitted: they can only finish if they wait at NCBI together
+    blast = server(hold_until_puts=4)
+    fasta = tmp_path / "contigs.fasta"
+    fasta.write_text(''.join(f">contig{i}\n{base * 100}\n" for i, base in enumerate('ACGT')))
+
+    results_file = run_fasta_blast_taxonomy(fasta, tmp_path, backend='remote', max_sequences=4)
+
+    results = json.loads(results_file.read_text())
+    assert [r['query_id'] for r in results] == ['contig0', 'contig1', 'contig2', 'contig3']
+    assert all(r['hits'][0]['organism'] == 'Escherichia coli' for r in results)
+    assert len(blast.times('Put')) == 4 and blast.commands().count(('Get', 'XML')) == 4
+    # Every request, Put or poll, waited for its token
+    times = [at for at, _ in blast.requests]
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.04
+
+
+def test_batches_respect_sequence_and_base_limits():
+    queries = [(i, f"seq{i}", 'A' * length) for i, length in enumerate([40, 40, 40, 90, 10, 10])]
+    batches = list(make_blast_batches(iter(queries), max_sequences=2, max_bases=100))
+    assert [[q[0] for q in batch] for batch in batches] == [[0, 1], [2], [3, 4], [5]]
+
+
+def test_token_bucket_spaces_out_requests():
+    bucket = TokenBucket(0.05)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # The first token is available at once, the other four are 50 ms apart
+    assert time.monotonic() - start >= 0.19
@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+import pytest
+from metagenomics import blast_cache
+from metagenomics.blast_cache import BlastCache, open_blast_cache
+from metagenomics.config import CACHE_CONFIG
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the time the cache sees; set ``clock.now`` to move it"""
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(blast_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def value(size):
+    # json.dumps adds the two quotes
+    return 'x' * (size - 2)
+
+
+def test_entries_round_trip_and_persist(tmp_path):
+    cache = BlastCache(tmp_path, expiry_days=30)
+    cache['seq1'] = {'taxid': 562, 'hits': [['Escherichia coli', 99.5]]}
+    assert 'seq1' in cache and 'seq2' not in cache
+    assert cache.get('seq2', 'missing') == 'missing'
+    with pytest.raises(KeyError):
+        cache['seq2']
+    cache.close()
+
+    reopened = BlastCache(tmp_path, expiry_days=30)
+    assert reopened['seq1'] == {'taxid': 562, 'hits': [['Escherichia coli', 99.5]]} and len(reopened) == 1
+    reopened.close()
+
+
+def test_expired_entries_read_as_missing_and_are_dropped(tmp_path, clock):
+    cache = BlastCache(tmp_path, expiry_days=2)
+    cache['old'] = 'result'
+    cache.put('older', 'result', created=clock.now - 5 * DAY)
+    assert len(cache) == 2
+
+    clock.now += 1 * DAY
+    assert cache['old'] == 'result'
+    assert 'older' not in cache and len(cache) == 1
+
+    # Reading an entry does not extend its life
+    clock.now += 1.5 * DAY
+    assert cache.get('old') is None and len(cache) == 0
+
+
+def test_cleanup_drops_expired_then_evicts_least_recently_used(tmp_path, clock, capsys):
+    cache = BlastCache(tmp_path, expiry_days=10, size_limit_mb=300 / (1024 * 1024))
+    cache.put('expired', value(100), created=clock.now - 11 * DAY)
+    for key in ('a', 'b', 'c', 'd'):
+        clock.now += 1
+        cache[key] = value(100)
+    # Reading 'a' makes 'b' the least recently used
+    clock.now += 1
+    assert cache['a'] == value(100)
+
+    assert cache.cleanup() == 2
+    assert 'expired' not in cache and 'b' not in cache
+    assert all(key in cache for key in ('a', 'c', 'd'))
+    assert "1 expired, 1 evicted" in capsys.readouterr().out
+    assert cache.cleanup() == 0
+
+
+def test_legacy_json_cache_is_imported_once_with_its_timestamps(tmp_path, clock, monkeypatch):
+    monkeypatch.setitem(CACHE_CONFIG, 'enable_blast_cache', True)
+    monkeypatch.setitem(CACHE_CONFIG, 'cleanup_on_startup', True)
+    legacy = tmp_path / "blast_cache.json"
+    legacy.write_text(json.dumps({
+        'fresh': {'timestamp': clock.now - DAY, 'organism': 'Escherichia coli'},
+        'stale': {'timestamp': clock.now - 400 * DAY, 'organism': 'Bacillus subtilis'},
+        'plain': ['no', 'timestamp'],
+    }))
+
+    cache = open_blast_cache(tmp_path)
+    assert not legacy.exists() and (tmp_path / "blast_cache.json.imported").exists()
+    assert cache['fresh']['organism'] == 'Escherichia coli' and cache['plain'] == ['no', 'timestamp']
+    # The legacy timestamp is kept, so the old entry expired in the startup cleanup
+    assert 'stale' not in cache and len(cache) == 2
+    cache.close()
+
+
+def test_unreadable_legacy_cache_is_left_in_place(tmp_path, capsys):
+    legacy = tmp_path / "blast_cache.json"
+    legacy.write_text("{not json")
+    cache = BlastCache(tmp_path)
+    assert cache.import_json(legacy) == 0
+    assert legacy.exists() and "Could not import legacy cache" in capsys.readouterr().out
+    cache.close()
+
+
+def test_disabled_cache_is_a_plain_dict(tmp_path, monkeypatch):
+    monkeypatch.setitem(CACHE_CONFIG, 'enable_blast_cache', False)
+    assert open_blast_cache(tmp_path) == {}
+    assert not (tmp_path / "blast_cache.sqlite").exists()
@@ -0,0 +1,88 @@
+import os
+import threading
+import pytest
+from metagenomics import diamond_index
+from metagenomics.diamond_index import ensure_diamond_index, ensure_combined_screening_index
+
+# Stands in for `diamond makedb`: logs the call and "indexes" by copying the FASTA
+FAKE_DIAMOND = """#!/bin/sh
+echo "$@" >> "$DIAMOND_LOG"
+while [ $# -gt 0 ]; do
+  case $1 in
+    --in) source=$2; shift;;
+    --db) db=$2; shift;;
+  esac
+  shift
+done
+sleep 0.2
+cp "$source" "$db.dmnd"
+"""
+
+
+@pytest.fixture
+def makedb_calls(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "diamond").write_text(FAKE_DIAMOND)
+    (bin_dir / "diamond").chmod(0o755)
+    log = tmp_path / "makedb.log"
+    log.touch()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('DIAMOND_LOG', str(log))
+    monkeypatch.setattr(diamond_index, 'DIAMOND_INDEX_DIR', tmp_path / "diamond_indexes")
+    return lambda: len(log.read_text().splitlines())
+
+
+def test_unchanged_source_skips_makedb_and_a_changed_checksum_rebuilds(tmp_path, makedb_calls):
+    card = tmp_path / "card.faa"
+    card.write_text(">aph(3')\nMKLV\n")
+    db = ensure_diamond_index(card, "card")
+    assert db == tmp_path / "diamond_indexes" / "card"
+    assert makedb_calls() == 1
+
+    # Same content under a new mtime: the checksum matches, so only the stamp is refreshed
+    assert ensure_diamond_index(card, "card") == db
+    os.utime(card, ns=(0, 10 ** 9))
+    assert ensure_diamond_index(card, "card") == db
+    assert makedb_calls() == 1
+
+    card.write_text(">aph(3')\nMKLVA\n")
+    ensure_diamond_index(card, "card")
+    assert makedb_calls() == 2
+    assert db.with_suffix('.dmnd').read_text() == ">aph(3')\nMKLVA\n"
+    # Only the index, its stamp and the lock file are left behind
+    assert sorted(p.name for p in db.parent.iterdir()) == ['.card.lock', 'card.dmnd', 'card.json']
+
+
+def test_concurrent_requests_build_the_index_once(tmp_path, makedb_calls):
+    vfdb = tmp_path / "vfdb.faa"
+    vfdb.write_text(">VFG000001\nMSTV\n")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ensure_diamond_index(vfdb, "vfdb")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert makedb_calls() == 1
+    assert len(set(results)) == 1 and results[0].with_suffix('.dmnd').exists()
+
+
+def test_combined_index_tags_subjects_and_follows_its_sources(tmp_path, makedb_calls):
+    card = tmp_path / "card.faa"
+    card.write_text(">aph(3') kanamycin\nMKLV\n")
+    vfdb = tmp_path / "vfdb.faa"
+    vfdb.write_text(">VFG000001\nMSTV\n")
+    sources = {'vf': vfdb, 'amr': card, 'pathogen': tmp_path / "missing.faa"}
+
+    db = ensure_combined_screening_index(sources)
+    assert db.name == "screening_amr_vf"
+    assert (db.parent / "screening_amr_vf.faa").read_text() == ">amr|aph(3') kanamycin\nMKLV\n>vf|VFG000001\nMSTV\n"
+    ensure_combined_screening_index(sources)
+    assert makedb_calls() == 1
+
+    vfdb.write_text(">VFG000002\nMSTV\n")
+    ensure_combined_screening_index(sources)
+    assert makedb_calls() == 2
+    assert ">vf|VFG000002" in db.with_suffix('.dmnd').read_text()
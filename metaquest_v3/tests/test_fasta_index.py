@@ -0,0 +1,92 @@
+import os
+import pytest
+from metagenomics.fasta_index import IndexedFasta, build_fasta_index, read_fasta_index
+
+# Line width 4 with a short last line, an empty record and a single-line record
+FASTA = b">seq1 desc\nACGT\nTTGA\nCC\n>seq2\nGGGG\nA\n>empty\n>seq3\nACGTACGT\n"
+
+# What `samtools faidx` writes for FASTA: NAME LENGTH OFFSET LINEBASES LINEWIDTH
+FAI = ("seq1\t10\t11\t4\t5\n"
+       "seq2\t5\t30\t4\t5\n"
+       "empty\t0\t44\t0\t0\n"
+       "seq3\t8\t50\t8\t9\n")
+
+
+@pytest.fixture
+def fasta(tmp_path):
+    path = tmp_path / "contigs.fasta"
+    path.write_bytes(FASTA)
+    return path
+
+
+def test_index_matches_samtools_faidx(fasta):
+    fai = build_fasta_index(fasta)
+    assert fai == fasta.parent / "contigs.fasta.fai"
+    assert fai.read_text() == FAI
+    assert read_fasta_index(fai)['seq1'] == (10, 11, 4, 5)
+
+
+def test_crlf_line_width_counts_both_line_end_bytes(tmp_path):
+    path = tmp_path / "contigs.fasta"
+    path.write_bytes(FASTA.replace(b"\n", b"\r\n"))
+    index = read_fasta_index(build_fasta_index(path))
+    assert index['seq1'] == (10, 12, 4, 6)
+    assert index['seq3'] == (8, 59, 8, 10)
+
+    with IndexedFasta(path) as indexed:
+        assert indexed.fetch('seq1') == "ACGTTTGACC"
+        assert indexed.fetch('seq1', 3, 9) == "TTTGAC"
+
+
+@pytest.mark.parametrize("records", [
+    b">bad\nACGT\nAC\nACGT\n",    # short line inside the record
+    b">bad\nACGT\nACGTA\n",       # last line longer than the others
+    b">bad\nACGT\n\nACGT\n",      # blank line inside the record
+    b">dup\nA\n>dup\nC\n",        # repeated name
+])
+def test_records_that_samtools_rejects_are_rejected(tmp_path, records):
+    path = tmp_path / "bad.fasta"
+    path.write_bytes(records)
+    with pytest.raises(ValueError):
+        build_fasta_index(path)
+
+
+def test_fetch_slices_across_line_breaks(fasta):
+    with IndexedFasta(fasta) as indexed:
+        assert sorted(indexed) == ['empty', 'seq1', 'seq2', 'seq3']
+        assert indexed.length('seq2') == 5
+        assert indexed.fetch('seq1') == "ACGTTTGACC"
+        assert indexed.fetch('seq1', 2, 4) == "GT"
+        assert indexed.fetch('seq1', 2, 9) == "GTTTGAC"
+        assert indexed.fetch('seq2', 4) == "A"
+        assert indexed.fetch('empty') == ""
+        # A region within one line is a view into the mapped file
+        view = indexed.raw('seq3', 1, 5)
+        assert bytes(view) == b"CGTA"
+        view.release()
+
+
+def test_regions_are_one_based_inclusive_and_clipped_like_samtools(fasta):
+    with IndexedFasta(fasta) as indexed:
+        assert indexed.fetch_region('seq1') == "ACGTTTGACC"
+        assert indexed.fetch_region('seq1:5') == "TTGACC"
+        assert indexed.fetch_region('seq1:5-8') == "TTGA"
+        assert indexed.fetch_region('seq1:1,000-2,000') == ""
+        assert indexed.fetch_region('seq1:8-100') == "ACC"
+        assert indexed.fetch_region('seq1:0-2') == "AC"
+        assert indexed.fetch_region('seq1:6-5') == ""
+        with pytest.raises(KeyError):
+            indexed.fetch_region('chr1:1-10')
+
+
+def test_stale_index_is_rebuilt(fasta):
+    with IndexedFasta(fasta) as indexed:
+        assert indexed.fetch('seq2') == "GGGGA"
+
+    fasta.write_bytes(b">seq2\nTT\n")
+    fai = fasta.parent / "contigs.fasta.fai"
+    stat = fasta.stat()
+    # Make the FASTA newer than its index
+    os.utime(fai, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 ** 9))
+    with IndexedFasta(fasta) as indexed:
+        assert list(indexed) == ['seq2'] and indexed.fetch('seq2') == "TT"
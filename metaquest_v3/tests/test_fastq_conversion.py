@@ -0,0 +1,60 @@
+import gzip
+import pytest
+from metagenomics import utils
+from metagenomics.utils import ReadIdFilter, iter_fastq, convert_fastq_to_fasta
+
+# Wrapped sequence and quality, a quality line starting with '@' and one starting with '+'
+MULTILINE = (b"@r1 sample=A\nACGT\nAC\n+\n@@II\n+I\n"
+             b"@r2\nGG\n+r2\nII\n"
+             b"@r1 mate\nTTTT\n+\nIIII\n")
+
+
+def test_filter_catches_every_duplicate_including_repeats_within_a_batch():
+    seen = ReadIdFilter(1000, 1024 * 1024)
+    assert seen.add_many([b'r1', b'r2', b'r1']).tolist() == [False, False, True]
+    assert seen.add(b'r2') and not seen.add(b'r3')
+    assert seen.add_many([]).tolist() == []
+
+
+def test_filter_is_sized_for_the_target_rate_and_reports_a_capped_one():
+    reads = [f"read{i}".encode() for i in range(100_000)]
+    unseen = [f"other{i}".encode() for i in range(20_000)]
+
+    seen = ReadIdFilter(len(reads), 256 * 1024 * 1024, fp_rate=0.001)
+    assert seen.fp_rate <= 0.001 and seen.hashes == 10
+    seen.add_many(reads)
+    assert seen.add_many(unseen).mean() < 0.003
+
+    # 64 KB is ~5 bits per ID: fewer hashes, and a rate well above the target that matches what it does
+    capped = ReadIdFilter(len(reads), 64 * 1024, fp_rate=0.001)
+    assert len(capped.bits) == 64 * 1024 and capped.hashes < 10
+    assert capped.fp_rate > 0.05
+    capped.add_many(reads)
+    assert capped.add_many(unseen).mean() == pytest.approx(capped.fp_rate, rel=0.25)
+
+
+def test_multi_line_and_crlf_records_parse_across_block_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setitem(utils.FASTQ_CONFIG, 'buffer_size', 5)
+    reads = tmp_path / "reads.fastq"
+    reads.write_bytes(MULTILINE.replace(b"\n", b"\r\n"))
+    assert list(iter_fastq(reads)) == [(b'r1 sample=A', b'ACGTAC'), (b'r2', b'GG'), (b'r1 mate', b'TTTT')]
+
+
+@pytest.mark.parametrize("record", [b"r1\nACGT\n+\nIIII\n", b"@r1\nACGT\n+\nIII\n", b"@r1\nACGT\n+\nII"])
+def test_malformed_or_truncated_records_are_rejected(tmp_path, record):
+    reads = tmp_path / "reads.fastq"
+    reads.write_bytes(record)
+    with pytest.raises(ValueError):
+        list(iter_fastq(reads))
+
+
+def test_conversion_renames_repeated_ids_across_files(tmp_path):
+    r1 = tmp_path / "reads_R1.fastq.gz"
+    with gzip.open(r1, 'wb') as f:
+        f.write(MULTILINE)
+    r2 = tmp_path / "reads_R2.fastq"
+    r2.write_bytes(b"@r2\nCC\n+\nII\n@r1_0\nA\n+\nI\n")
+
+    fasta = convert_fastq_to_fasta([str(r1), str(r2)], tmp_path)
+    assert fasta.read_bytes() == (b">r1\nACGTAC\n>r2\nGG\n>r1_0\nTTTT\n"
+                                  b">r2_1\nCC\n>r1_0_2\nA\n")
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from metagenomics import hit_tables
+from metagenomics.hit_tables import (FilteredHits, Histogram, TopHits, load_hits, parquet_path,
+                                     write_hit_parquet)
+
+HITS = ("contig1\tARO_1\t99.5\t300\t1e-100\t612.3\tbeta-lactamase TEM-1\n"
+        "contig2\tARO_2\t65.0\t120\t2.5e-08\t80.1\tefflux pump \"mexB\"\n"
+        "contig3\tARO_3\t88.0\t210\t0\t400.0\taminoglycoside acetyltransferase\n")
+
+
+@pytest.fixture
+def hits_file(tmp_path):
+    path = tmp_path / "amr_hits.txt"
+    path.write_text(HITS)
+    return path
+
+
+def older(path, than):
+    """Backdate ``path`` so it is older than ``than``"""
+    mtime = than.stat().st_mtime_ns - 10 ** 9
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_parquet_copy_is_typed_and_reads_back_like_the_tsv(hits_file):
+    columnar = write_hit_parquet(hits_file)
+    assert columnar == hits_file.with_suffix('.parquet') == parquet_path(hits_file)
+
+    schema = pq.read_schema(columnar)
+    assert [str(field.type) for field in schema] == ['string', 'string', 'double', 'int32',
+                                                     'double', 'double', 'string']
+
+    from_parquet = load_hits(hits_file)
+    assert from_parquet['stitle'].tolist()[1] == 'efflux pump "mexB"'
+    older(columnar, hits_file)
+    pd.testing.assert_frame_equal(from_parquet, load_hits(hits_file))
+
+
+def test_only_the_requested_columns_are_read(hits_file):
+    write_hit_parquet(hits_file)
+    hits = load_hits(hits_file, usecols=['bitscore', 'qseqid'])
+    assert list(hits.columns) == ['bitscore', 'qseqid']
+    assert hits['bitscore'].tolist() == [612.3, 80.1, 400.0]
+
+
+def test_tsv_newer_than_its_parquet_copy_is_read_instead(hits_file):
+    columnar = write_hit_parquet(hits_file)
+    hits_file.write_text(HITS.splitlines(keepends=True)[0])
+    older(columnar, hits_file)
+    assert load_hits(hits_file)['sseqid'].tolist() == ['ARO_1']
+
+
+def test_without_pyarrow_the_tsv_is_used(hits_file, monkeypatch):
+    monkeypatch.setattr(hit_tables, 'pa', None)
+    assert write_hit_parquet(hits_file) is None
+    assert not parquet_path(hits_file).exists()
+    assert load_hits(hits_file)['evalue'].tolist() == [1e-100, 2.5e-08, 0.0]
+
+
+@pytest.mark.parametrize("content", ["", "# No AMR hits found\n"])
+def test_empty_tables_and_placeholders_have_typed_columns_and_no_rows(tmp_path, content):
+    path = tmp_path / "vf_hits.txt"
+    path.write_text(content)
+    assert len(pd.read_parquet(write_hit_parquet(path))) == 0
+
+    parquet_path(path).unlink()
+    hits = load_hits(path, usecols=['sseqid', 'pident'])
+    assert len(hits) == 0 and list(hits.columns) == ['sseqid', 'pident']
+    assert hits['pident'].dtype == 'float64'
+
+
+def test_unreadable_table_leaves_no_parquet_copy(tmp_path, capsys):
+    path = tmp_path / "amr_hits.txt"
+    path.write_text("contig1\tARO_1\tnot-a-number\t300\t1e-100\t612.3\ttitle\n")
+    assert write_hit_parquet(path) is None
+    assert list(tmp_path.iterdir()) == [path]
+    assert "Could not write Parquet copy" in capsys.readouterr().out
+
+
+def many_hits(path, count):
+    """Hit i has pident 50 + i % 50, e-value 1e-(i % 30) and bitscore i % 7"""
+    path.write_text(''.join(f"contig{i}\tsubject{i}\t{50 + i % 50}\t100\t1e-{i % 30}\t{i % 7}\ttitle {i}\n"
+                            for i in range(count)))
+    return path
+
+
+def expected_rows(count, min_pident, max_evalue):
+    return [f"subject{i}" for i in range(count) if 50 + i % 50 >= min_pident and 10.0 ** -(i % 30) <= max_evalue]
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_filtered_hits_stream_in_chunks_from_either_format(tmp_path, columnar):
+    path = many_hits(tmp_path / "vf_hits.txt", 1000)
+    if columnar:
+        write_hit_parquet(path)
+    hits = FilteredHits(path, usecols=['sseqid', 'bitscore'], min_pident=70, max_evalue=1e-10, chunk_rows=128)
+
+    chunks = list(hits)
+    assert all(len(chunk) <= 128 for chunk in chunks) and len(chunks) > 1
+    # The filter columns are read but only the requested ones are returned
+    assert all(list(chunk.columns) == ['sseqid', 'bitscore'] for chunk in chunks)
+    kept = pd.concat(chunks)['sseqid'].tolist()
+    assert kept == expected_rows(1000, 70, 1e-10)
+    assert hits.rows_read == 1000 and hits.rows_kept == len(kept)
+
+
+def test_filtered_hits_of_a_placeholder_yield_nothing(tmp_path):
+    path = tmp_path / "amr_hits.txt"
+    path.write_text("# No AMR hits found\n")
+    hits = FilteredHits(path, min_pident=0, max_evalue=float('inf'))
+    assert list(hits) == [] and hits.rows_read == 0
+
+
+def test_top_hits_over_chunks_match_nlargest_over_the_whole_table(tmp_path):
+    path = many_hits(tmp_path / "amr_hits.txt", 500)
+    whole = load_hits(path)
+    top = TopHits(10)
+    for chunk in FilteredHits(path, min_pident=0, max_evalue=float('inf'), chunk_rows=37):
+        top.update(chunk)
+
+    # Bitscores repeat every 7 rows, so the ties are broken by row order
+    expected = whole.nlargest(10, 'bitscore')
+    assert top.result()['sseqid'].tolist() == expected['sseqid'].tolist()
+    assert top.result(3)['sseqid'].tolist() == ['subject6', 'subject13', 'subject20']
+    assert TopHits(5).result().empty
+
+
+def test_histogram_accumulated_over_chunks_matches_one_pass():
+    values = np.random.default_rng(0).uniform(70, 100, 1000)
+    histogram = Histogram(70, 100, 20)
+    for chunk in np.array_split(values, 7):
+        histogram.update(chunk)
+    assert histogram.counts.tolist() == np.histogram(values, bins=np.linspace(70, 100, 21))[0].tolist()
+    assert histogram.centers[0] == 70.75
@@ -0,0 +1,72 @@
+import gzip
+import threading
+import time
+import pytest
+from metagenomics import utils
+from metagenomics.utils import interleaved_pipes
+
+
+def records(count):
+    return b''.join(b"@pair%d/%d\nACGT\n+\nIIII\n" % (i // 2, i % 2 + 1) for i in range(count))
+
+
+@pytest.fixture
+def interleaved(tmp_path):
+    path = tmp_path / "reads.fastq.gz"
+    with gzip.open(path, 'wb') as f:
+        f.write(records(6))
+    return path
+
+
+def test_pipes_carry_alternate_records_and_can_be_read_in_any_order(interleaved):
+    with interleaved_pipes(interleaved) as (r1, r2):
+        with open(r2, 'rb') as f:
+            mates2 = f.read()
+        with open(r1, 'rb') as f:
+            mates1 = f.read()
+
+    assert mates1.count(b'@') == mates2.count(b'@') == 3
+    assert b"/2" not in mates1 and b"/1" not in mates2
+
+
+def test_consumer_that_never_opens_the_pipes_does_not_hang(interleaved, monkeypatch):
+    # The writers are still opening the FASTQ when the consumer gives up
+    open_fastq = utils.open_fastq
+
+    def slow_open_fastq(path):
+        time.sleep(0.3)
+        return open_fastq(path)
+    monkeypatch.setattr(utils, 'open_fastq', slow_open_fastq)
+
+    def consumer():
+        with interleaved_pipes(interleaved):
+            pass
+    thread = threading.Thread(target=consumer, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_consumer_that_stops_reading_early_does_not_hang(tmp_path):
+    # Much more than a pipe buffer per mate
+    path = tmp_path / "reads.fastq"
+    path.write_bytes(records(40000))
+
+    def consumer():
+        with interleaved_pipes(path) as (r1, r2):
+            with open(r1, 'rb') as f:
+                f.read(100)
+    thread = threading.Thread(target=consumer, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_malformed_records_are_reported_after_the_pipes_close(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_bytes(records(2) + b"@pair1/1\nACGT\nIIII\n")
+    with pytest.raises(ValueError, match="Malformed"):
+        with interleaved_pipes(path) as (r1, r2):
+            for fifo in (r1, r2):
+                with open(fifo, 'rb') as f:
+                    f.read()
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+from metagenomics.keyword_classifier import KeywordClassifier
+from metagenomics.pathogen_analysis import ANTIBIOTIC_FAMILIES, VF_KEYWORDS
+
+TITLES = [
+    "Beta-lactamase TEM-1 [Escherichia coli]",
+    "aminoglycoside resistance protein conferring beta-lactam tolerance",
+    "Type III secretion system needle protein",
+    "T3SS effector",
+    "fimbrial adhesin with toxin domain",
+    "Capsule biosynthesis protein",
+    "flagellin FliC",
+    "hypothetical protein",
+    "",
+]
+
+
+def first_match(categories, text, default='other'):
+    """The loop the classifier replaces"""
+    lowered = str(text).lower()
+    for category, keywords in categories.items():
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return default
+
+
+@pytest.mark.parametrize("categories", [ANTIBIOTIC_FAMILIES, VF_KEYWORDS])
+def test_classify_equals_the_first_match_loop(categories):
+    labels = KeywordClassifier(categories).classify(TITLES)
+    assert labels.tolist() == [first_match(categories, title) for title in TITLES]
+
+
+def test_earlier_categories_win_and_capitalised_keywords_never_match():
+    labels = KeywordClassifier(VF_KEYWORDS).classify(TITLES).tolist()
+    # 'adhesin' and 'toxin' both match; adhesion is listed first
+    assert labels[4] == 'adhesion'
+    # 'type III' and 'T3SS' hold capitals, so only 'secretion' can match
+    assert labels[2] == 'secretion_system' and labels[3] == 'other'
+
+
+def test_keywords_are_literal_text_not_regexes():
+    classifier = KeywordClassifier({'dotted': ['a.c'], 'grouped': ['(x|y)']}, default='none')
+    assert classifier.classify(["abc", "a.c", "x", "(x|y) operon"]).tolist() == ['none', 'dotted', 'none', 'grouped']
+
+
+def test_index_is_kept_and_empty_input_is_handled():
+    texts = pd.Series(["penicillin-binding protein", None], index=[7, 3])
+    labels = KeywordClassifier(ANTIBIOTIC_FAMILIES).classify(texts)
+    assert labels.to_dict() == {7: 'beta-lactam', 3: 'other'}
+    assert KeywordClassifier(ANTIBIOTIC_FAMILIES).classify([]).empty
+
+
+def test_group_keeps_first_seen_category_order_and_row_order():
+    hits = pd.DataFrame({'sseqid': ['g1', 'g2', 'g3', 'g4'],
+                         'pident': [99.0, 80.0, 75.0, 90.0],
+                         'stitle': ['tetracycline efflux', 'TEM beta-lactamase', 'unknown', 'doxycycline pump']})
+    groups = KeywordClassifier(ANTIBIOTIC_FAMILIES).group(hits, 'stitle', {'gene': 'sseqid', 'identity': 'pident'})
+
+    assert list(groups) == ['tetracycline', 'beta-lactam', 'other']
+    assert groups['tetracycline'] == [{'gene': 'g1', 'identity': 99.0}, {'gene': 'g4', 'identity': 90.0}]
+    assert KeywordClassifier(ANTIBIOTIC_FAMILIES).group(hits.iloc[:0], 'stitle', {'gene': 'sseqid'}) == {}
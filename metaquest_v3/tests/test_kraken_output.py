@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from metagenomics.kraken_output import (ReportTree, iter_kraken_output, classify_reads, parse_kraken_report,
+                                        read_confidence, rescore_kraken_output, load_read_taxids)
+
+REPORT = """\
+ 10.00\t1\t1\tU\t0\tunclassified
+ 90.00\t9\t0\tR\t1\troot
+ 90.00\t9\t0\tD\t2\t  Bacteria
+ 90.00\t9\t1\tO\t91347\t    Enterobacterales
+ 60.00\t6\t2\tG\t561\t      Escherichia
+ 40.00\t4\t4\tS\t562\t        Escherichia coli
+ 20.00\t2\t2\tG\t590\t      Salmonella
+"""
+
+# Kraken2 --output lines: status, read ID, call, length(s), taxid:k-mer pairs
+OUTPUT = """\
+C\tr1\t562\t150\t562:8 561:2
+C\tr2\t91347\t150\t562:3 590:3 0:4
+C\tr3\t590\t150\tA:5 590:5
+U\tr4\t0\t150\t0:10
+C\tr5\t562\t100|100\t562:4 |:| 562:4
+"""
+
+
+@pytest.fixture
+def kraken_files(tmp_path):
+    report = tmp_path / "kraken_report.txt"
+    report.write_text(REPORT)
+    classified = tmp_path / "kraken_classified.txt"
+    classified.write_text(OUTPUT)
+    return classified, report
+
+
+def test_report_tree_is_recovered_from_name_indentation(kraken_files):
+    report = parse_kraken_report(kraken_files[1])
+    assert report.set_index('taxid')['parent'].to_dict() == {0: 0, 1: 0, 2: 1, 91347: 2, 561: 91347,
+                                                             562: 561, 590: 91347}
+    tree = ReportTree(report)
+    assert tree.taxids[tree.parent[tree.index([562])[0]]] == 561
+    assert list(tree.index([590, 7, 1])) == [5, -1, 0]
+
+
+def test_output_parsing_sums_mates_and_keeps_the_call(kraken_files):
+    chunk = next(iter_kraken_output(kraken_files[0]))
+    assert list(chunk['taxid']) == [562, 91347, 590, 0, 562]
+    assert list(chunk['length']) == [150, 150, 150, 150, 200]
+
+
+def test_confidence_is_the_share_of_unambiguous_kmers_in_the_called_clade(kraken_files):
+    classified, report = kraken_files
+    chunk = next(iter_kraken_output(classified))
+    confidence = read_confidence(ReportTree.from_report(report), chunk)
+    # r1: 562 holds 8 of 10 k-mers; r2: 6 of 10 (taxid 0 k-mers count); r3: ambiguous k-mers excluded
+    assert np.allclose(confidence, [0.8, 0.6, 1.0, 0.0, 1.0])
+
+
+def test_reads_are_reclassified_like_kraken2_at_each_threshold(kraken_files):
+    classified, report = kraken_files
+    tree = ReportTree.from_report(report)
+    calls = classify_reads(tree, next(iter_kraken_output(classified)), [0.0, 0.5, 0.9])
+    taxids = np.where(calls >= 0, tree.taxids[np.maximum(calls, 0)], 0)
+
+    assert taxids.tolist() == [
+        [562, 91347, 590, 0, 562],   # r2 ties 562 and 590: the LCA is called
+        [562, 91347, 590, 0, 562],
+        [561, 0, 590, 0, 562],       # r1 climbs to Escherichia to reach 9 k-mers; r2 never does
+    ]
+
+
+def test_sweep_writes_a_report_and_read_taxids_per_threshold(kraken_files, tmp_path):
+    classified, report = kraken_files
+    reports = rescore_kraken_output(classified, report, tmp_path, [0.5, 0.9])
+
+    assert reports == [tmp_path / "confidence_0.5" / "kraken_report.txt",
+                       tmp_path / "confidence_0.9" / "kraken_report.txt"]
+    strict = parse_kraken_report(reports[1]).set_index('taxid')
+    assert strict.loc[0, 'clade_reads'] == 2
+    assert strict.loc[1, 'clade_reads'] == 3
+    assert strict.loc[561, ['clade_reads', 'taxon_reads']].tolist() == [2, 1]
+    assert strict.loc[91347, 'name'] == 'Enterobacterales' and strict.loc[91347, 'depth'] == 2
+    assert load_read_taxids(tmp_path / "confidence_0.9" / "kraken_read_taxids.u32").tolist() == [561, 0, 590, 0, 562]
+
+    sweep = pd.read_csv(tmp_path / "kraken_confidence_sweep.tsv", sep='\t')
+    assert sweep['classified_reads'].tolist() == [4, 3]
+    assert sweep['taxa'].tolist() == [3, 3]
+
+
+def test_sweep_rejects_duplicate_or_out_of_range_thresholds(kraken_files, tmp_path):
+    classified, report = kraken_files
+    with pytest.raises(ValueError):
+        rescore_kraken_output(classified, report, tmp_path, [0.1, 0.1])
+    with pytest.raises(ValueError):
+        rescore_kraken_output(classified, report, tmp_path, [1.5])
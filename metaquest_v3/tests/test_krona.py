@@ -0,0 +1,68 @@
+import os
+import pytest
+from metagenomics import krona
+from metagenomics.krona import find_kronatools, write_krona_chart
+
+REPORT = """\
+ 20.00\t2\t2\tU\t0\tunclassified
+ 80.00\t8\t0\tR\t1\troot
+ 80.00\t8\t0\tD\t2\t  Bacteria
+ 50.00\t5\t5\tS\t562\t    Escherichia coli
+ 30.00\t3\t3\tS\t28901\t    Salmonella enterica
+"""
+
+
+@pytest.fixture
+def kronatools(tmp_path):
+    """A KronaTools install laid out like the bioconda package"""
+    root = tmp_path / "opt" / "krona"
+    (root / "src").mkdir(parents=True)
+    (root / "img").mkdir()
+    (root / "scripts").mkdir()
+    (root / "src" / "krona-2.0.js").write_text("function load() { document.write('</script>'); }")
+    for name in ('favicon.ico', 'hidden.png', 'loading.gif'):
+        (root / "img" / name).write_bytes(b"GIF89a")
+    (root / "scripts" / "ImportText.pl").write_text("#!/usr/bin/env perl\n")
+    (root / "scripts" / "ImportText.pl").chmod(0o755)
+    (tmp_path / "bin").mkdir()
+    os.symlink(root / "scripts" / "ImportText.pl", tmp_path / "bin" / "ktImportText")
+    return root
+
+
+@pytest.fixture
+def report(tmp_path):
+    report = tmp_path / "kraken_report.txt"
+    report.write_text(REPORT)
+    return report
+
+
+def test_installed_kronatools_is_found_through_ktimporttext(kronatools, tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path / "bin"))
+    monkeypatch.delenv('CONDA_PREFIX', raising=False)
+    assert find_kronatools() == kronatools.resolve()
+
+
+def test_chart_embeds_local_krona_resources_and_opens_offline(kronatools, report, tmp_path, monkeypatch):
+    monkeypatch.setitem(krona.KRONA_CONFIG, 'resources', str(kronatools))
+    html = write_krona_chart(report, tmp_path / "taxonomy_krona.html").read_text()
+
+    assert "function load()" in html and "<\\/script>" in html
+    assert 'src="data:image/png;base64,' in html and 'href="data:image/x-icon;base64,' in html
+    assert "marbl.github.io" not in html and "<script src=" not in html
+    assert '<node name="Escherichia coli"><magnitude><val>5</val>' in html
+    assert '<node name="Unclassified"><magnitude><val>2</val>' in html
+    assert (tmp_path / "taxonomy_krona.xml").read_text().startswith('  <krona')
+
+
+def test_chart_links_resources_when_not_embedding_or_none_are_installed(kronatools, report, tmp_path,
+                                                                        monkeypatch, capsys):
+    monkeypatch.setitem(krona.KRONA_CONFIG, 'resources', str(kronatools))
+    monkeypatch.setitem(krona.KRONA_CONFIG, 'embed', False)
+    html = write_krona_chart(report, tmp_path / "linked.html").read_text()
+    assert f'<script src="{kronatools.as_uri()}/src/krona-2.0.js">' in html
+
+    monkeypatch.setitem(krona.KRONA_CONFIG, 'resources', None)
+    monkeypatch.setattr(krona, 'find_kronatools', lambda: None)
+    html = write_krona_chart(report, tmp_path / "online.html").read_text()
+    assert '<script src="https://marbl.github.io/Krona/src/krona-2.0.js">' in html
+    assert "KronaTools not found" in capsys.readouterr().out
@@ -0,0 +1,133 @@
+import json
+import os
+import pytest
+from metagenomics.taxonomic_analysis import (DIAMOND_BLAST_FIELDS, LOCAL_BLAST_FIELDS, DiamondBlastBackend,
+                                             LocalBlastBackend, RemoteBlastBackend, get_blast_backend,
+                                             parse_tabular_hits, run_fasta_blast_taxonomy)
+
+# Stands in for blastn and diamond: logs its arguments, then hits every query once.
+# blastn also reports staxids (a merged entry), DIAMOND does not.
+FAKE_SEARCH = """#!/bin/sh
+echo "$(basename "$0") $*" >> "$SEARCH_LOG"
+[ -n "$SEARCH_FAIL" ] && exit 1
+extra=""
+[ "$(basename "$0")" = blastn ] && extra="\t562;83333"
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -query|-q) query="$2" ;;
+    -out|-o) out="$2" ;;
+  esac
+  shift
+done
+grep '^>' "$query" | sed 's/^>//' | while read name; do
+  printf "%s\tref|NP_1|\tDNA polymerase III [Escherichia coli]\t5000\t1e-50\t180.5\t98.0\t1\t50$extra\n" "$name"
+done > "$out"
+"""
+
+
+@pytest.fixture
+def searches(tmp_path, monkeypatch):
+    """Fake blastn and diamond on PATH; returns a function listing the command lines run so far"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for program in ('blastn', 'diamond'):
+        (bin_dir / program).write_text(FAKE_SEARCH)
+        (bin_dir / program).chmod(0o755)
+    log = tmp_path / "search.log"
+    log.touch()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('SEARCH_LOG', str(log))
+    return lambda: log.read_text().splitlines()
+
+
+@pytest.fixture
+def databases(tmp_path):
+    db_dir = tmp_path / "db"
+    db_dir.mkdir()
+    for suffix in ('nhr', 'nin', 'nsq'):
+        (db_dir / f"nt.{suffix}").touch()
+    (db_dir / "nr.dmnd").touch()
+    return db_dir
+
+
+def write_contigs(tmp_path, count):
+    fasta = tmp_path / "contigs.fasta"
+    fasta.write_text(''.join(f">contig{i}\n{base * 100}\n" for i, base in zip(range(count), 'ACGTACGTAC')))
+    return fasta
+
+
+def test_tabular_hits_map_back_to_their_queries(tmp_path):
+    batch = [('contig_a', 'A' * 200), ('contig_b', 'C' * 100)]
+    hits = tmp_path / "hits.tsv"
+    hits.write_text("q1\tref|NC_1|\tSalmonella enterica chromosome\t4000\t1e-30\t150.0\t97.5\t91\t10\t28901\n"
+                    "q0\tref|NC_2|\tplasmid pX [Escherichia coli]\t900\t0.0\t400.0\t100.0\t1\t100\t562;83333\n"
+                    "q0\tref|NC_3|\tuncultured bacterium\t900\t2e-5\t40.0\t80.0\t1\t50\tN/A\n"
+                    "other\tref|NC_4|\tnot one of ours\t1\t1\t1\t1\t1\t1\t1\n")
+    results = parse_tabular_hits(hits, batch, LOCAL_BLAST_FIELDS)
+
+    assert [r['query_id'] for r in results] == ['contig_a', 'contig_b']
+    first, second = results[0]['hits']
+    assert first['organism'] == 'Escherichia coli' and first['taxid'] == 562
+    assert first['query_cover'] == 50 and first['bit_score'] == 400.0
+    assert 'taxid' not in second
+    # Reverse-strand coordinates still cover 82 bases
+    [reverse] = results[1]['hits']
+    assert reverse['query_cover'] == 82 and reverse['taxid'] == 28901
+    assert reverse['organism'] == 'Salmonella enterica'
+
+
+def test_backends_by_name(databases):
+    assert isinstance(get_blast_backend('remote'), RemoteBlastBackend)
+    megablast = get_blast_backend('megablast', databases / "nt")
+    assert type(megablast) is LocalBlastBackend and megablast.task == 'megablast'
+    assert get_blast_backend('blastn', databases / "nt").task == 'blastn'
+    diamond = get_blast_backend('diamond', databases / "nr.dmnd")
+    assert isinstance(diamond, DiamondBlastBackend) and diamond.database_files() == [databases / "nr.dmnd"]
+    # Backends searching different databases never share cache entries
+    assert megablast.cache_key('ACGT') != diamond.cache_key('ACGT') != get_blast_backend('remote').cache_key('ACGT')
+    with pytest.raises(ValueError, match="Unknown BLAST backend"):
+        get_blast_backend('tblastx')
+
+
+def test_missing_program_or_database_is_reported(tmp_path, databases, searches, monkeypatch):
+    with pytest.raises(FileNotFoundError, match="database not found"):
+        LocalBlastBackend(tmp_path / "absent" / "nt").check()
+    LocalBlastBackend(databases / "nt").check()
+
+    monkeypatch.setenv('PATH', str(tmp_path / "empty"))
+    with pytest.raises(FileNotFoundError, match="diamond not found"):
+        DiamondBlastBackend(databases / "nr.dmnd").check()
+
+
+def test_local_search_covers_every_sequence_and_reuses_the_cache(tmp_path, databases, searches, monkeypatch):
+    monkeypatch.setattr(LocalBlastBackend, 'max_sequences', 2)
+    # contig4 repeats contig0's sequence, so it is answered from the entry cached a batch earlier
+    fasta = write_contigs(tmp_path, 5)
+
+    # Local backends do not sample down to max_sequences
+    results_file = run_fasta_blast_taxonomy(fasta, tmp_path, database=databases / "nt",
+                                            max_sequences=1, backend='megablast')
+    results = json.loads(results_file.read_text())
+    assert [r['query_id'] for r in results] == [f"contig{i}" for i in range(5)]
+    assert all(r['hits'][0]['taxid'] == 562 for r in results)
+
+    runs = searches()
+    assert len(runs) == 2
+    assert all(run.startswith("blastn -task megablast") and f"-db {databases / 'nt'}" in run for run in runs)
+
+    run_fasta_blast_taxonomy(fasta, tmp_path, database=databases / "nt", backend='megablast')
+    assert len(searches()) == 2
+
+
+def test_failed_diamond_search_is_reported_per_query_and_not_cached(tmp_path, databases, searches, monkeypatch):
+    fasta = write_contigs(tmp_path, 2)
+    monkeypatch.setenv('SEARCH_FAIL', '1')
+    results_file = run_fasta_blast_taxonomy(fasta, tmp_path, database=databases / "nr.dmnd", backend='diamond')
+    assert all('error' in r and r['hits'] == [] for r in json.loads(results_file.read_text()))
+
+    monkeypatch.delenv('SEARCH_FAIL')
+    results_file = run_fasta_blast_taxonomy(fasta, tmp_path, database=databases / "nr.dmnd", backend='diamond')
+    results = json.loads(results_file.read_text())
+    assert all('error' not in r and 'taxid' not in r['hits'][0] for r in results)
+    assert [run.split()[:2] for run in searches()] == [['diamond', 'blastx']] * 2
+    assert f"--outfmt 6 {' '.join(DIAMOND_BLAST_FIELDS)}" in searches()[-1]
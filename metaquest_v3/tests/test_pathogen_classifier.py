@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from metagenomics.pathogen_classifier import (NON_PATHOGENIC, PATHOGENIC, UNKNOWN, PathogenClassifier,
+                                              load_pathogen_taxids)
+from metagenomics.taxonomy import Taxonomy
+
+NODES = [
+    (1, 1, 'no rank'),
+    (2, 1, 'superkingdom'),
+    (543, 2, 'family'),
+    (561, 543, 'genus'),
+    (562, 561, 'species'),
+    (83333, 562, 'strain'),
+    (590, 543, 'genus'),
+    (28901, 590, 'species'),
+    (59201, 28901, 'subspecies'),
+    (1280, 2, 'species'),
+]
+
+
+@pytest.fixture
+def taxonomy(tmp_path):
+    with open(tmp_path / "nodes.dmp", 'w') as f:
+        for taxid, parent, rank in NODES:
+            f.write(f"{taxid}\t|\t{parent}\t|\t{rank}\t|\tXX\t|\n")
+    with open(tmp_path / "names.dmp", 'w') as f:
+        for taxid, _, _ in NODES:
+            f.write(f"{taxid}\t|\ttaxon {taxid}\t|\t\t|\tscientific name\t|\n")
+    # 46170 was merged into 1280
+    (tmp_path / "merged.dmp").write_text("46170\t|\t1280\t|\n")
+    return Taxonomy(tmp_path / "nodes.dmp", tmp_path / "names.dmp")
+
+
+def test_pathogen_list_skips_comments_and_reads_the_first_field(tmp_path):
+    path = tmp_path / "pathogens.txt"
+    path.write_text("# taxid\tname\n590\tSalmonella\n\n1280 Staphylococcus aureus\nnot-a-taxid\n")
+    assert load_pathogen_taxids(path).tolist() == [590, 1280]
+
+
+def test_without_taxonomy_only_listed_taxids_are_pathogens():
+    classifier = PathogenClassifier([590, 1280])
+    labels = classifier.classify([590, 28901, 1280, 0, -1, 10 ** 9])
+    assert labels.tolist() == [PATHOGENIC, NON_PATHOGENIC, PATHOGENIC, UNKNOWN, UNKNOWN, NON_PATHOGENIC]
+
+
+def test_flags_reach_every_taxon_under_a_listed_one(taxonomy):
+    classifier = PathogenClassifier([590, 83333], taxonomy)
+    assert classifier.is_pathogen([590, 28901, 59201, 83333, 562, 561, 1280]).tolist() == [
+        True, True, True, True, False, False, False]
+
+
+def test_merged_and_unknown_taxids(taxonomy):
+    # A merged taxid in the list flags its replacement, and a merged taxid queried is looked up there too
+    classifier = PathogenClassifier([46170], taxonomy)
+    labels = classifier.classify([1280, 46170, 562, 7, 0])
+    assert labels.tolist() == [PATHOGENIC, PATHOGENIC, NON_PATHOGENIC, UNKNOWN, UNKNOWN]
+
+
+def test_empty_list_and_missing_file(tmp_path, taxonomy, capsys):
+    classifier = PathogenClassifier(np.array([], dtype=np.int64), taxonomy)
+    assert classifier.classify([562, 0]).tolist() == [NON_PATHOGENIC, UNKNOWN]
+    assert PathogenClassifier.from_file(tmp_path / "absent.txt", taxonomy) is None
+    assert "not found" in capsys.readouterr().out
@@ -0,0 +1,124 @@
+import os
+import pytest
+from metagenomics import pathogen_analysis
+from metagenomics.hit_tables import parquet_path
+from metagenomics.pathogen_analysis import locate_gene_hits, run_protein_scan
+from metagenomics.utils import parse_prokka_gene_coordinates
+
+# Stands in for `diamond blastp -d DB -q QUERY -o OUTPUT ...`: logs its arguments and hits every query once
+FAKE_DIAMOND = """#!/bin/sh
+echo "$*" >> "$DIAMOND_LOG"
+[ -n "$DIAMOND_NO_HITS" ] && : > "$7" && exit 0
+grep '^>' "$5" | sed 's/^>//; s/ .*//' | awk '{print $1"\\tref_"NR"\\t95.0\\t300\\t1e-50\\t500.0\\tprotein "NR}' > "$7"
+"""
+
+GFF = """##gff-version 3
+##sequence-region contig_1 1 5000
+contig_1\tProdigal:002006\tCDS\t100\t999\t.\t+\t0\tID=SAMPLE_00001;locus_tag=SAMPLE_00001;product=TEM-1
+contig_1\tProdigal:002006\tgene\t1200\t1800\t.\t-\t.\tID=SAMPLE_00002_gene
+contig_1\tProdigal:002006\tCDS\t1200\t1800\t.\t-\t0\tID=SAMPLE_00002;locus_tag=SAMPLE_00002
+contig_2\tProdigal:002006\tCDS\t5\t400\t.\t+\t0\tID=SAMPLE_00003;product=hypothetical protein
+##FASTA
+>contig_1
+ACGT\tnot\ta\tfeature\tline\t1\t2\t.\tlocus_tag=bogus
+"""
+
+
+@pytest.fixture
+def diamond_runs(tmp_path, monkeypatch):
+    """Fake diamond on PATH; returns a function listing the arguments of each run so far"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "diamond").write_text(FAKE_DIAMOND)
+    (bin_dir / "diamond").chmod(0o755)
+    log = tmp_path / "diamond.log"
+    log.touch()
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('DIAMOND_LOG', str(log))
+    return lambda: log.read_text().splitlines()
+
+
+@pytest.fixture
+def prokka_dir(tmp_path):
+    prokka = tmp_path / "prokka"
+    prokka.mkdir()
+    (prokka / "sample.faa").write_text(''.join(f">SAMPLE_0000{i} hypothetical protein\nMKLVAAG\n"
+                                               for i in (1, 2, 3)))
+    (prokka / "sample.gff").write_text(GFF)
+    return prokka
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    output = tmp_path / "results"
+    output.mkdir()
+    return output
+
+
+def test_gene_coordinates_come_from_cds_features_before_the_fasta_section(prokka_dir):
+    assert parse_prokka_gene_coordinates(prokka_dir / "sample.gff") == {
+        'SAMPLE_00001': ('contig_1', 100, 999, '+'),
+        'SAMPLE_00002': ('contig_1', 1200, 1800, '-'),
+        # Without a locus_tag the ID is used
+        'SAMPLE_00003': ('contig_2', 5, 400, '+'),
+    }
+
+
+def test_amr_scan_runs_blastp_on_the_predicted_proteins(tmp_path, prokka_dir, output_dir, diamond_runs,
+                                                        monkeypatch):
+    card = tmp_path / "card"
+    monkeypatch.setattr(pathogen_analysis, 'ensure_diamond_index', lambda fasta, name: card)
+
+    hits = run_protein_scan(prokka_dir, output_dir, 'amr')
+
+    assert hits == output_dir / "amr_hits.txt" and parquet_path(hits).exists()
+    [run] = diamond_runs()
+    assert run.startswith(f"blastp -d {card} -q {prokka_dir / 'sample.faa'}") and "--top 5" in run
+    # Locus tags are the query IDs
+    assert [line.split('\t')[0] for line in hits.read_text().splitlines()] == [
+        'SAMPLE_00001', 'SAMPLE_00002', 'SAMPLE_00003']
+
+
+def test_pathogen_scan_without_hits_writes_the_placeholder(tmp_path, prokka_dir, output_dir, diamond_runs,
+                                                           monkeypatch, capsys):
+    monkeypatch.setattr(pathogen_analysis, 'CAT_DB', tmp_path / "absent.dmnd")
+    assert run_protein_scan(prokka_dir, output_dir, 'pathogen') is None
+    assert "Pathogen database not found" in capsys.readouterr().out
+
+    cat_db = tmp_path / "cat_database.dmnd"
+    cat_db.touch()
+    monkeypatch.setattr(pathogen_analysis, 'CAT_DB', cat_db)
+    monkeypatch.setenv('DIAMOND_NO_HITS', '1')
+    hits = run_protein_scan(prokka_dir, output_dir, 'pathogen')
+    assert hits.read_text() == "# No pathogen hits found\n"
+    assert diamond_runs()[0].startswith(f"blastp -d {tmp_path / 'cat_database'} ")
+
+
+def test_sample_without_predicted_proteins_is_skipped(prokka_dir, output_dir, diamond_runs):
+    (prokka_dir / "sample.faa").write_text("")
+    assert run_protein_scan(prokka_dir, output_dir, 'vf') is None
+    assert diamond_runs() == []
+
+
+def test_hits_are_joined_to_their_gene_locations(prokka_dir, output_dir, tmp_path):
+    amr = tmp_path / "amr_hits.txt"
+    amr.write_text("SAMPLE_00002\tARO_3000873\t99.1\t286\t1e-150\t560.0\tTEM-1 [Escherichia coli]\n"
+                   "SAMPLE_00099\tARO_1\t80.0\t100\t1e-20\t90.0\tunplaced gene\n"
+                   "truncated\trow\n")
+    pathogen = tmp_path / "pathogen_blast_results.txt"
+    pathogen.write_text("# No pathogen hits found\n")
+
+    located = locate_gene_hits(prokka_dir, {'pathogen': pathogen, 'amr': amr, 'vf': None}, output_dir)
+
+    assert located.read_text().splitlines() == [
+        "source\tgene\tcontig\tstart\tend\tstrand\tsseqid\tpident\tevalue\tbitscore\tstitle",
+        "amr\tSAMPLE_00002\tcontig_1\t1200\t1800\t-\tARO_3000873\t99.1\t1e-150\t560.0\tTEM-1 [Escherichia coli]",
+        # A gene missing from the GFF keeps its hit with an empty location
+        "amr\tSAMPLE_00099\t\t\t\t\tARO_1\t80.0\t1e-20\t90.0\tunplaced gene",
+    ]
+
+
+def test_missing_gff_is_reported(prokka_dir, output_dir, capsys):
+    (prokka_dir / "sample.gff").unlink()
+    assert locate_gene_hits(prokka_dir, {'amr': None}, output_dir) is None
+    assert "cannot locate gene hits" in capsys.readouterr().out
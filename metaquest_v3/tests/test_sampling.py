@@ -0,0 +1,59 @@
+from collections import Counter
+import pytest
+from metagenomics.utils import iter_fasta, sample_sequences
+
+
+def contigs(lengths):
+    """A generator, like iter_fasta: the sampler sees each record once"""
+    return ((f"contig{i}", 'A' * length) for i, length in enumerate(lengths))
+
+
+def names(sample):
+    return [name for name, _ in sample]
+
+
+def test_head_keeps_the_first_records_and_counts_them_all():
+    sample, seen = sample_sequences(contigs([100] * 10), 3, 'head')
+    assert names(sample) == ['contig0', 'contig1', 'contig2'] and seen == 10
+
+
+@pytest.mark.parametrize("method", ['head', 'reservoir', 'length'])
+def test_short_input_is_returned_whole_in_input_order(method):
+    sample, seen = sample_sequences(contigs([100, 5000, 300]), 10, method)
+    assert names(sample) == ['contig0', 'contig1', 'contig2'] and seen == 3
+
+
+def test_reservoir_is_reproducible_ordered_and_uniform():
+    first, seen = sample_sequences(contigs([100] * 20), 5, 'reservoir', seed=1)
+    again, _ = sample_sequences(contigs([100] * 20), 5, 'reservoir', seed=1)
+    assert first == again and seen == 20 and len(first) == 5
+    assert names(first) == sorted(names(first), key=lambda name: int(name[6:]))
+
+    picks = Counter()
+    for seed in range(2000):
+        picks.update(names(sample_sequences(contigs([100] * 20), 5, 'reservoir', seed=seed)[0]))
+    # Every record is kept with probability 5/20: ~500 times each
+    assert len(picks) == 20 and all(400 < count < 600 for count in picks.values())
+
+
+def test_length_sampling_represents_each_length_class_in_proportion():
+    # 90 short contigs then 10 long ones: a head sample would miss every long contig
+    lengths = [100] * 90 + [5000] * 10
+    sample, seen = sample_sequences(contigs(lengths), 10, 'length', seed=3)
+    assert seen == 100
+    assert Counter(len(sequence) for _, sequence in sample) == {100: 9, 5000: 1}
+
+    # 3 picks over classes of 5, 3 and 2 records are 1.5, 0.9 and 0.6: the largest remainders round up
+    sample, _ = sample_sequences(contigs([100] * 5 + [1000] * 3 + [5000] * 2), 3, 'length')
+    assert sorted(len(sequence) for _, sequence in sample) == [100, 1000, 5000]
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError, match="Unknown sampling method"):
+        sample_sequences(contigs([100]), 1, 'random')
+
+
+def test_fasta_is_streamed_without_short_sequences(tmp_path):
+    fasta = tmp_path / "contigs.fasta"
+    fasta.write_text(">c1 len=60\nACGTACGTAC\nACGTACGTAC\n>c2\nAC\n>c3\n" + "G" * 30 + "\n")
+    assert list(iter_fasta(fasta, min_length=20)) == [('c1', 'ACGTACGTAC' * 2), ('c3', 'G' * 30)]
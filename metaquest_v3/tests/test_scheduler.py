@@ -0,0 +1,120 @@
+import threading
+import time
+from metagenomics.scheduler import StageScheduler
+from metagenomics.resources import ResourceBudget, MIN_STAGE_MEMORY, current_allocation, stage_threads
+
+
+def test_stages_run_after_their_requirements_and_receive_their_results():
+    order = []
+    lock = threading.Lock()
+
+    def stage(name, value):
+        def run(*args):
+            with lock:
+                order.append(name)
+            return value + sum(args)
+        return run
+
+    scheduler = StageScheduler()
+    scheduler.add('reads', stage('reads', 1))
+    scheduler.add('kraken', stage('kraken', 10), requires=['reads'])
+    scheduler.add('prokka', stage('prokka', 100), requires=['reads'])
+    scheduler.add('report', stage('report', 1000), requires=['kraken', 'prokka'])
+    results = scheduler.run()
+
+    assert results == {'reads': 1, 'kraken': 11, 'prokka': 101, 'report': 1112}
+    assert order[0] == 'reads' and order[-1] == 'report'
+
+
+def test_independent_stages_run_concurrently():
+    both_started = threading.Barrier(2, timeout=5)
+    scheduler = StageScheduler()
+    scheduler.add('amr_scan', both_started.wait)
+    scheduler.add('vf_scan', both_started.wait)
+    # Run one at a time, the barrier would time out and both stages fail
+    assert set(scheduler.run()) == {'amr_scan', 'vf_scan'}
+
+
+def test_failure_skips_downstream_stages_only():
+    finished = []
+
+    def fail():
+        raise RuntimeError("kraken2 not found")
+
+    scheduler = StageScheduler(on_finish=finished.append)
+    scheduler.add('kraken', fail)
+    scheduler.add('bracken', lambda _: 'bracken', requires=['kraken'])
+    scheduler.add('plots', lambda _: 'plots', requires=['bracken'])
+    scheduler.add('prokka', lambda: 'prokka')
+    results = scheduler.run()
+
+    assert results == {'prokka': 'prokka'}
+    assert sorted(finished) == ['bracken', 'kraken', 'plots', 'prokka']
+
+
+def test_late_cpu_bound_stage_gets_a_fair_share_of_the_budget():
+    """Prokka, ready just after the three scans, must not be left with the scraps"""
+    budget = ResourceBudget(cpus=32, memory=64 * 1024 ** 3)
+    threads = {}
+    swissprot_done = threading.Event()
+
+    def scan(name):
+        def run(_):
+            threads[name] = stage_threads()
+            swissprot_done.wait(5)
+            return name
+        return run
+
+    def tool(name):
+        def run(_):
+            threads[name] = stage_threads()
+            if name == 'swissprot':
+                swissprot_done.set()
+            return name
+        return run
+
+    scheduler = StageScheduler(resources=budget)
+    scheduler.add('input_fasta', lambda: 'contigs.fasta')
+    for name in ('pathogen_scan', 'amr_scan', 'vf_scan'):
+        scheduler.add(name, scan(name), requires=['input_fasta'], cpu_bound=True)
+    scheduler.add('fasta_conversion', lambda _: time.sleep(0.05) or 'converted', requires=['input_fasta'])
+    scheduler.add('prokka', tool('prokka'), requires=['fasta_conversion'], cpu_bound=True)
+    scheduler.add('swissprot', tool('swissprot'), requires=['prokka'], cpu_bound=True)
+    scheduler.run()
+
+    # Scans share with each other, Prokka and SwissProt; Prokka with the scans only
+    assert [threads[name] for name in ('pathogen_scan', 'amr_scan', 'vf_scan')] == [6, 6, 6]
+    assert threads['prokka'] == 8
+    assert threads['swissprot'] == 8
+
+
+def test_stages_wait_when_the_budget_is_used_up():
+    budget = ResourceBudget(cpus=2, memory=2 * MIN_STAGE_MEMORY)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def stage():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return current_allocation().memory
+
+    scheduler = StageScheduler(resources=budget)
+    for name in ('a', 'b', 'c'):
+        scheduler.add(name, stage, cpu_bound=True)
+    results = scheduler.run()
+
+    assert sorted(results) == ['a', 'b', 'c']
+    assert max(peak) == 2
+    # The two that ran together split the budget; the one that waited ran alone
+    assert sorted(results.values()) == [MIN_STAGE_MEMORY, MIN_STAGE_MEMORY, 2 * MIN_STAGE_MEMORY]
+
+
+def test_stages_outside_the_cpu_budget_see_the_run_budget_not_the_host():
+    scheduler = StageScheduler(resources=ResourceBudget(cpus=3, memory=2 * MIN_STAGE_MEMORY))
+    scheduler.add('plots', stage_threads)
+    assert scheduler.run() == {'plots': 3}
@@ -0,0 +1,30 @@
+from metagenomics import pathogen_analysis
+
+
+def test_combined_screening_keeps_card_and_vfdb_hits_next_to_dense_cat_match(tmp_path, monkeypatch):
+    sources = {}
+    for name in ('CAT_FASTA_SOURCE', 'CARD_PROTEIN_DB', 'VFDB_DB'):
+        sources[name] = tmp_path / f"{name}.faa"
+        sources[name].write_text(">x\nM\n")
+        monkeypatch.setattr(pathogen_analysis, name, sources[name])
+    monkeypatch.setattr(pathogen_analysis, 'ensure_combined_screening_index', lambda _: tmp_path / "combined")
+    commands = []
+
+    def fake_diamond(cmd, **kwargs):
+        commands.append(cmd)
+        out = cmd.split(' -o ')[1].split()[0]
+        with open(out, 'w') as f:
+            # 300 strong CAT hits would fill a 250-hit cap on their own
+            for i in range(300):
+                f.write(f"contig1\tpathogen|P{i}\t99.0\t300\t1e-100\t{600 - i * 0.01:.2f}\tpathogen|pathogen protein {i}\n")
+            f.write("contig1\tamr|ARO_1\t80.0\t250\t1e-40\t150.0\tamr|beta-lactamase\n")
+            f.write("contig1\tvf|VF_1\t70.0\t200\t1e-30\t120.0\tvf|adhesin\n")
+
+    monkeypatch.setattr(pathogen_analysis.subprocess, 'run', fake_diamond)
+    pathogen, amr, vf = pathogen_analysis.run_combined_screening(tmp_path / "contigs.fasta", tmp_path)
+
+    assert '--max-target-seqs 0 ' in commands[0]
+    assert amr.read_text().split('\t')[1] == 'ARO_1'
+    assert vf.read_text().split('\t')[1] == 'VF_1'
+    # CAT keeps its own --top 3 window relative to its best hit
+    assert all(line.split('\t')[1].startswith('P') for line in pathogen.read_text().splitlines())
@@ -0,0 +1,71 @@
+from metagenomics.scheduler import StageScheduler
+from metagenomics.stage_cache import StageCache
+
+
+def _pipeline(output_dir, reads, calls, evalue=1e-5, **cache_options):
+    """reads -> kraken -> bracken, with the first two stages writing files"""
+    def kraken():
+        calls.append('kraken')
+        out = output_dir / "kraken_report.txt"
+        out.write_text(reads.read_text().upper())
+        return out
+
+    def bracken(report):
+        calls.append('bracken')
+        out = output_dir / "bracken_report.tsv"
+        out.write_text(report.read_text()[::-1])
+        return out
+
+    scheduler = StageScheduler(cache=StageCache(output_dir, **cache_options))
+    scheduler.add('kraken', kraken, cached=True, inputs=[reads], params={'evalue': evalue})
+    scheduler.add('bracken', bracken, requires=['kraken'], cached=True)
+    return scheduler.run()
+
+
+def test_rerun_reuses_unchanged_stages(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("acgt")
+    calls = []
+    first = _pipeline(tmp_path, reads, calls)
+    second = _pipeline(tmp_path, reads, calls)
+
+    assert calls == ['kraken', 'bracken']
+    assert second == first
+
+
+def test_changed_input_invalidates_the_stage_and_everything_downstream(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("acgt")
+    calls = []
+    _pipeline(tmp_path, reads, calls)
+    reads.write_text("ttga")
+    _pipeline(tmp_path, reads, calls)
+
+    assert calls == ['kraken', 'bracken'] * 2
+    assert (tmp_path / "bracken_report.tsv").read_text() == "AGTT"
+
+
+def test_changed_params_or_output_force_a_rerun(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("acgt")
+    calls = []
+    _pipeline(tmp_path, reads, calls)
+    _pipeline(tmp_path, reads, calls, evalue=1e-3)
+    assert calls == ['kraken', 'bracken'] * 2
+
+    # Editing a recorded output reruns that stage only; its upstream is intact
+    (tmp_path / "bracken_report.tsv").write_text("edited")
+    _pipeline(tmp_path, reads, calls, evalue=1e-3)
+    assert calls[4:] == ['bracken']
+
+
+def test_forced_rerun_runs_every_stage_and_records_it_again(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("acgt")
+    calls = []
+    _pipeline(tmp_path, reads, calls)
+    _pipeline(tmp_path, reads, calls, reuse=False)
+    assert calls == ['kraken', 'bracken'] * 2
+
+    _pipeline(tmp_path, reads, calls)
+    assert calls == ['kraken', 'bracken'] * 2
@@ -0,0 +1,100 @@
+from collections import Counter
+import numpy as np
+import pytest
+from metagenomics.taxonomy import Taxonomy, group_lca
+from metagenomics.taxonomic_analysis import assign_blast_lca, create_hit_comparison_data
+
+NODES = [
+    (1, 1, 'no rank', 'root'),
+    (2, 1, 'superkingdom', 'Bacteria'),
+    (1224, 2, 'phylum', 'Pseudomonadota'),
+    (543, 1224, 'family', 'Enterobacteriaceae'),
+    (561, 543, 'genus', 'Escherichia'),
+    (562, 561, 'species', 'Escherichia coli'),
+    (83333, 562, 'strain', 'Escherichia coli K-12'),
+    (590, 543, 'genus', 'Salmonella'),
+    (28901, 590, 'species', 'Salmonella enterica'),
+    (1239, 2, 'phylum', 'Bacillota'),
+    (1280, 1239, 'species', 'Staphylococcus aureus'),
+]
+
+
+@pytest.fixture
+def taxonomy(tmp_path):
+    with open(tmp_path / "nodes.dmp", 'w') as f:
+        for taxid, parent, rank, _ in NODES:
+            f.write(f"{taxid}\t|\t{parent}\t|\t{rank}\t|\tXX\t|\n")
+    with open(tmp_path / "names.dmp", 'w') as f:
+        for taxid, _, _, name in NODES:
+            f.write(f"{taxid}\t|\t{name}\t|\t\t|\tscientific name\t|\n")
+            f.write(f"{taxid}\t|\t{name} (synonym)\t|\t\t|\tsynonym\t|\n")
+    (tmp_path / "merged.dmp").write_text("99999\t|\t562\t|\n")
+    return Taxonomy(tmp_path / "nodes.dmp", tmp_path / "names.dmp")
+
+
+def test_taxonomy_lookups(taxonomy):
+    assert taxonomy.index([562, 99999, 7, 0, 10 ** 9]).tolist() == [562, 562, -1, -1, -1]
+    assert taxonomy.find('Salmonella enterica') == 28901
+    assert taxonomy.find('Salmonella enterica (synonym)') == -1
+    assert taxonomy.lineage(83333) == [1, 2, 1224, 543, 561, 562, 83333]
+    assert taxonomy.rollup([83333, 28901, 1280], 'genus').tolist() == [561, 590, 0]
+    assert [taxonomy.rank_code(node) for node in (1, 562, 83333)] == ['R', 'S', 'S1']
+
+
+def test_pairwise_and_group_lca(taxonomy):
+    assert taxonomy.lca([83333, 562, 562], [28901, 561, 1280]).tolist() == [543, 561, 2]
+
+    groups = np.array([3, 1, 3, 1, 1, 2, 4, 4])
+    nodes = np.array([1280, 562, 28901, 83333, 561, 590, 562, -1])
+    queries, lca = group_lca(taxonomy, groups, nodes)
+    assert queries.tolist() == [1, 2, 3, 4]
+    # A member outside the taxonomy (-1) leaves its group unplaced
+    assert lca.tolist() == [561, 590, 2, -1]
+
+
+def hit(organism, bit_score, hit_id='', taxid=None):
+    result = {'hit_id': hit_id, 'organism': organism, 'bit_score': bit_score}
+    if taxid is not None:
+        result['taxid'] = taxid
+    return result
+
+
+def test_blast_queries_go_to_the_lca_of_their_top_hits(taxonomy):
+    class Index:
+        def lookup(self, seqids):
+            return np.array([28901 if seqid == 'NZ_CP000001.1' else 0 for seqid in seqids], dtype=np.uint32)
+
+    results = [
+        # E. coli and Salmonella within 10% of the best bitscore; the weak S. aureus hit is ignored
+        {'query_id': 'contig1', 'hits': [hit('Escherichia coli', 200), hit('Unnamed', 190, 'NZ_CP000001.1'),
+                                         hit('Staphylococcus aureus', 100)]},
+        # Reported taxid first, then the genus and species of a strain-level name
+        {'query_id': 'contig2', 'hits': [hit('whatever', 300, taxid=83333),
+                                         hit('Escherichia coli O157:H7 str. Sakai', 295)]},
+        {'query_id': 'contig3', 'hits': [hit('Uncultured bacterium', 50)]},
+        {'query_id': 'contig4', 'hits': [], 'error': 'timeout'},
+    ]
+    assigned = assign_blast_lca(results, taxonomy, Index(), top_percent=10)
+
+    assert assigned['query_id'].tolist() == ['contig1', 'contig2', 'contig3']
+    assert assigned['taxid'].tolist() == [543, 562, 0]
+    assert assigned['name'].tolist() == ['Enterobacteriaceae', 'Escherichia coli', 'Uncultured bacterium']
+    assert assigned['hits'].tolist() == [3, 2, 1]
+
+
+def test_without_taxonomy_queries_keep_their_best_hit(taxonomy):
+    results = [{'query_id': 'contig1', 'hits': [hit('Salmonella enterica', 10), hit('Escherichia coli', 20)]}]
+    assigned = assign_blast_lca(results, None)
+    assert assigned[['taxid', 'name']].values.tolist() == [[0, 'Escherichia coli']]
+
+
+def test_organisms_are_compared_by_assigned_sequences_not_raw_hits(tmp_path):
+    # One E. coli contig with 50 hits against three S. aureus contigs with one hit each
+    hits = Counter({'Escherichia coli': 50, 'Staphylococcus aureus': 3, 'Salmonella enterica': 3})
+    sequences = {'Escherichia coli': {'c1'}, 'Staphylococcus aureus': {'c2', 'c3', 'c4'},
+                 'Salmonella enterica': {'c5'}}
+    data = create_hit_comparison_data(hits, sequences, tmp_path)
+
+    assert [row['organism'] for row in data] == ['Staphylococcus aureus', 'Escherichia coli', 'Salmonella enterica']
+    assert data[0]['sequences_with_hits'] == 3 and data[0]['avg_hits_per_sequence'] == 1
+    assert (tmp_path / "organism_comparison_data.csv").read_text().splitlines()[1].startswith('Staphylococcus aureus,3,3')